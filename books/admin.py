@@ -1,8 +1,17 @@
+import json
+
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 
-from .models import Author, Book, UserFavoriteBook, Feedback, ToBeReadBook, UserReadBook
+from .models import (
+    Author, Book, UserFavoriteBook, Feedback, ToBeReadBook, UserReadBook, GuestUsernamePool, GuestAccount, ProfileRun,
+)
 
 @admin.register(Author)
 class AuthorAdmin(admin.ModelAdmin):
@@ -39,6 +48,76 @@ class FeedbackAdmin(admin.ModelAdmin):
     list_filter = ('rating', 'created_at')
 
 
+@admin.register(GuestUsernamePool)
+class GuestUsernamePoolAdmin(admin.ModelAdmin):
+    list_display = ('username', 'created_at')
+    search_fields = ('username',)
+
+
+@admin.register(GuestAccount)
+class GuestAccountAdmin(admin.ModelAdmin):
+    list_display = ('user', 'created_at', 'last_active_at')
+    list_filter = ('last_active_at',)
+
+
+@admin.register(ProfileRun)
+class ProfileRunAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'user', 'truncated', 'downloads')
+    list_filter = ('created_at', 'truncated')
+    search_fields = ('path',)
+    list_select_related = ('user',)
+    exclude = ('profile', 'sql_log')
+    readonly_fields = (
+        'created_at', 'user', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'truncated',
+        'downloads', 'summary', 'sql_log_display',
+    )
+
+    def get_queryset(self, request):
+        # The profile and SQL log can be megabytes each; only load them when downloaded or viewed
+        return super().get_queryset(request).defer('profile', 'summary', 'sql_log').annotate(
+            has_profile=ExpressionWrapper(Q(profile__isnull=False), output_field=BooleanField()),
+        )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/profile/', self.admin_site.admin_view(self.download_profile), name='books_profilerun_profile'),
+            path('<int:pk>/sql/', self.admin_site.admin_view(self.download_sql), name='books_profilerun_sql'),
+        ] + super().get_urls()
+
+    @admin.display(description='Download')
+    def downloads(self, obj):
+        sql_url = reverse('admin:books_profilerun_sql', args=[obj.pk])
+        if not obj.has_profile:
+            return format_html('<a href="{}">sql</a>', sql_url)
+        return format_html(
+            '<a href="{}">.prof</a> | <a href="{}">sql</a>', reverse('admin:books_profilerun_profile', args=[obj.pk]), sql_url,
+        )
+
+    @admin.display(description='SQL log')
+    def sql_log_display(self, obj):
+        return format_html('<pre>{}</pre>', '\n'.join(f"{entry['ms']:>8}ms  {entry['sql']}" for entry in obj.sql_log))
+
+    def download_profile(self, request, pk):
+        run = get_object_or_404(ProfileRun, pk=pk)
+        if run.profile is None:
+            raise Http404("Profile was over PROFILE_MAX_BYTES; only the summary was kept")
+        response = HttpResponse(bytes(run.profile), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{run.pk}.prof"'
+        return response
+
+    def download_sql(self, request, pk):
+        run = get_object_or_404(ProfileRun, pk=pk)
+        response = HttpResponse(json.dumps(run.sql_log, indent=2), content_type='application/json')
+        response['Content-Disposition'] = f'attachment; filename="profile-{run.pk}-sql.json"'
+        return response
+
+
 # Show user creation date in the Users admin list
 admin.site.unregister(User)
 
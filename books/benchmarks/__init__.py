@@ -0,0 +1,20 @@
+"""
+Performance benchmarks for the hot paths: the recommendations page (for each
+scoring strategy), autocomplete, saving favorites, guest merge and the weekly
+digest email fan-out.
+
+Generate a dataset with `manage.py generate_synthetic_data`, then run
+`manage.py run_benchmarks --output=results.json`. Pass `--compare=old.json` to
+diff two runs, e.g. from different commits. Benchmarks never call Google Books
+(see books.benchmarks.stubs) or send email, and roll back every write.
+
+`manage.py loadtest` drives the app over HTTP with concurrent virtual users
+(books.benchmarks.loadtest) against a local Google Books stand-in
+(books.benchmarks.google_books_server), for sizing workers.
+
+Known hotspot: the email fan-out. On the 2,000-reader dataset the most-followed
+reader has about 1,400 followers, and weekly_digest renders and sends one email to
+each (seconds per run). favorite_save includes it (a 4.2s median and a 27s worst run
+there) unless RECOMMENDATION_EMAILS_DEFERRED moves it to send_recommendation_emails
+(see books.recommendation_emails); compare both settings when changing either path.
+"""
@@ -0,0 +1,81 @@
+"""
+A local HTTP stand-in for the Google Books volumes API, for load tests.
+
+Serves the same deterministic volumes as StubGoogleBooksSession, after a tunable
+latency, and answers a tunable share of requests with 429 Too Many Requests. Point
+the app at it with GOOGLE_BOOKS_API_URL=<server.url>.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .stubs import stub_volumes
+
+VOLUMES_PATH = '/books/v1/volumes'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        if url.path != VOLUMES_PATH:
+            self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+            return
+        with server.lock:
+            server.requests += 1
+            # Latency varies by up to +/-25% around the configured value
+            delay = server.latency_ms * server.random.uniform(0.75, 1.25) / 1000
+            rate_limited = server.random.random() < server.rate_limited_ratio
+        time.sleep(delay)
+        if rate_limited:
+            with server.lock:
+                server.rate_limited += 1
+            self._send(429, {'error': {'code': 429, 'message': 'Rate Limit Exceeded'}})
+            return
+        params = parse_qs(url.query)
+        query = params.get('q', [''])[0]
+        max_results = int(params.get('maxResults', ['10'])[0])
+        self._send(200, stub_volumes(query, min(max_results, 40)))
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GoogleBooksStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency_ms=200, rate_limited_ratio=0.0, seed=None):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency_ms = latency_ms
+        self.rate_limited_ratio = rate_limited_ratio
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{VOLUMES_PATH}'
+
+    def start(self):
+        """Serve from a background thread; returns self."""
+        self._thread = threading.Thread(target=self.serve_forever, name='google-books-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
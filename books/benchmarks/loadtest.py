@@ -0,0 +1,250 @@
+"""
+Closed-loop HTTP load test: virtual users replay a weighted mix of scenarios.
+
+Each virtual user is a thread with its own cookie session. It repeatedly picks a
+scenario by weight, runs its requests one after another, then waits a think time.
+Because a user only starts its next request after the previous one completes,
+throughput is what the server sustains at that concurrency.
+
+Scenarios:
+  homepage         anonymous GET /
+  autocomplete     one keystroke sequence: /api/search/?term= for 3, 4, ... characters
+  add_favorite     a guest adds a book (GET the form, POST it)
+  recommendations  the guest's recommendations page (adds a favorite first if needed)
+  book_info        /api/book-info/ for a catalog book (Google Books details)
+
+server_memory() reports per-process memory of a local server, to measure what a
+worker costs (GUNICORN_WORKER_MEMORY_MB in gunicorn.conf.py).
+"""
+import math
+import random
+import threading
+import time
+from urllib.parse import urljoin
+
+import requests
+
+SCENARIO_NAMES = ('homepage', 'autocomplete', 'add_favorite', 'recommendations', 'book_info')
+DEFAULT_MIX = {'homepage': 30, 'autocomplete': 30, 'add_favorite': 10, 'recommendations': 20, 'book_info': 10}
+# Autocomplete fires from the third character; a sequence stops after this many
+MAX_KEYSTROKES = 8
+REQUEST_TIMEOUT = 60
+
+FALLBACK_CATALOG = [
+    ('Piranesi', 'Susanna Clarke'),
+    ('The Remains of the Day', 'Kazuo Ishiguro'),
+    ('Middlemarch', 'George Eliot'),
+    ('The Left Hand of Darkness', 'Ursula K. Le Guin'),
+    ('Beloved', 'Toni Morrison'),
+]
+
+
+def parse_mix(value):
+    """'homepage=30,autocomplete=70' -> {'homepage': 30, 'autocomplete': 70}"""
+    mix = {}
+    for part in filter(None, (part.strip() for part in value.split(','))):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIO_NAMES:
+            raise ValueError(f"Unknown scenario '{name}' (choose from {', '.join(SCENARIO_NAMES)})")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise ValueError(f"Weight for '{name}' must be a number")
+        if mix[name] < 0:
+            raise ValueError(f"Weight for '{name}' must not be negative")
+    if not any(mix.values()):
+        raise ValueError('At least one scenario needs a positive weight')
+    return mix
+
+
+def load_catalog(limit=200):
+    """(title, author) pairs of the most favorited books, for searches and adds."""
+    from books.models import Book
+
+    catalog = list(Book.objects.order_by('-favorite_count', 'id').values_list('title', 'author__name')[:limit])
+    return catalog or FALLBACK_CATALOG
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """Latency samples and errors per scenario, shared by every virtual user."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+
+    def record(self, scenario, seconds, status):
+        # status is an HTTP status code, or an exception class name when the request failed
+        with self.lock:
+            self.latencies.setdefault(scenario, []).append(seconds * 1000)
+            key = str(status)
+            self.statuses.setdefault(scenario, {}).setdefault(key, 0)
+            self.statuses[scenario][key] += 1
+            if not isinstance(status, int) or status >= 400:
+                self.errors[scenario] = self.errors.get(scenario, 0) + 1
+
+    def summary(self, elapsed):
+        def row(latencies, errors, statuses):
+            values = sorted(latencies)
+            return {
+                'requests': len(values),
+                'errors': errors,
+                'error_rate': round(errors / len(values), 4) if values else 0.0,
+                'throughput_rps': round(len(values) / elapsed, 2) if elapsed else 0.0,
+                'p50_ms': round(percentile(values, 50), 1) if values else None,
+                'p95_ms': round(percentile(values, 95), 1) if values else None,
+                'p99_ms': round(percentile(values, 99), 1) if values else None,
+                'statuses': statuses,
+            }
+
+        with self.lock:
+            scenarios = {
+                name: row(self.latencies[name], self.errors.get(name, 0), self.statuses[name])
+                for name in sorted(self.latencies)
+            }
+            all_statuses = {}
+            for statuses in self.statuses.values():
+                for key, count in statuses.items():
+                    all_statuses[key] = all_statuses.get(key, 0) + count
+            total = row(
+                [value for values in self.latencies.values() for value in values],
+                sum(self.errors.values()),
+                all_statuses,
+            )
+        return {'elapsed_s': round(elapsed, 2), 'scenarios': scenarios, 'total': total}
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, index, base_url, mix, catalog, recorder, deadline, think_time_ms, seed):
+        super().__init__(name=f'virtual-user-{index}', daemon=True)
+        self.base_url = base_url
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.catalog = catalog
+        self.recorder = recorder
+        self.deadline = deadline
+        self.think_time_ms = think_time_ms
+        self.random = random.Random(seed)
+        self.session = requests.Session()
+        self.has_favorites = False
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            scenario = self.random.choices(self.names, self.weights)[0]
+            getattr(self, f'scenario_{scenario}')()
+            if self.think_time_ms:
+                # Exponential think times, so users don't fall into lockstep
+                time.sleep(self.random.expovariate(1000 / self.think_time_ms))
+        self.session.close()
+
+    def request(self, scenario, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, urljoin(self.base_url, path), timeout=REQUEST_TIMEOUT, allow_redirects=False, **kwargs,
+            )
+        except requests.RequestException as e:
+            self.recorder.record(scenario, time.perf_counter() - started, type(e).__name__)
+            return None
+        self.recorder.record(scenario, time.perf_counter() - started, response.status_code)
+        return response
+
+    def book(self):
+        return self.random.choice(self.catalog)
+
+    def scenario_homepage(self):
+        self.request('homepage', 'GET', '/')
+
+    def scenario_autocomplete(self):
+        title, _author = self.book()
+        for length in range(3, min(len(title), 2 + MAX_KEYSTROKES) + 1):
+            self.request('autocomplete', 'GET', '/api/search/', params={'term': title[:length]})
+
+    def scenario_add_favorite(self):
+        form = self.request('add_favorite', 'GET', '/add-favorite/')
+        if form is None:
+            return
+        title, author = self.book()
+        token = self.session.cookies.get('csrftoken', '')
+        response = self.request(
+            'add_favorite', 'POST', '/add-favorite/save/',
+            data={'title': title, 'author': author, 'csrfmiddlewaretoken': token},
+            headers={'X-CSRFToken': token, 'Referer': urljoin(self.base_url, '/add-favorite/')},
+        )
+        if response is not None and response.status_code < 400:
+            self.has_favorites = True
+
+    def scenario_recommendations(self):
+        if not self.has_favorites:
+            self.scenario_add_favorite()
+        self.request('recommendations', 'GET', '/recommend/')
+
+    def scenario_book_info(self):
+        title, author = self.book()
+        self.request('book_info', 'GET', '/api/book-info/', params={'title': title, 'author': author})
+
+
+def _smaps_rollup_kb(pid):
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields
+
+
+def _child_pids(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def server_memory(pid):
+    """
+    Memory of a server process and its children (e.g. the gunicorn master and its
+    workers), in MB, from /proc (Linux only). PSS splits shared pages between the
+    processes sharing them; private is what each process alone holds.
+    """
+    processes = []
+    for role, process_id in [('master', pid)] + [('worker', child) for child in _child_pids(pid)]:
+        try:
+            fields = _smaps_rollup_kb(process_id)
+        except OSError:
+            continue
+        processes.append({
+            'pid': process_id,
+            'role': role,
+            'rss_mb': round(fields.get('Rss', 0) / 1024, 1),
+            'pss_mb': round(fields.get('Pss', 0) / 1024, 1),
+            'private_mb': round((fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024, 1),
+        })
+    return processes
+
+
+def run_load_test(base_url, users, duration, mix, catalog, think_time_ms=100, seed=42):
+    """Run `users` virtual users against base_url for `duration` seconds and return the summary."""
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + duration
+    virtual_users = [
+        VirtualUser(i, base_url, mix, catalog, recorder, deadline, think_time_ms, seed + i) for i in range(users)
+    ]
+    for user in virtual_users:
+        user.start()
+    for user in virtual_users:
+        user.join()
+    # Users finish their current scenario after the deadline, so measure the real span
+    return recorder.summary(time.monotonic() - started)
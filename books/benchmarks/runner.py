@@ -0,0 +1,129 @@
+"""Run benchmark scenarios and record wall time, query count and peak memory."""
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from books.models import Book, UserFavoriteBook
+
+from .stubs import offline_google_books
+
+RESULTS_VERSION = 1
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def _run_once(scenario, state, iteration):
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        scenario.run(state, iteration)
+        elapsed = time.perf_counter() - started
+    return elapsed, len(queries)
+
+
+def measure(scenario, repeat=5):
+    """
+    Time `repeat` runs of a scenario, then one more under tracemalloc for peak memory.
+    Each run happens inside a transaction that is rolled back afterwards.
+    """
+    timings = []
+    query_counts = []
+    for iteration in range(repeat + 1):
+        with transaction.atomic():
+            state = scenario.setup()
+            if iteration < repeat:
+                elapsed, query_count = _run_once(scenario, state, iteration)
+                timings.append(elapsed)
+                query_counts.append(query_count)
+            else:
+                tracemalloc.start()
+                try:
+                    scenario.run(state, iteration)
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+            transaction.set_rollback(True)
+
+    return {
+        'description': scenario.description,
+        'repeat': repeat,
+        'wall_ms': {
+            'min': round(min(timings) * 1000, 3),
+            'median': round(statistics.median(timings) * 1000, 3),
+            'max': round(max(timings) * 1000, 3),
+        },
+        'queries': query_counts[-1],
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(scenarios, repeat=5, progress=None):
+    """Run scenarios offline (stubbed Google Books, in-memory email) and return the results document."""
+    results = {}
+    with offline_google_books() as google, override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    ):
+        for scenario in scenarios:
+            results[scenario.name] = measure(scenario, repeat)
+            if progress:
+                progress(scenario.name, results[scenario.name])
+
+    return {
+        'version': RESULTS_VERSION,
+        'commit': _git_commit(),
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'dataset': {
+            'readers': UserFavoriteBook.objects.values('user_id').distinct().count(),
+            'books': Book.objects.count(),
+            'favorites': UserFavoriteBook.objects.count(),
+        },
+        'settings': {
+            'RECOMMENDATION_ENGINE': getattr(settings, 'RECOMMENDATION_ENGINE', 'exact'),
+            'RECOMMENDATION_SCORING': getattr(settings, 'RECOMMENDATION_SCORING', 'overlap'),
+            'USER_NEIGHBORS_K': getattr(settings, 'USER_NEIGHBORS_K', 50),
+        },
+        'google_books_requests': google.requests,
+        'scenarios': results,
+    }
+
+
+def compare(results, baseline):
+    """Yield (scenario, metric, baseline value, current value, change %) for scenarios in both documents."""
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        for metric, old, new in (
+            ('wall_ms', previous['wall_ms']['median'], current['wall_ms']['median']),
+            ('queries', previous['queries'], current['queries']),
+            ('peak_memory_kb', previous['peak_memory_kb'], current['peak_memory_kb']),
+        ):
+            change = (new - old) / old * 100 if old else 0.0
+            yield name, metric, old, new, change
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_results(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
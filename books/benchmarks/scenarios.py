@@ -0,0 +1,159 @@
+"""
+Benchmark scenarios. Each scenario's setup() runs untimed inside the same rolled-back
+transaction as run(), so scenarios can write freely.
+"""
+from django.contrib.auth.models import User
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+
+from books.models import Book, PrecomputedRecommendations, UserEmailPreferences, UserNeighbor
+from books.recommendation_emails import send_new_recommendation_emails
+from books.scoring import SCORERS
+
+
+def _client(user=None):
+    client = Client(HTTP_HOST='localhost')
+    if user is not None:
+        client.force_login(user)
+    return client
+
+
+def _heaviest_reader():
+    """The reader with the most favorites, the worst case for most pages."""
+    return User.objects.annotate(favorites=Count('favorite_books')).order_by('-favorites', 'id').first()
+
+
+def _books_not_favorited_by(user, limit):
+    return list(
+        Book.objects.exclude(favorited_by__user=user).select_related('author').order_by('-favorite_count', 'id')[:limit]
+    )
+
+
+class Scenario:
+    name = ''
+    description = ''
+
+    def setup(self):
+        return None
+
+    def run(self, state, iteration):
+        raise NotImplementedError
+
+
+class RecommendationsPage(Scenario):
+    """GET /recommend/ for the heaviest reader, computed on demand with one scoring strategy."""
+
+    def __init__(self, scoring):
+        self.scoring = scoring
+        self.name = f'recommendations_page_{scoring}'
+        self.description = f'Recommendations page for the heaviest reader, {scoring} scoring, nothing precomputed'
+
+    def setup(self):
+        user = _heaviest_reader()
+        PrecomputedRecommendations.objects.filter(user=user).delete()
+        return _client(user)
+
+    def run(self, client, iteration):
+        with override_settings(RECOMMENDATION_SCORING=self.scoring):
+            response = client.get('/recommend/')
+        assert response.status_code == 200, response.status_code
+
+
+class Autocomplete(Scenario):
+    """GET /api/search/ for a term the database answers, or one that falls through to Google Books."""
+
+    def __init__(self, source):
+        self.source = source
+        self.name = f'autocomplete_{source}'
+        self.description = (
+            'Autocomplete answered from the database' if source == 'database'
+            else 'Autocomplete that misses the database and calls the stubbed Google Books API'
+        )
+
+    def setup(self):
+        if self.source == 'database':
+            book = Book.objects.order_by('-favorite_count', 'id').first()
+            return (book.title if book else 'the')[:4]
+        return None
+
+    def run(self, term, iteration):
+        # A new term each time so the Google Books cache never answers
+        term = term or f'zzqx offline benchmark {iteration}'
+        response = _client().get('/api/search/', {'term': term})
+        assert response.status_code == 200, response.status_code
+
+
+class FavoriteSave(Scenario):
+    name = 'favorite_save'
+    description = 'Heaviest reader saves three popular books (incremental upkeep and email fan-out included)'
+
+    def setup(self):
+        user = _heaviest_reader()
+        books = _books_not_favorited_by(user, 3)
+        return _client(user), {
+            'title': [book.title for book in books],
+            'author': [book.author.name for book in books],
+            'isbn': [book.isbn or '' for book in books],
+            'explanation': ['' for _ in books],
+        }
+
+    def run(self, state, iteration):
+        client, data = state
+        response = client.post('/add-favorite/save/', data)
+        assert response.status_code == 302, response.status_code
+
+
+class GuestMerge(Scenario):
+    name = 'guest_merge'
+    description = 'A guest with five favorites registers and their favorites are merged'
+
+    def setup(self):
+        client = _client()
+        books = list(Book.objects.select_related('author').order_by('-favorite_count', 'id')[:5])
+        client.post('/add-favorite/save/', {
+            'title': [book.title for book in books],
+            'author': [book.author.name for book in books],
+            'isbn': [book.isbn or '' for book in books],
+            'explanation': ['' for _ in books],
+        })
+        return client
+
+    def run(self, client, iteration):
+        response = client.post('/register/', {
+            'username': f'benchmark_guest_{iteration}',
+            'email': f'benchmark_guest_{iteration}@example.com',
+            'password1': 'Benchmark-Pass-123!',
+            'password2': 'Benchmark-Pass-123!',
+        })
+        assert response.status_code == 302, response.status_code
+
+
+class WeeklyDigest(Scenario):
+    name = 'weekly_digest'
+    description = 'send_recommendation_emails for the most-followed reader (all recipients due)'
+
+    def setup(self):
+        popular = (
+            UserNeighbor.objects.values('neighbor_id').annotate(followers=Count('id'))
+            .order_by('-followers', 'neighbor_id').first()
+        )
+        user_b = User.objects.get(id=popular['neighbor_id']) if popular else _heaviest_reader()
+        UserEmailPreferences.objects.filter(user__neighbors__neighbor=user_b).update(
+            receive_recommendation_emails=True, last_recommendation_email_sent=None,
+        )
+        return user_b.id
+
+    def run(self, user_id, iteration):
+        send_new_recommendation_emails(user_id, 'http://localhost')
+
+
+def all_scenarios():
+    return [
+        *(RecommendationsPage(scoring) for scoring in SCORERS),
+        Autocomplete('database'),
+        Autocomplete('google'),
+        FavoriteSave(),
+        GuestMerge(),
+        WeeklyDigest(),
+    ]
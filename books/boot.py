@@ -0,0 +1,153 @@
+"""
+Fingerprints and a migration lock for the boot command.
+
+A container start only needs to migrate when the migration graph has nodes the
+django_migrations table doesn't list, and only needs collectstatic when the static
+sources changed since the files in STATIC_ROOT were collected. Both checks are cheap
+(one query; hashing the static sources), so a replica that finds nothing to do
+starts serving right after importing the app.
+
+Static fingerprints are stored next to the manifest in STATIC_ROOT, together with
+the manifest's own hash, so a missing or hand-edited manifest triggers a collect.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+
+STATIC_FINGERPRINT_FILE = 'boot-fingerprint.json'
+# pg_advisory_lock takes a bigint; every replica must use the same one
+MIGRATION_LOCK_ID = zlib.crc32(b'books.boot:migrate')
+LOCK_POLL_SECONDS = 0.5
+
+
+class LockTimeout(Exception):
+    pass
+
+
+def _sha256(chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pending_migrations(using='default'):
+    """(fingerprint of the migration graph, [(app_label, name), ...] not yet applied)."""
+    executor = MigrationExecutor(connections[using])
+    graph = executor.loader.graph
+    fingerprint = _sha256(f'{app_label}.{name}\n'.encode() for app_label, name in sorted(graph.nodes))
+    plan = executor.migration_plan(graph.leaf_nodes())
+    return fingerprint, [(migration.app_label, migration.name) for migration, _backwards in plan]
+
+
+def static_sources_fingerprint():
+    """Hash of every file collectstatic would copy (path and contents) and the storage settings."""
+    def chunks():
+        yield f'{settings.STATIC_URL}\n{settings.STATICFILES_STORAGE}\n'.encode()
+        found = {}
+        for finder in finders.get_finders():
+            for path, storage in finder.list(['CVS', '.*', '*~']):
+                # The first finder to list a path wins, as in collectstatic
+                found.setdefault(path, storage)
+        for path in sorted(found):
+            yield f'{path}\n'.encode()
+            with found[path].open(path) as f:
+                for block in iter(lambda: f.read(65536), b''):
+                    yield block
+    return _sha256(chunks())
+
+
+def _manifest_path():
+    return os.path.join(settings.STATIC_ROOT, 'staticfiles.json')
+
+
+def _manifest_hash():
+    try:
+        with open(_manifest_path(), 'rb') as f:
+            return _sha256([f.read()])
+    except OSError:
+        return None
+
+
+def collected_static_fingerprint():
+    """The sources fingerprint STATIC_ROOT was collected from, or None if the manifest no longer matches it."""
+    try:
+        with open(os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT_FILE), encoding='utf-8') as f:
+            recorded = json.load(f)
+    except (OSError, ValueError):
+        return None
+    manifest = _manifest_hash()
+    if manifest is None or recorded.get('manifest') != manifest:
+        return None
+    return recorded.get('sources')
+
+
+def record_static_fingerprint(sources_fingerprint):
+    path = os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT_FILE)
+    payload = {'sources': sources_fingerprint, 'manifest': _manifest_hash()}
+    # Write then rename, so a replica reading it never sees half a file
+    with tempfile.NamedTemporaryFile('w', dir=settings.STATIC_ROOT, delete=False, encoding='utf-8') as f:
+        json.dump(payload, f)
+    os.replace(f.name, path)
+
+
+def _wait(try_acquire, timeout):
+    deadline = time.monotonic() + timeout
+    while not try_acquire():
+        if time.monotonic() >= deadline:
+            raise LockTimeout(f'Another replica held the migration lock for more than {timeout:g}s')
+        time.sleep(LOCK_POLL_SECONDS)
+
+
+def _lock_file_path(connection):
+    # SQLite: next to the database file, which is what replicas would share
+    name = str(connection.settings_dict.get('NAME') or '')
+    if connection.vendor == 'sqlite' and name and not connection.is_in_memory_db():
+        return f'{name}.migrate.lock'
+    return os.path.join(tempfile.gettempdir(), f'books-migrate-{MIGRATION_LOCK_ID}.lock')
+
+
+@contextmanager
+def migration_lock(using='default', timeout=300):
+    """
+    Hold an exclusive lock across replicas while migrating: a session-level advisory
+    lock on PostgreSQL, a file lock otherwise. Raises LockTimeout after `timeout` seconds.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        def try_acquire():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_lock(%s)', [MIGRATION_LOCK_ID])
+                return cursor.fetchone()[0]
+
+        _wait(try_acquire, timeout)
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [MIGRATION_LOCK_ID])
+        return
+
+    with open(_lock_file_path(connection), 'a') as lock_file:
+        def try_acquire():
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            return True
+
+        _wait(try_acquire, timeout)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,130 @@
+"""
+Item-to-item co-occurrence: how many readers love both of two books.
+
+BookCooccurrence rows are kept in sync by deltas from books.favorites, so adding
+or removing a favorite costs a few statements proportional to that reader's
+favorites rather than a rescan. rebuild_book_cooccurrence recomputes the table.
+"""
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import BookCooccurrence, UserFavoriteBook
+from .query_plans import hot_query
+
+
+def _current_favorites(user_ids):
+    favorites = defaultdict(set)
+    for user_id, book_id in UserFavoriteBook.objects.filter(user_id__in=user_ids).values_list('user_id', 'book_id'):
+        favorites[user_id].add(book_id)
+    return favorites
+
+
+def _pair_deltas(pairs, sign):
+    """
+    Co-occurrence deltas for favorites that were just added (sign=1) or deleted
+    (sign=-1). Must run after the favorites table has been changed.
+    """
+    changed = defaultdict(set)
+    for user_id, book_id in pairs:
+        changed[user_id].add(book_id)
+
+    current = _current_favorites(changed.keys())
+    deltas = Counter()
+    for user_id, changed_books in changed.items():
+        # Removed books are gone from the table, so pair them with what remains and each other
+        others = current[user_id] | changed_books if sign < 0 else current[user_id]
+        touched = set()
+        for book_id in changed_books:
+            for other_id in others:
+                if other_id != book_id:
+                    touched.add((min(book_id, other_id), max(book_id, other_id)))
+        for a, b in touched:
+            deltas[(a, b)] += sign
+            deltas[(b, a)] += sign
+    return deltas
+
+
+def apply_cooccurrence_deltas(deltas):
+    """Add each delta to its (book_a, book_b) row, creating and removing rows as needed."""
+    deltas = {pair: delta for pair, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    BookCooccurrence.objects.bulk_create(
+        [BookCooccurrence(book_a_id=a, book_b_id=b, count=0) for (a, b), delta in deltas.items() if delta > 0],
+        ignore_conflicts=True,
+    )
+
+    # One UPDATE per (book, delta) group; each pair is grouped by whichever of its
+    # books it shares with more pairs, so one reader's change is ~2 statements
+    a_counts = Counter(a for a, _ in deltas)
+    b_counts = Counter(b for _, b in deltas)
+    groups = defaultdict(list)
+    for (a, b), delta in deltas.items():
+        if a_counts[a] >= b_counts[b]:
+            groups[('book_a_id', a, 'book_b_id__in', delta)].append(b)
+        else:
+            groups[('book_b_id', b, 'book_a_id__in', delta)].append(a)
+
+    for (side, book_id, others, delta), other_ids in groups.items():
+        BookCooccurrence.objects.filter(**{side: book_id, others: other_ids}).update(
+            count=Greatest(F('count') + delta, Value(0))
+        )
+
+    decreased = {a for (a, _), delta in deltas.items() if delta < 0}
+    if decreased:
+        BookCooccurrence.objects.filter(book_a_id__in=decreased, count=0).delete()
+
+
+def cooccurrence_favorites_added(pairs):
+    apply_cooccurrence_deltas(_pair_deltas(pairs, 1))
+
+
+def cooccurrence_favorites_removed(pairs):
+    apply_cooccurrence_deltas(_pair_deltas(pairs, -1))
+
+
+def rebuild_book_cooccurrence(batch_size=5000, chunk_size=10000):
+    """Recompute the whole table from the favorites table. Returns the number of rows written."""
+    counts = Counter()
+    current_user = None
+    books = []
+    for user_id, book_id in (
+        UserFavoriteBook.objects.order_by('user_id', 'book_id')
+        .values_list('user_id', 'book_id').iterator(chunk_size=chunk_size)
+    ):
+        if user_id != current_user:
+            counts.update(combinations(books, 2))
+            current_user = user_id
+            books = []
+        books.append(book_id)
+    counts.update(combinations(books, 2))
+
+    with transaction.atomic():
+        BookCooccurrence.objects.all().delete()
+        batch = []
+        for (a, b), count in counts.items():
+            batch.append(BookCooccurrence(book_a_id=a, book_b_id=b, count=count))
+            batch.append(BookCooccurrence(book_a_id=b, book_b_id=a, count=count))
+            if len(batch) >= batch_size:
+                BookCooccurrence.objects.bulk_create(batch)
+                batch = []
+        BookCooccurrence.objects.bulk_create(batch)
+    return len(counts) * 2
+
+
+@hot_query('also_loved', lambda sample: {'book_id': sample.book_id, 'exclude_book_ids': sample.book_ids})
+def also_loved_rows(book_id, exclude_book_ids=()):
+    rows = BookCooccurrence.objects.filter(book_a_id=book_id)
+    if exclude_book_ids:
+        rows = rows.exclude(book_b_id__in=exclude_book_ids)
+    return rows.select_related('book_b__author').order_by('-count', 'book_b_id')
+
+
+def also_loved(book_id, limit=10, exclude_book_ids=()):
+    """Books most often loved by readers of `book_id`, with their co-occurrence counts (one query)."""
+    return list(also_loved_rows(book_id, exclude_book_ids)[:limit])
@@ -0,0 +1,105 @@
+"""
+Bookkeeping for denormalized data that depends on UserFavoriteBook rows.
+
+Every code path that creates or deletes favorites (views, guest merge, purges)
+reports the affected (user_id, book_id) pairs here so the derived data stays in
+sync without re-aggregating the whole favorites table. Bulk loads (imports,
+fixtures, synthetic data) only keep the counts in step with
+favorite_counts_added() and call rebuild_derived_data() once at the end, which is
+far cheaper than per-reader upkeep for every chunk.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .cooccurrence import cooccurrence_favorites_added, cooccurrence_favorites_removed, rebuild_book_cooccurrence
+from .minhash import engine_enabled as minhash_enabled, minhash_favorites_changed, rebuild_signatures
+from .models import Book, PrecomputedRecommendations, UserFavoriteBook
+from .neighbors import neighbors_favorites_changed, rebuild_user_neighbors
+from .recommendations import invalidate_precomputed_recommendations
+from .stats import refresh_site_stats, site_stats_changed
+
+
+def _apply_favorite_count_deltas(book_ids, sign):
+    """Adjust Book.favorite_count with one UPDATE per distinct delta size."""
+    books_by_delta = defaultdict(list)
+    for book_id, count in Counter(book_ids).items():
+        books_by_delta[count].append(book_id)
+
+    for delta, ids in books_by_delta.items():
+        # A count that has drifted low must not go negative (the column is unsigned)
+        Book.objects.filter(id__in=ids).update(favorite_count=Greatest(F('favorite_count') + sign * delta, Value(0)))
+
+
+def favorites_added(pairs):
+    """Record newly created favorites given as (user_id, book_id) pairs."""
+    pairs = list(pairs)
+    if not pairs:
+        return
+    _apply_favorite_count_deltas([book_id for _, book_id in pairs], 1)
+    cooccurrence_favorites_added(pairs)
+    minhash_favorites_changed(pairs, added=True)
+    neighbors_favorites_changed(pairs)
+    invalidate_precomputed_recommendations({user_id for user_id, _ in pairs})
+    site_stats_changed()
+
+
+def favorites_removed(pairs):
+    """Record deleted favorites given as (user_id, book_id) pairs."""
+    pairs = list(pairs)
+    if not pairs:
+        return
+    _apply_favorite_count_deltas([book_id for _, book_id in pairs], -1)
+    cooccurrence_favorites_removed(pairs)
+    minhash_favorites_changed(pairs, added=False)
+    user_ids = {user_id for user_id, _ in pairs}
+    # Before the upkeep too: readers who drop these readers from their lists still show their books
+    invalidate_precomputed_recommendations(user_ids)
+    neighbors_favorites_changed(pairs)
+    invalidate_precomputed_recommendations(user_ids)
+    site_stats_changed()
+
+
+def favorite_counts_added(pairs):
+    """Bulk-load counterpart of favorites_added: only Book.favorite_count is updated."""
+    _apply_favorite_count_deltas([book_id for _, book_id in pairs], 1)
+
+
+def rebuild_derived_data(workers=1):
+    """
+    Recompute everything derived from the favorites table after a bulk load:
+    favorite counts, co-occurrence, MinHash signatures (if enabled), neighbor lists
+    and site stats. Stored recommendations are dropped, since any reader's
+    neighbors may have changed; pages compute them on demand until
+    precompute_recommendations runs again.
+    """
+    reconcile_favorite_counts()
+    rebuild_book_cooccurrence()
+    if minhash_enabled():
+        rebuild_signatures()
+    rebuild_user_neighbors(workers=workers)
+    PrecomputedRecommendations.objects.all().delete()
+    refresh_site_stats()
+
+
+def reconcile_favorite_counts():
+    """
+    Recompute Book.favorite_count from the favorites table and fix any drift.
+    Returns the number of books that were corrected.
+    """
+    actual_count = Coalesce(
+        Subquery(
+            UserFavoriteBook.objects.filter(book_id=OuterRef('pk'))
+            .order_by()
+            .values('book_id')
+            .annotate(count=Count('id'))
+            .values('count')
+        ),
+        Value(0),
+    )
+    drifted = Book.objects.annotate(actual_count=actual_count).exclude(favorite_count=F('actual_count'))
+    fixed = Book.objects.filter(id__in=drifted.values('id')).update(favorite_count=actual_count)
+    if fixed:
+        site_stats_changed()
+    return fixed
@@ -0,0 +1,296 @@
+"""
+Compact binary snapshot of the favorites graph.
+
+A snapshot holds every (user_id, book_id, created_at) favorite plus a book/author
+string table, so analytics jobs, recommendation rebuilds and benchmarks can read
+the whole graph without going through the ORM. The loader memory-maps the file.
+
+File layout (all integers little-endian):
+
+    header   magic(8s) version(H) section_count(H) crc32(I) payload_length(Q)
+    payload  section*
+
+    section  name(4s) typecode(c) encoding(B) pad(x) count(Q) base(q) nbytes(Q)
+             padding to an 8-byte boundary, then nbytes of data
+
+Integer columns are stored either raw (zero-copy memoryview casts on load) or
+delta-encoded: `base` is the first value and the data holds the count - 1
+differences in the smallest array typecode that fits them. The crc32 covers the
+payload.
+"""
+import array
+import mmap
+import os
+import struct
+import sys
+import zlib
+from itertools import accumulate, chain
+
+MAGIC = b'FAVGRAPH'
+VERSION = 1
+
+HEADER = struct.Struct('<8sHHIQ')
+SECTION_HEADER = struct.Struct('<4scBxQqQ')
+
+ENCODING_RAW = 0
+ENCODING_DELTA = 1
+
+SIGNED_TYPECODES = ('b', 'h', 'i', 'q')
+UNSIGNED_TYPECODES = ('B', 'H', 'I', 'Q')
+
+
+class GraphFormatError(Exception):
+    """The file is not a readable favorites graph snapshot."""
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def smallest_typecode(values, signed=True):
+    """Return the narrowest array typecode that can hold every value."""
+    values = list(values) if not isinstance(values, (list, array.array)) else values
+    low = min(values, default=0)
+    high = max(values, default=0)
+    if low < 0 and not signed:
+        raise ValueError('Negative value in an unsigned column')
+    for typecode in (SIGNED_TYPECODES if signed else UNSIGNED_TYPECODES):
+        bits = array.array(typecode).itemsize * 8
+        if signed and -(1 << (bits - 1)) <= low and high < (1 << (bits - 1)):
+            return typecode
+        if not signed and high < (1 << bits):
+            return typecode
+    raise OverflowError('Value does not fit in 64 bits')
+
+
+class Section:
+    """One named column of a snapshot."""
+
+    def __init__(self, name, typecode, encoding, count, base, data):
+        self.name = name
+        self.typecode = typecode
+        self.encoding = encoding
+        self.count = count
+        self.base = base
+        self.data = data
+
+    @classmethod
+    def ints(cls, name, values, delta=True, typecode=None):
+        """Build an integer column, delta-encoded unless `delta` is False."""
+        values = values if isinstance(values, array.array) else array.array('q', values)
+        if not delta:
+            typecode = typecode or smallest_typecode(values)
+            return cls(name, typecode, ENCODING_RAW, len(values), 0, array.array(typecode, values))
+        if not values:
+            return cls(name, 'b', ENCODING_DELTA, 0, 0, array.array('b'))
+        deltas = array.array('q', (b - a for a, b in zip(values, values[1:])))
+        typecode = smallest_typecode(deltas)
+        return cls(name, typecode, ENCODING_DELTA, len(values), values[0], array.array(typecode, deltas))
+
+    @classmethod
+    def raw_bytes(cls, name, data):
+        return cls(name, 'B', ENCODING_RAW, len(data), 0, bytes(data))
+
+    def to_bytes(self):
+        if isinstance(self.data, array.array):
+            if sys.byteorder != 'little':
+                self.data = array.array(self.typecode, self.data)
+                self.data.byteswap()
+            return self.data.tobytes()
+        return bytes(self.data)
+
+    def values(self):
+        """
+        Decoded integers. Raw columns come back as a zero-copy memoryview over the
+        mapped file; delta columns are expanded into an array('q').
+        """
+        if self.encoding == ENCODING_RAW:
+            return self.data.cast(self.typecode) if isinstance(self.data, memoryview) else self.data
+        if not self.count:
+            return array.array('q')
+        deltas = self.data.cast(self.typecode) if isinstance(self.data, memoryview) else self.data
+        return array.array('q', accumulate(chain((self.base,), deltas)))
+
+
+class StringTable:
+    """
+    Strings stored as a delta-encoded offsets column (<prefix>OF) plus one UTF-8
+    blob (<prefix>ST), decoded on access. Prefixes are two characters.
+    """
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    @staticmethod
+    def sections(prefix, strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = array.array('q', accumulate((len(e) for e in encoded), initial=0))
+        return [Section.ints(prefix + 'OF', offsets), Section.raw_bytes(prefix + 'ST', b''.join(encoded))]
+
+    @classmethod
+    def from_sections(cls, sections, prefix):
+        return cls(sections[prefix + 'OF'].values(), sections[prefix + 'ST'].data)
+
+    def __len__(self):
+        return max(len(self.offsets) - 1, 0)
+
+    def __getitem__(self, index):
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+
+def write_snapshot(path, sections):
+    """Write sections to `path` atomically (a temp file renamed into place)."""
+    payload = bytearray()
+    for section in sections:
+        data = section.to_bytes()
+        payload += SECTION_HEADER.pack(
+            section.name.encode('ascii'), section.typecode.encode('ascii'), section.encoding,
+            section.count, section.base, len(data),
+        )
+        # Offsets are relative to the payload, which starts on an 8-byte boundary
+        payload += b'\0' * (_align(HEADER.size + len(payload)) - HEADER.size - len(payload))
+        payload += data
+
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(sections), zlib.crc32(payload), len(payload)))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return HEADER.size + len(payload)
+
+
+def read_snapshot(path, verify=True):
+    """
+    Memory-map a snapshot and return (mmap, {name: Section}).
+    Section data are memoryviews into the map, so keep the mmap open while using them.
+    """
+    if sys.byteorder != 'little':
+        raise GraphFormatError('Graph snapshots can only be mapped on little-endian hosts')
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise GraphFormatError(f'{path} is too short to be a graph snapshot')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mm)
+    magic, version, section_count, crc, payload_length = HEADER.unpack_from(mm, 0)
+    try:
+        if magic != MAGIC:
+            raise GraphFormatError(f'{path} is not a graph snapshot')
+        if version != VERSION:
+            raise GraphFormatError(f'{path} has format version {version}, expected {VERSION}')
+        if HEADER.size + payload_length != len(mm):
+            raise GraphFormatError(f'{path} is truncated')
+        if verify and zlib.crc32(view[HEADER.size:]) != crc:
+            raise GraphFormatError(f'{path} failed its checksum')
+    except GraphFormatError:
+        view.release()
+        mm.close()
+        raise
+
+    sections = {}
+    offset = HEADER.size
+    for _ in range(section_count):
+        name, typecode, encoding, count, base, nbytes = SECTION_HEADER.unpack_from(mm, offset)
+        offset = _align(offset + SECTION_HEADER.size)
+        name = name.decode('ascii')
+        sections[name] = Section(name, typecode.decode('ascii'), encoding, count, base, view[offset:offset + nbytes])
+        offset += nbytes
+    return mm, sections
+
+
+class FavoritesGraph:
+    """
+    The favorites graph loaded from a snapshot.
+
+    `user_ids`, `book_ids` and `created_at` (epoch seconds, a zero-copy view of the
+    map) are parallel arrays sorted by (user_id, book_id). Book titles and author names are looked up
+    through `book_info()`.
+    """
+
+    SECTIONS = ('FUSR', 'FBOK', 'FTIM', 'BKID', 'BKAU', 'BTOF', 'BTST', 'ANOF', 'ANST')
+
+    def __init__(self, mm, sections):
+        self._mm = mm
+        self.user_ids = sections['FUSR'].values()
+        self.book_ids = sections['FBOK'].values()
+        self.created_at = sections['FTIM'].values()
+        self.book_table_ids = sections['BKID'].values()
+        self.book_authors = sections['BKAU'].values()
+        self.titles = StringTable.from_sections(sections, 'BT')
+        self.author_names = StringTable.from_sections(sections, 'AN')
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def book_info(self):
+        """Return {book_id: (title, author name)} for every book in the snapshot."""
+        return {
+            book_id: (self.titles[index], self.author_names[self.book_authors[index]])
+            for index, book_id in enumerate(self.book_table_ids)
+        }
+
+    def close(self):
+        self.user_ids = self.book_ids = self.created_at = None
+        self.book_table_ids = self.book_authors = self.titles = self.author_names = None
+        self._mm.close()
+
+
+def dump_favorites_graph(path, chunk_size=10000):
+    """Write the favorites graph from the database to `path`. Returns (favorites, bytes written)."""
+    from .models import Author, Book, UserFavoriteBook
+
+    user_ids = array.array('q')
+    book_ids = array.array('q')
+    created_at = array.array('q')
+    for user_id, book_id, created in (
+        UserFavoriteBook.objects.order_by('user_id', 'book_id')
+        .values_list('user_id', 'book_id', 'created_at')
+        .iterator(chunk_size=chunk_size)
+    ):
+        user_ids.append(user_id)
+        book_ids.append(book_id)
+        created_at.append(int(created.timestamp()))
+
+    author_index = {}
+    author_names = []
+    for author_id, name in Author.objects.order_by('id').values_list('id', 'name').iterator(chunk_size=chunk_size):
+        author_index[author_id] = len(author_names)
+        author_names.append(name)
+
+    book_table_ids = array.array('q')
+    book_authors = array.array('q')
+    titles = []
+    for book_id, title, author_id in (
+        Book.objects.order_by('id').values_list('id', 'title', 'author_id').iterator(chunk_size=chunk_size)
+    ):
+        book_table_ids.append(book_id)
+        book_authors.append(author_index[author_id])
+        titles.append(title)
+
+    sections = [
+        Section.ints('FUSR', user_ids),
+        Section.ints('FBOK', book_ids),
+        # Timestamps are unordered within a user, so store plain epoch seconds
+        Section.ints('FTIM', created_at, delta=False),
+        Section.ints('BKID', book_table_ids),
+        Section.ints('BKAU', book_authors, delta=False),
+        *StringTable.sections('BT', titles),
+        *StringTable.sections('AN', author_names),
+    ]
+    return len(user_ids), write_snapshot(path, sections)
+
+
+def load_favorites_graph(path, verify=True):
+    """Memory-map a snapshot written by dump_favorites_graph()."""
+    mm, sections = read_snapshot(path, verify=verify)
+    missing = [name for name in FavoritesGraph.SECTIONS if name not in sections]
+    if missing:
+        # Drop the views into the map before closing it
+        sections.clear()
+        mm.close()
+        raise GraphFormatError(f'{path} is missing sections: {", ".join(missing)}')
+    return FavoritesGraph(mm, sections)
@@ -0,0 +1,70 @@
+"""
+Prepare the database and static files for serving, skipping work that's already done.
+Usage:
+  python manage.py boot
+  python manage.py boot --skip-migrate      # e.g. at image build time, no database needed
+  python manage.py boot --force
+
+Migrations run only when the migration graph has migrations the django_migrations
+table doesn't list, under a lock (pg_advisory_lock on PostgreSQL, a file lock
+otherwise) so concurrent replicas migrate one at a time; the plan is re-read once
+the lock is held, so replicas that waited find nothing left to do. collectstatic
+runs only when the static sources' fingerprint differs from the one recorded with
+the current manifest (see books.boot). Replaces check --database / migrate /
+collectstatic in start.sh and the Procfile release phase.
+"""
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from books.boot import (
+    LockTimeout, collected_static_fingerprint, migration_lock, pending_migrations, record_static_fingerprint,
+    static_sources_fingerprint,
+)
+
+
+class Command(BaseCommand):
+    help = "Run migrate and collectstatic only when the migration graph or the static sources changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database to migrate (default: default)')
+        parser.add_argument('--skip-migrate', action='store_true', help="Don't check or apply migrations")
+        parser.add_argument('--skip-static', action='store_true', help="Don't check or collect static files")
+        parser.add_argument('--force', action='store_true', help='Run migrate and collectstatic even if nothing changed')
+        parser.add_argument('--lock-timeout', type=float, default=300, help='Seconds to wait for the migration lock (default: 300)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if not options['skip_static']:
+            self._static(options['force'])
+        if not options['skip_migrate']:
+            self._migrate(options['database'], options['force'], options['lock_timeout'])
+        self.stdout.write(self.style.SUCCESS(f'Boot complete in {time.monotonic() - started:.2f}s'))
+
+    def _static(self, force):
+        fingerprint = static_sources_fingerprint()
+        if not force and collected_static_fingerprint() == fingerprint:
+            self.stdout.write(f'Static files up to date ({fingerprint[:12]}), skipping collectstatic')
+            return
+        self.stdout.write(f'Collecting static files ({fingerprint[:12]})')
+        call_command('collectstatic', interactive=False, verbosity=0)
+        record_static_fingerprint(fingerprint)
+
+    def _migrate(self, database, force, lock_timeout):
+        fingerprint, pending = pending_migrations(database)
+        if not force and not pending:
+            self.stdout.write(f'Migrations up to date ({fingerprint[:12]}), skipping migrate')
+            return
+        self.stdout.write(f'{len(pending)} unapplied migration(s); waiting for the migration lock')
+        try:
+            with migration_lock(database, timeout=lock_timeout):
+                # Another replica may have applied them while we waited
+                _fingerprint, pending = pending_migrations(database)
+                if not force and not pending:
+                    self.stdout.write('Migrations were applied by another replica, skipping migrate')
+                    return
+                call_command('migrate', database=database, interactive=False, verbosity=1, stdout=self.stdout)
+        except LockTimeout as e:
+            raise CommandError(str(e))
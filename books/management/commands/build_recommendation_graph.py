@@ -0,0 +1,66 @@
+"""
+Build a new generation of the memory-mapped recommendation graph (see books/recommendations.py).
+Usage:
+  python manage.py build_recommendation_graph
+  python manage.py build_recommendation_graph --if-stale
+  python manage.py build_recommendation_graph --directory=/var/lib/frodo/graph
+
+Web workers pick up the new generation within RECOMMENDATION_GRAPH_CHECK_SECONDS.
+Run it from cron (e.g. every few minutes with --if-stale) to keep the graph fresh.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from books.graph import GraphFormatError
+from books.models import UserFavoriteBook
+from books.recommendations import build_recommendation_graph, load_recommendation_graph
+
+
+class Command(BaseCommand):
+    help = "Write the favorites CSR graph used by recommendation views and swap workers over to it"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            type=str,
+            default=None,
+            help='Graph directory (default: RECOMMENDATION_GRAPH_DIR)',
+        )
+        parser.add_argument(
+            '--if-stale',
+            action='store_true',
+            help='Only rebuild if favorites changed since the current generation was built',
+        )
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or getattr(settings, 'RECOMMENDATION_GRAPH_DIR', '')
+        if not directory:
+            raise CommandError('Set RECOMMENDATION_GRAPH_DIR or pass --directory')
+
+        if options['if_stale'] and not self._is_stale(directory):
+            self.stdout.write(self.style.SUCCESS('Recommendation graph is up to date'))
+            return
+
+        started = time.monotonic()
+        generation, favorites = build_recommendation_graph(directory)
+        self.stdout.write(self.style.SUCCESS(
+            f'Built recommendation graph generation {generation} with {favorites} favorites '
+            f'in {time.monotonic() - started:.2f}s'
+        ))
+
+    def _is_stale(self, directory):
+        try:
+            graph = load_recommendation_graph(directory)
+        except (OSError, GraphFormatError):
+            return True
+        if graph is None:
+            return True
+        max_favorite_id = UserFavoriteBook.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        # Adds raise the max id and deletes lower the count
+        return (
+            graph.max_favorite_id != max_favorite_id
+            or graph.favorites_count != UserFavoriteBook.objects.count()
+        )
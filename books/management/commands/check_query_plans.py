@@ -0,0 +1,131 @@
+"""
+Check the plans of the hot queries (see books.query_plans) against a stored baseline.
+Usage:
+  python manage.py check_query_plans --synthetic                    # what CI runs
+  python manage.py check_query_plans --synthetic --update-baseline
+  python manage.py check_query_plans --show-plans --query=search     # against the current database
+
+Runs EXPLAIN (EXPLAIN QUERY PLAN on SQLite) for each hot query and flags full
+scans, temp B-trees and sorts on tables with at least --large-table-rows rows.
+Exits non-zero when a query has a finding the baseline doesn't, so CI catches a
+lost index. Baselines are kept per database vendor; refresh with --update-baseline
+after an accepted change.
+
+Plans depend on data. With --synthetic the queries are explained against a
+throwaway test database (created like the test runner's, then destroyed) filled by
+generate_synthetic_data with the fixed SYNTHETIC_DATASET, so every machine gets the
+same findings; the committed baseline comes from that. Without it they run against
+the current database, which is useful for investigating production-like data but
+not for the baseline.
+"""
+import json
+import os
+from contextlib import contextmanager
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from books.query_plans import PlanSample, compare_to_baseline, explain_hot_queries, load_hot_queries
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'books', 'query_plans_baseline.json')
+
+# generate_synthetic_data options for --synthetic; changing them means regenerating the baseline
+SYNTHETIC_DATASET = {'readers': 1000, 'books': 5000, 'favorites_per_reader': 20, 'seed': 42}
+
+
+class Command(BaseCommand):
+    help = "Flag full scans and sorts in the hot queries' plans and compare them with the baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file (default: books/query_plans_baseline.json)')
+        parser.add_argument('--update-baseline', action='store_true', help="Write this run's findings as the baseline for this database vendor")
+        parser.add_argument('--large-table-rows', type=int, default=1000, help='Tables with at least this many rows count as large (default: 1000)')
+        parser.add_argument(
+            '--query',
+            action='append',
+            default=[],
+            help='Only hot queries whose name contains this; repeatable (default: all)',
+        )
+        parser.add_argument('--show-plans', action='store_true', help='Print every plan, not just findings')
+        parser.add_argument(
+            '--synthetic',
+            action='store_true',
+            help='Explain against a throwaway database holding the fixed synthetic dataset instead of the current one',
+        )
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            with self._synthetic_database():
+                self._check(options)
+        else:
+            if options['update_baseline']:
+                self.stdout.write(self.style.WARNING(
+                    'Writing a baseline from the current database; use --synthetic for one other machines can reproduce'
+                ))
+            self._check(options)
+
+    @contextmanager
+    def _synthetic_database(self):
+        old_name = connection.settings_dict['NAME']
+        self.stdout.write(f"Generating the synthetic dataset ({', '.join(f'{k}={v}' for k, v in SYNTHETIC_DATASET.items())})")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # One worker: an in-memory SQLite test database isn't visible to forked processes
+            call_command('generate_synthetic_data', workers=1, stdout=StringIO(), **SYNTHETIC_DATASET)
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _check(self, options):
+        sample = PlanSample.from_database()
+        if sample is None:
+            raise CommandError('No favorites in the database; load a dataset first (e.g. generate_synthetic_data)')
+        names = [
+            name for name in sorted(load_hot_queries())
+            if not options['query'] or any(part in name for part in options['query'])
+        ]
+        if not names:
+            raise CommandError('No hot query matches ' + ', '.join(options['query']))
+
+        results = explain_hot_queries(sample, options['large_table_rows'], names)
+        for name, plan, findings in results:
+            line = f"{name:<45} {', '.join(findings) or 'ok'}"
+            self.stdout.write(self.style.WARNING(line) if findings else line)
+            if options['show_plans']:
+                self.stdout.write('    ' + plan.replace('\n', '\n    '))
+
+        baselines = self._load(options['baseline'])
+        vendor = connection.vendor
+        if options['update_baseline']:
+            # With --query, the other queries keep their entries
+            current = dict(baselines.get(vendor, {})) if options['query'] else {}
+            current.update({name: findings for name, _plan, findings in results})
+            baselines[vendor] = {name: findings for name, findings in sorted(current.items()) if findings}
+            with open(options['baseline'], 'w', encoding='utf-8') as f:
+                json.dump(baselines, f, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(self.style.SUCCESS(f"Baseline for {vendor} written to {options['baseline']}"))
+            return
+
+        if vendor not in baselines:
+            raise CommandError(f'No {vendor} baseline in {options["baseline"]}; create one with --update-baseline')
+        regressions, fixed = compare_to_baseline(results, baselines[vendor])
+        for name, finding in fixed:
+            self.stdout.write(f'{name}: {finding} is gone; update the baseline to lock that in')
+        if regressions:
+            raise CommandError(
+                'Query plan regressions:\n' + '\n'.join(f'  {name}: {finding}' for name, finding in regressions)
+            )
+        self.stdout.write(self.style.SUCCESS(f'{len(results)} hot queries checked, no regressions'))
+
+    def _load(self, path):
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError as e:
+            raise CommandError(f'Could not read baseline {path}: {e}')
@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
+from django.db import transaction
+from books.favorites import favorites_removed
 from books.models import UserFavoriteBook
 
 
@@ -34,11 +36,15 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR('Deletion cancelled.'))
                 return
         
-        # Delete all favorites associated with non-superusers
-        favorites_deleted = UserFavoriteBook.objects.filter(user__is_superuser=False).delete()[0]
-        
-        # Delete the non-superuser users themselves
-        users_deleted = non_superusers.delete()[0]
+        with transaction.atomic():
+            # Delete all favorites associated with non-superusers
+            user_favorites = UserFavoriteBook.objects.filter(user__is_superuser=False)
+            removed_pairs = list(user_favorites.values_list('user_id', 'book_id'))
+            favorites_deleted = user_favorites.delete()[0]
+            favorites_removed(removed_pairs)
+            
+            # Delete the non-superuser users themselves
+            users_deleted = non_superusers.delete()[0]
         
         self.stdout.write(self.style.SUCCESS(f'Deleted {favorites_deleted} favorite book entries.'))
         self.stdout.write(self.style.SUCCESS(f'Deleted {users_deleted} user account(s).'))
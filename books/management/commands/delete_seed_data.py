@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
+from django.db import transaction
+from books.favorites import favorites_removed
 from books.models import UserFavoriteBook
 
 
@@ -17,11 +19,15 @@ class Command(BaseCommand):
             self.stdout.write(self.style.SUCCESS('No seed users found.'))
             return
         
-        # Delete all favorites associated with seed users
-        favorites_deleted = UserFavoriteBook.objects.filter(user__username__startswith='seed_user_').delete()[0]
-        
-        # Delete the seed users themselves
-        users_deleted = seed_users.delete()[0]
+        with transaction.atomic():
+            # Delete all favorites associated with seed users
+            seed_favorites = UserFavoriteBook.objects.filter(user__username__startswith='seed_user_')
+            removed_pairs = list(seed_favorites.values_list('user_id', 'book_id'))
+            favorites_deleted = seed_favorites.delete()[0]
+            favorites_removed(removed_pairs)
+            
+            # Delete the seed users themselves
+            users_deleted = seed_users.delete()[0]
         
         self.stdout.write(self.style.SUCCESS(f'Deleted {favorites_deleted} favorite book entries.'))
         self.stdout.write(self.style.SUCCESS(f'Deleted {users_deleted} seed user account(s).'))
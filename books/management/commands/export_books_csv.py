@@ -1,4 +1,6 @@
 import csv
+import sys
+
 from django.core.management.base import BaseCommand
 from books.models import Book
 
@@ -13,12 +15,24 @@ class Command(BaseCommand):
             default=None,
             help='Output CSV filename (default: stdout)',
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows fetched from the database at a time (default: 2000)',
+        )
 
     def handle(self, *args, **options):
         output_file = options['output']
         
-        # Get all books with related author data
-        books = Book.objects.select_related('author').order_by('id')
+        # Get all books with related author data; iterator() streams rows (through a
+        # server-side cursor on Postgres) instead of caching the whole table
+        books = (
+            Book.objects
+            .order_by('id')
+            .values_list('id', 'title', 'author__name', 'isbn', 'genre', 'sub_genre', 'is_popular', 'created_at')
+            .iterator(chunk_size=options['chunk_size'])
+        )
         
         # Define CSV columns
         fieldnames = [
@@ -36,33 +50,33 @@ class Command(BaseCommand):
         if output_file:
             file_handle = open(output_file, 'w', newline='', encoding='utf-8')
         else:
-            import sys
             file_handle = sys.stdout
         
+        exported = 0
         try:
-            writer = csv.DictWriter(file_handle, fieldnames=fieldnames)
-            writer.writeheader()
+            writer = csv.writer(file_handle)
+            writer.writerow(fieldnames)
             
-            for book in books:
-                writer.writerow({
-                    'id': book.id,
-                    'title': book.title,
-                    'author': book.author.name,
-                    'isbn': book.isbn or '',
-                    'genre': book.genre,
-                    'sub_genre': book.sub_genre or '',
-                    'is_popular': book.is_popular,
-                    'created_at': book.created_at.strftime('%Y-%m-%d %H:%M:%S') if book.created_at else '',
-                })
+            for book_id, title, author, isbn, genre, sub_genre, is_popular, created_at in books:
+                writer.writerow([
+                    book_id,
+                    title,
+                    author,
+                    isbn or '',
+                    genre,
+                    sub_genre or '',
+                    is_popular,
+                    created_at.strftime('%Y-%m-%d %H:%M:%S') if created_at else '',
+                ])
+                exported += 1
         finally:
             if output_file:
                 file_handle.close()
                 self.stdout.write(
                     self.style.SUCCESS(
-                        f'Successfully exported {books.count()} books to {output_file}'
+                        f'Successfully exported {exported} books to {output_file}'
                     )
                 )
             else:
                 # When writing to stdout, write success message to stderr so it doesn't interfere with CSV
-                import sys
-                sys.stderr.write(f'\nSuccessfully exported {books.count()} books\n')
+                sys.stderr.write(f'\nSuccessfully exported {exported} books\n')
@@ -8,9 +8,9 @@ On Heroku (save to file on your machine):
   heroku run "python manage.py export_top_favorited_csv --offset=99 --limit=101" --app great-minds > top_100_200.csv
 """
 import csv
+import itertools
 import sys
 from django.core.management.base import BaseCommand
-from django.db.models import Count
 from books.models import Book
 
 
@@ -44,14 +44,16 @@ class Command(BaseCommand):
 
         top_books = (
             Book.objects
-            .annotate(favorite_count=Count('favorited_by'))
             .filter(favorite_count__gt=0)
             .order_by('-favorite_count', 'title')
-            .select_related('author')[offset:offset + limit]
+            .values_list('favorite_count', 'title', 'author__name', 'isbn', 'genre', 'sub_genre')
+            [offset:offset + limit]
         )
 
-        books_list = list(top_books)
-        if not books_list:
+        # Stream rows (through a server-side cursor on Postgres) instead of building a list
+        rows = top_books.iterator(chunk_size=2000)
+        first_row = next(rows, None)
+        if first_row is None:
             self.stdout.write(self.style.WARNING('No books found in that range.'))
             return
 
@@ -61,22 +63,18 @@ class Command(BaseCommand):
         else:
             f = sys.stdout
 
+        exported = 0
         try:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            for i, book in enumerate(books_list, start=offset + 1):
-                writer.writerow({
-                    'rank': i,
-                    'favorite_count': book.favorite_count,
-                    'title': book.title,
-                    'author': book.author.name,
-                    'isbn': book.isbn or '',
-                    'genre': book.genre or '',
-                    'sub_genre': book.sub_genre or '',
-                })
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+            for i, (favorite_count, title, author, isbn, genre, sub_genre) in enumerate(
+                itertools.chain([first_row], rows), start=offset + 1
+            ):
+                writer.writerow([i, favorite_count, title, author, isbn or '', genre or '', sub_genre or ''])
+                exported += 1
         finally:
             if output_file:
                 f.close()
-                self.stdout.write(self.style.SUCCESS(f'Exported {len(books_list)} books to {output_file}'))
+                self.stdout.write(self.style.SUCCESS(f'Exported {exported} books to {output_file}'))
             else:
-                sys.stderr.write(f'\nExported {len(books_list)} books (ranks {offset + 1}-{offset + len(books_list)})\n')
+                sys.stderr.write(f'\nExported {exported} books (ranks {offset + 1}-{offset + exported})\n')
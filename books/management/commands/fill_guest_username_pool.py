@@ -0,0 +1,85 @@
+"""
+Pre-fill the guest username pool so creating a guest account is a single claim query.
+Usage:
+  python manage.py fill_guest_username_pool
+  python manage.py fill_guest_username_pool --target=5000 --batch-size=500
+
+Run it periodically (e.g. from a cron job) to top the pool back up.
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from books.models import GuestUsernamePool
+from books.utils import generate_guest_username_candidate
+
+
+class Command(BaseCommand):
+    help = "Top up the GuestUsernamePool with unique, collision-checked guest usernames"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target',
+            type=int,
+            default=1000,
+            help='Number of unclaimed usernames to keep in the pool (default: 1000)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Candidates generated and checked per batch (default: 500)',
+        )
+        parser.add_argument(
+            '--max-stale-batches',
+            type=int,
+            default=5,
+            help='Stop after this many batches in a row add no new names (default: 5)',
+        )
+
+    def handle(self, *args, **options):
+        target = options['target']
+        batch_size = options['batch_size']
+        max_stale_batches = options['max_stale_batches']
+
+        pool_size = GuestUsernamePool.objects.count()
+        needed = target - pool_size
+        if needed <= 0:
+            self.stdout.write(self.style.SUCCESS(f'Pool already has {pool_size} usernames (target: {target})'))
+            return
+
+        self.stdout.write(f'Pool has {pool_size} usernames, generating {needed} more...')
+
+        initial_size = pool_size
+        stale_batches = 0
+        while pool_size < target and stale_batches < max_stale_batches:
+            # Deduplicate in memory first, then check the whole batch with two IN queries
+            candidates = {generate_guest_username_candidate() for _ in range(batch_size)}
+            taken = set(User.objects.filter(username__in=candidates).values_list('username', flat=True))
+            taken.update(
+                GuestUsernamePool.objects.filter(username__in=candidates).values_list('username', flat=True)
+            )
+            fresh = sorted(candidates - taken)[:target - pool_size]
+
+            if not fresh:
+                stale_batches += 1
+                continue
+            stale_batches = 0
+
+            # ignore_conflicts covers a concurrent run inserting the same name; those rows
+            # are skipped, so measure progress by the pool size rather than len(fresh)
+            GuestUsernamePool.objects.bulk_create(
+                [GuestUsernamePool(username=username) for username in fresh],
+                ignore_conflicts=True,
+            )
+            new_size = GuestUsernamePool.objects.count()
+            if new_size <= pool_size:
+                stale_batches += 1
+            pool_size = new_size
+
+        final_size = pool_size
+        added = final_size - initial_size
+        if final_size < target:
+            self.stdout.write(self.style.WARNING(
+                f'Username space is nearly exhausted: added {added} of {needed} requested'
+            ))
+        self.stdout.write(self.style.SUCCESS(f'Guest username pool now has {final_size} usernames'))
@@ -0,0 +1,167 @@
+"""
+Bulk-create a synthetic dataset for benchmarks: readers, authors, books and a
+Zipf-distributed favorites graph (a few books are loved by most readers, most
+books by a handful).
+Usage:
+  python manage.py generate_synthetic_data --readers=10000 --books=50000
+  python manage.py generate_synthetic_data --readers=1000 --books=5000 --favorites-per-reader=40 --zipf=1.2
+  python manage.py generate_synthetic_data --clear
+
+Synthetic rows are recognisable by their names (synth_reader_*, "Synthetic Author *")
+and --clear replaces them. Derived data (favorite counts, co-occurrence, neighbor
+lists, site stats) is rebuilt afterwards.
+"""
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from books.favorites import rebuild_derived_data
+from books.models import Author, Book, UserFavoriteBook
+
+READER_PREFIX = 'synth_reader_'
+AUTHOR_PREFIX = 'Synthetic Author '
+TITLE_WORDS = (
+    'Silent', 'River', 'Night', 'Garden', 'Empire', 'Glass', 'Winter', 'Stone', 'Light', 'House',
+    'Shadow', 'Ocean', 'Crown', 'Letters', 'Orchard', 'Storm', 'Island', 'Paper', 'Fire', 'Station',
+)
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic readers, books and Zipf-distributed favorites for benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=1000, help='Readers to create (default: 1000)')
+        parser.add_argument('--books', type=int, default=5000, help='Books to create (default: 5000)')
+        parser.add_argument(
+            '--authors',
+            type=int,
+            default=None,
+            help='Authors to create (default: one per five books)',
+        )
+        parser.add_argument(
+            '--favorites-per-reader',
+            type=float,
+            default=20,
+            help='Mean favorites per reader; counts are exponentially distributed (default: 20)',
+        )
+        parser.add_argument(
+            '--zipf',
+            type=float,
+            default=1.1,
+            help='Zipf exponent of book popularity; higher means a heavier head (default: 1.1)',
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per bulk insert (default: 5000)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Worker processes for rebuilding neighbor lists (default: 1)',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete existing synthetic data before generating',
+        )
+
+    def handle(self, *args, **options):
+        if options['readers'] < 1 or options['books'] < 1:
+            raise CommandError('--readers and --books must be at least 1')
+        if options['clear']:
+            self._clear()
+        elif User.objects.filter(username__startswith=READER_PREFIX).exists():
+            raise CommandError('Synthetic data already exists; pass --clear to replace it')
+
+        rng = random.Random(options['seed'])
+        started = time.monotonic()
+        with transaction.atomic():
+            user_ids = self._create_readers(options['readers'], rng, options['batch_size'])
+            author_ids = self._create_authors(options['authors'] or max(options['books'] // 5, 1), options['batch_size'])
+            book_ids = self._create_books(options['books'], author_ids, rng, options['batch_size'])
+            favorites = self._create_favorites(
+                user_ids, book_ids, options['favorites_per_reader'], options['zipf'], rng, options['batch_size'],
+            )
+        self.stdout.write(
+            f'Created {len(user_ids)} readers, {len(author_ids)} authors, {len(book_ids)} books and '
+            f'{favorites} favorites in {time.monotonic() - started:.1f}s'
+        )
+        self._rebuild_derived(options['workers'])
+
+    def _clear(self):
+        with transaction.atomic():
+            users, _ = User.objects.filter(username__startswith=READER_PREFIX).delete()
+            authors, _ = Author.objects.filter(name__startswith=AUTHOR_PREFIX).delete()
+        self.stdout.write(self.style.WARNING(f'Deleted synthetic data ({users} + {authors} rows including cascades)'))
+
+    def _create_readers(self, count, rng, batch_size):
+        password = make_password(None)
+        now = timezone.now()
+        users = [
+            User(
+                username=f'{READER_PREFIX}{i}',
+                email=f'{READER_PREFIX}{i}@example.com',
+                password=password,
+                # Spread sign-ups over two months so "joined this week" has something to find
+                date_joined=now - timedelta(seconds=rng.randrange(60 * 24 * 3600)),
+            )
+            for i in range(count)
+        ]
+        User.objects.bulk_create(users, batch_size=batch_size)
+        return list(User.objects.filter(username__startswith=READER_PREFIX).order_by('id').values_list('id', flat=True))
+
+    def _create_authors(self, count, batch_size):
+        Author.objects.bulk_create([Author(name=f'{AUTHOR_PREFIX}{i}') for i in range(count)], batch_size=batch_size)
+        return list(Author.objects.filter(name__startswith=AUTHOR_PREFIX).order_by('id').values_list('id', flat=True))
+
+    def _create_books(self, count, author_ids, rng, batch_size):
+        sub_genres = [value for value, _ in Book.SUB_GENRE_CHOICES]
+        books = []
+        for i in range(count):
+            sub_genre = rng.choice(sub_genres)
+            books.append(Book(
+                title=f'The {rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)} {i}',
+                author_id=author_ids[i % len(author_ids)],
+                genre=Book.GENRE_NONFICTION if sub_genres.index(sub_genre) >= 7 else Book.GENRE_FICTION,
+                sub_genre=sub_genre,
+                is_popular=i < 200,
+            ))
+        Book.objects.bulk_create(books, batch_size=batch_size)
+        # Ordered by id, so the first books are the most popular
+        return list(Book.objects.filter(author_id__in=author_ids).order_by('id').values_list('id', flat=True))
+
+    def _create_favorites(self, user_ids, book_ids, mean, exponent, rng, batch_size):
+        cum_weights = list(accumulate(1 / rank ** exponent for rank in range(1, len(book_ids) + 1)))
+        batch = []
+        created = 0
+        for user_id in user_ids:
+            wanted = min(max(1, round(rng.expovariate(1 / mean))), len(book_ids))
+            chosen = set()
+            # Popular books repeat often, so draw in rounds until the set is full
+            for _ in range(20):
+                chosen.update(rng.choices(book_ids, cum_weights=cum_weights, k=wanted - len(chosen)))
+                if len(chosen) >= wanted:
+                    break
+            batch.extend(UserFavoriteBook(user_id=user_id, book_id=book_id) for book_id in chosen)
+            if len(batch) >= batch_size:
+                UserFavoriteBook.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        UserFavoriteBook.objects.bulk_create(batch)
+        return created + len(batch)
+
+    def _rebuild_derived(self, workers):
+        started = time.monotonic()
+        rebuild_derived_data(workers=workers)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt derived data in {time.monotonic() - started:.1f}s'))
@@ -1,13 +1,52 @@
+"""
+Import favorites from a CSV file with columns: User Name, Book Title, Book Author, Genre, Subgenre.
+Usage:
+  python manage.py import_books_csv frodo_data_19Dec.csv
+  python manage.py import_books_csv data.csv --chunk-size=10000
+  python manage.py import_books_csv data.csv --start-row=250001
+  python manage.py import_books_csv data.csv --workers=4
+  python manage.py import_books_csv data.csv --dry-run
+
+Rows are streamed in chunks. Users, authors and books already in the database are
+loaded into in-memory key maps up front, so each chunk costs a handful of bulk
+queries and is committed in its own transaction. After every chunk the last
+committed row is printed; pass it + 1 as --start-row to resume an interrupted import.
+
+Chunks only keep Book.favorite_count in step; co-occurrence, neighbor lists, MinHash
+signatures and site stats are rebuilt once after the last chunk (see
+books.favorites.rebuild_derived_data), rather than updated reader by reader.
+"""
 import csv
+import itertools
 import os
+import time
+from functools import lru_cache
 
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand
-from django.db import IntegrityError, transaction
+from django.db import transaction
 
 from books.models import Author, Book, UserFavoriteBook
+from books.favorites import favorite_counts_added, rebuild_derived_data
 from books.utils import smart_title_case
 
+# Accepted header spellings per column, compared case-insensitively
+COLUMN_ALIASES = {
+    'username': ("User Name", "username", "user"),
+    'title': ("Book Title", "title", "book title"),
+    'author': ("Book Author", "author", "book author"),
+    'genre': ("Genre", "genre"),
+    'subgenre': ("Subgenre", "subgenre", "Sub-Genre", "sub-genre"),
+}
+
+NONFICTION_VALUES = ("non-fiction", "nonfiction", "nf", "non fiction")
+
+
+@lru_cache(maxsize=100_000)
+def _clean_title(raw_title):
+    return smart_title_case(raw_title)
+
 
 class Command(BaseCommand):
     help = "Import books from CSV file with columns: User Name, Book Title, Book Author, Genre, Subgenre"
@@ -20,10 +59,36 @@ class Command(BaseCommand):
             default=None,
             help="Path to the CSV file (default: looks for CSV files in project root)",
         )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Rows imported per transaction (default: 5000)",
+        )
+        parser.add_argument(
+            "--start-row",
+            type=int,
+            default=1,
+            help="First data row to import, counting from 1 after the header (default: 1)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Worker processes for rebuilding neighbor lists after the import (default: 1)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be created without writing to the database",
+        )
 
     def handle(self, *args, **options):
         csv_path = options["csv_path"]
-        
+        chunk_size = options["chunk_size"]
+        start_row = max(options["start_row"], 1)
+        self.dry_run = options["dry_run"]
+
         # If no path provided, look for CSV files in the project root
         if not csv_path:
             base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
@@ -35,180 +100,279 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.WARNING(f'Multiple CSV files found: {csv_files}'))
                 self.stdout.write(self.style.WARNING('Using the first one. Specify the path explicitly to use a different file.'))
             csv_path = os.path.join(base_dir, csv_files[0])
-        
+
         if not os.path.exists(csv_path):
             self.stdout.write(self.style.ERROR(f'CSV file not found: {csv_path}'))
             return
-        
-        self.stdout.write(self.style.WARNING(f"Importing books from {csv_path}"))
-
-        created_users = 0
-        created_authors = 0
-        created_books = 0
-        created_favorites = 0
-        skipped_rows = 0
-
-        def get_first(row, *keys):
-            """Helper to read from any of a set of possible column names."""
-            for key in keys:
-                if key in row and row[key] is not None:
-                    return row[key]
-                # Also try case-insensitive match
-                for k in row.keys():
-                    if k.lower() == key.lower():
-                        return row[k]
-            return ""
 
+        mode = " (dry run)" if self.dry_run else ""
+        self.stdout.write(self.style.WARNING(f"Importing books from {csv_path}{mode}"))
+
+        self.counts = {'users': 0, 'authors': 0, 'books': 0, 'books_updated': 0, 'favorites': 0, 'skipped': 0}
+        self._next_placeholder_id = -1
+
+        started = time.monotonic()
+        self._load_key_maps()
+        self.stdout.write(
+            f"Loaded {len(self.user_ids)} users, {len(self.author_ids)} authors and "
+            f"{len(self.books)} books in {time.monotonic() - started:.1f}s"
+        )
+
+        rows_done = 0
+        last_row = start_row - 1
         with open(csv_path, newline="", encoding="utf-8") as f:
-            # Try to detect if there's a header row
-            sample = f.read(1024)
-            f.seek(0)
-            has_header = csv.Sniffer().has_header(sample)
-            
-            reader = csv.DictReader(f) if has_header else None
-            
-            if not reader:
-                # No header row, read as list and create header
-                f.seek(0)
-                reader = csv.reader(f)
-                # Read first row to determine structure
-                first_row = next(reader, None)
-                if not first_row or len(first_row) < 3:
-                    self.stdout.write(self.style.ERROR('CSV file must have at least 3 columns: User Name, Book Title, Book Author'))
-                    return
-                
-                # Create a reader that maps columns by position
-                fieldnames = ['User Name', 'Book Title', 'Book Author', 'Genre', 'Subgenre']
-                reader = csv.DictReader(f, fieldnames=fieldnames)
-                # Skip the first row if it was data
-                if first_row:
-                    # Reconstruct the row as a dict
-                    row_dict = {}
-                    for i, value in enumerate(first_row):
-                        if i < len(fieldnames):
-                            row_dict[fieldnames[i]] = value
-                    # Process this first row
+            reader, columns = self._open_reader(f)
+            if reader is None:
+                return
+
+            numbered_rows = itertools.islice(enumerate(reader, start=1), start_row - 1, None)
+            while True:
+                chunk = list(itertools.islice(numbered_rows, chunk_size))
+                if not chunk:
+                    break
+
+                chunk_started = time.monotonic()
+                parsed = [self._parse_row(row, columns) for _, row in chunk]
+                parsed = [row for row in parsed if row is not None]
+                if self.dry_run:
+                    self._import_chunk(parsed)
+                else:
                     with transaction.atomic():
-                        result = self._process_row(row_dict, get_first)
-                        if result:
-                            created_users += result.get('users', 0)
-                            created_authors += result.get('authors', 0)
-                            created_books += result.get('books', 0)
-                            created_favorites += result.get('favorites', 0)
-                        else:
-                            skipped_rows += 1
-
-            for row in reader:
-                # Skip completely blank lines
-                if not row or all((str(value) or "").strip() == "" for value in row.values()):
-                    continue
-
-                with transaction.atomic():
-                    result = self._process_row(row, get_first)
-                    if result:
-                        created_users += result.get('users', 0)
-                        created_authors += result.get('authors', 0)
-                        created_books += result.get('books', 0)
-                        created_favorites += result.get('favorites', 0)
-                    else:
-                        skipped_rows += 1
-
-        self.stdout.write(self.style.SUCCESS(f"\nImport complete!"))
-        self.stdout.write(self.style.SUCCESS(f"Users created:   {created_users}"))
-        self.stdout.write(self.style.SUCCESS(f"Authors created: {created_authors}"))
-        self.stdout.write(self.style.SUCCESS(f"Books created:   {created_books}"))
-        self.stdout.write(self.style.SUCCESS(f"Favorites created: {created_favorites}"))
-        if skipped_rows > 0:
-            self.stdout.write(self.style.WARNING(f"Rows skipped:    {skipped_rows}"))
-
-    def _process_row(self, row, get_first):
-        """Process a single CSV row and return counts of created objects."""
-        # Get values from CSV (handle various column name variations)
-        username = (get_first(row, "User Name", "username", "user") or "").strip()
-        raw_title = (get_first(row, "Book Title", "title", "book title") or "").strip()
-        raw_author = (get_first(row, "Book Author", "author", "book author") or "").strip()
-        raw_genre = (get_first(row, "Genre", "genre") or "").strip()
-        raw_subgenre = (get_first(row, "Subgenre", "subgenre", "Sub-Genre", "sub-genre") or "").strip()
+                        self._import_chunk(parsed)
+                chunk_elapsed = time.monotonic() - chunk_started
+
+                rows_done += len(chunk)
+                last_row = chunk[-1][0]
+                self.stdout.write(
+                    f"  Rows {chunk[0][0]}-{last_row} {'checked' if self.dry_run else 'committed'} "
+                    f"({len(chunk) / chunk_elapsed if chunk_elapsed else len(chunk):.0f} rows/s)"
+                )
+
+        if self.counts['favorites'] and not self.dry_run:
+            rebuild_started = time.monotonic()
+            self.stdout.write("Rebuilding co-occurrence, neighbor lists and site stats...")
+            rebuild_derived_data(workers=options["workers"])
+            self.stdout.write(f"  Rebuilt in {time.monotonic() - rebuild_started:.1f}s")
+
+        elapsed = time.monotonic() - started
+        verb = "would be created" if self.dry_run else "created"
+        self.stdout.write(self.style.SUCCESS(f"\nImport {'dry run ' if self.dry_run else ''}complete!"))
+        self.stdout.write(self.style.SUCCESS(f"Rows processed:  {rows_done} (last row: {last_row})"))
+        self.stdout.write(self.style.SUCCESS(f"Users {verb}:   {self.counts['users']}"))
+        self.stdout.write(self.style.SUCCESS(f"Authors {verb}: {self.counts['authors']}"))
+        self.stdout.write(self.style.SUCCESS(f"Books {verb}:   {self.counts['books']}"))
+        self.stdout.write(self.style.SUCCESS(f"Books {'to update' if self.dry_run else 'updated'}:   {self.counts['books_updated']}"))
+        self.stdout.write(self.style.SUCCESS(f"Favorites {verb}: {self.counts['favorites']}"))
+        if self.counts['skipped'] > 0:
+            self.stdout.write(self.style.WARNING(f"Rows skipped:    {self.counts['skipped']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Finished in {elapsed:.1f}s ({rows_done / elapsed if elapsed else rows_done:.0f} rows/s)"
+        ))
+
+    def _open_reader(self, f):
+        """Return a csv.reader positioned at the first data row and the column index for each field."""
+        # Try to detect if there's a header row
+        sample = f.read(1024)
+        f.seek(0)
+        try:
+            has_header = csv.Sniffer().has_header(sample)
+        except csv.Error:
+            # Ragged rows can defeat the sniffer; exports from the site always have a header
+            has_header = True
+        reader = csv.reader(f)
+
+        if not has_header:
+            # No header row: map columns by position
+            columns = {field: index for index, field in enumerate(COLUMN_ALIASES)}
+            first_row = next(reader, None)
+            if not first_row or len(first_row) < 3:
+                self.stdout.write(self.style.ERROR('CSV file must have at least 3 columns: User Name, Book Title, Book Author'))
+                return None, None
+            return itertools.chain([first_row], reader), columns
+
+        header = [name.strip().lower() for name in next(reader)]
+        columns = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            for alias in aliases:
+                if alias.lower() in header:
+                    columns[field] = header.index(alias.lower())
+                    break
+        return reader, columns
+
+    def _parse_row(self, row, columns):
+        """Return (username, title, author, genre or None, sub_genre or None), or None to skip the row."""
+        # Skip completely blank lines
+        if not row or all(not value.strip() for value in row):
+            return None
+
+        # Columns that are missing from the file (or from a short row) read as empty
+        padded = row + [''] * (max(columns.values(), default=0) + 1 - len(row)) + ['']
+        username, raw_title, raw_author, raw_genre, raw_subgenre = (
+            padded[columns.get(field, -1)].strip() for field in COLUMN_ALIASES
+        )
 
         # Validate required fields
         if not username or not raw_title or not raw_author:
+            self.counts['skipped'] += 1
             return None
 
-        counts = {'users': 0, 'authors': 0, 'books': 0, 'favorites': 0}
+        # Map raw genre to Book.GENRE_* constants; None leaves an existing book's genre alone
+        genre = None
+        if raw_genre:
+            g = raw_genre.lower()
+            genre = Book.GENRE_NONFICTION if g in NONFICTION_VALUES else Book.GENRE_FICTION
 
-        # --- USER ---
-        user, user_created = User.objects.get_or_create(
-            username=username,
-            defaults={
-                "password": User.objects.make_random_password(),
-                "is_active": True,
-            },
+        return (
+            username,
+            _clean_title(raw_title),
+            raw_author.title(),
+            genre,
+            raw_subgenre.title() if raw_subgenre else None,
         )
-        if user_created:
-            counts['users'] = 1
 
-        # --- NORMALIZE TITLE & AUTHOR ---
-        clean_title = smart_title_case(raw_title)
-        clean_author_name = raw_author.title()
+    def _load_key_maps(self):
+        """Load the natural keys of existing users, authors and books into memory."""
+        self.user_ids = dict(User.objects.values_list('username', 'id').iterator())
+
+        self.author_ids = {}
+        for author_id, name in Author.objects.order_by('id').values_list('id', 'name').iterator():
+            # Authors are matched case-insensitively; the oldest one wins
+            self.author_ids.setdefault(name.lower(), author_id)
+
+        # (lower title, author_id) -> [book_id, genre, sub_genre]
+        self.books = {}
+        for book_id, title, author_id, genre, sub_genre in (
+            Book.objects.order_by('id').values_list('id', 'title', 'author_id', 'genre', 'sub_genre').iterator()
+        ):
+            self.books.setdefault((title.lower(), author_id), [book_id, genre, sub_genre])
+
+    def _placeholder_id(self):
+        """Stand-in primary key for rows a dry run would have created."""
+        placeholder = self._next_placeholder_id
+        self._next_placeholder_id -= 1
+        return placeholder
 
-        # --- AUTHOR ---
-        author, author_created = Author.objects.get_or_create(
-            name__iexact=clean_author_name,
-            defaults={"name": clean_author_name},
+    def _import_chunk(self, rows):
+        self._create_users({row[0] for row in rows})
+        self._create_authors({row[2].lower(): row[2] for row in rows})
+        book_ids = self._create_and_update_books(rows)
+        self._create_favorites(rows, book_ids)
+
+    def _create_users(self, usernames):
+        missing = [username for username in usernames if username not in self.user_ids]
+        if not missing:
+            return
+        self.counts['users'] += len(missing)
+
+        if self.dry_run:
+            self.user_ids.update((username, self._placeholder_id()) for username in missing)
+            return
+
+        # Imported readers never log in with a password, so give them an unusable one
+        # (generated once per chunk; the random part of it is never checked)
+        unusable_password = make_password(None)
+        User.objects.bulk_create(
+            [User(username=username, password=unusable_password, is_active=True) for username in missing],
+            ignore_conflicts=True,
         )
-        if author_created:
-            counts['authors'] = 1
+        self.user_ids.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
 
-        # --- GENRE / SUB-GENRE ---
-        # Map raw genre to Book.GENRE_* constants
-        genre_value = Book.GENRE_FICTION  # default
-        if raw_genre:
-            g = raw_genre.strip().lower()
-            if g in ("non-fiction", "nonfiction", "nf", "non fiction"):
-                genre_value = Book.GENRE_NONFICTION
-            elif g in ("fiction", "fic", "f"):
-                genre_value = Book.GENRE_FICTION
-
-        clean_sub_genre = raw_subgenre.title() if raw_subgenre else None
-
-        # --- BOOK ---
-        book = Book.objects.filter(
-            title__iexact=clean_title,
-            author=author,
-        ).first()
-
-        if not book:
-            try:
-                book = Book.objects.create(
-                    title=clean_title,
-                    author=author,
-                    genre=genre_value,
-                    sub_genre=clean_sub_genre,
+    def _create_authors(self, names_by_key):
+        missing = {key: name for key, name in names_by_key.items() if key not in self.author_ids}
+        if not missing:
+            return
+        self.counts['authors'] += len(missing)
+
+        if self.dry_run:
+            self.author_ids.update((key, self._placeholder_id()) for key in missing)
+            return
+
+        Author.objects.bulk_create([Author(name=name) for name in missing.values()])
+        for author_id, name in Author.objects.filter(name__in=missing.values()).order_by('id').values_list('id', 'name'):
+            self.author_ids.setdefault(name.lower(), author_id)
+
+    def _create_and_update_books(self, rows):
+        """Create missing books and apply genre changes; return the book id for each row."""
+        new_books = {}  # key -> Book, in first-seen order
+        original = {}  # key -> (genre, sub_genre) before this chunk
+        keys = []
+        for _, title, author_name, genre, sub_genre in rows:
+            author_id = self.author_ids[author_name.lower()]
+            key = (title.lower(), author_id)
+            keys.append(key)
+
+            if key in new_books:
+                book = new_books[key]
+                book.genre = genre or book.genre
+                book.sub_genre = sub_genre or book.sub_genre
+                continue
+
+            entry = self.books.get(key)
+            if entry is None:
+                new_books[key] = Book(
+                    title=title,
+                    author_id=author_id,
+                    genre=genre or Book.GENRE_FICTION,
+                    sub_genre=sub_genre,
                 )
-                counts['books'] = 1
-            except IntegrityError:
-                # Another process/row just created the same book: fetch it
-                book = Book.objects.get(title=clean_title, author=author)
-        else:
-            # Update genre/subgenre if provided and different
-            updated = False
-            if raw_genre and book.genre != genre_value:
-                book.genre = genre_value
-                updated = True
-            if clean_sub_genre and book.sub_genre != clean_sub_genre:
-                book.sub_genre = clean_sub_genre
-                updated = True
-            if updated:
-                book.save()
-
-        # --- FAVORITE ---
-        favorite, favorite_created = UserFavoriteBook.objects.get_or_create(
-            user=user,
-            book=book,
-        )
-        if favorite_created:
-            counts['favorites'] = 1
+                continue
+
+            # Update genre/subgenre if provided; later rows win
+            if genre or sub_genre:
+                original.setdefault(key, (entry[1], entry[2]))
+                entry[1] = genre or entry[1]
+                entry[2] = sub_genre or entry[2]
+
+        if new_books:
+            self.counts['books'] += len(new_books)
+            if self.dry_run:
+                for key, book in new_books.items():
+                    self.books[key] = [self._placeholder_id(), book.genre, book.sub_genre]
+            else:
+                Book.objects.bulk_create(new_books.values(), ignore_conflicts=True)
+                for book_id, title, author_id, genre, sub_genre in (
+                    Book.objects.filter(
+                        title__in={book.title for book in new_books.values()},
+                        author_id__in={book.author_id for book in new_books.values()},
+                    ).values_list('id', 'title', 'author_id', 'genre', 'sub_genre')
+                ):
+                    self.books.setdefault((title.lower(), author_id), [book_id, genre, sub_genre])
 
-        return counts
+        changed = [key for key, values in original.items() if (self.books[key][1], self.books[key][2]) != values]
+        if changed:
+            self.counts['books_updated'] += len(changed)
+            if not self.dry_run:
+                Book.objects.bulk_update(
+                    [Book(id=self.books[key][0], genre=self.books[key][1], sub_genre=self.books[key][2]) for key in changed],
+                    ['genre', 'sub_genre'],
+                )
+
+        return [self.books[key][0] for key in keys]
+
+    def _create_favorites(self, rows, book_ids):
+        pairs = list(dict.fromkeys(
+            (self.user_ids[row[0]], book_id) for row, book_id in zip(rows, book_ids)
+        ))
+        if not pairs:
+            return
 
+        # Placeholder ids only exist in a dry run and can't have favorites yet.
+        # Readers have few favorites each, so fetching all of the chunk's users' rows
+        # is cheaper than a user x book IN filter.
+        user_ids = {user_id for user_id, _ in pairs if user_id > 0}
+        existing = set()
+        if user_ids:
+            existing = set(UserFavoriteBook.objects.filter(user_id__in=user_ids).values_list('user_id', 'book_id'))
+        new_pairs = [pair for pair in pairs if pair not in existing]
+        if not new_pairs:
+            return
+        self.counts['favorites'] += len(new_pairs)
+
+        if self.dry_run:
+            return
 
+        UserFavoriteBook.objects.bulk_create(
+            [UserFavoriteBook(user_id=user_id, book_id=book_id) for user_id, book_id in new_pairs],
+            ignore_conflicts=True,
+        )
+        favorite_counts_added(new_pairs)
@@ -5,6 +5,7 @@ from django.core.management.base import BaseCommand
 from django.db import IntegrityError
 
 from books.models import Author, Book, UserFavoriteBook
+from books.favorites import favorites_added
 from books.utils import smart_title_case
 
 
@@ -124,6 +125,7 @@ class Command(BaseCommand):
                 )
                 if favorite_created:
                     created_favorites += 1
+                    favorites_added([(user.id, book.id)])
 
         self.stdout.write(self.style.SUCCESS(f"\nImport complete!"))
         self.stdout.write(self.style.SUCCESS(f"Users created:   {created_users}"))
@@ -0,0 +1,66 @@
+"""
+Memory-map a favorites graph snapshot written by dump_graph and summarize it.
+Usage:
+  python manage.py load_graph favorites.graph
+  python manage.py load_graph favorites.graph --top=20 --no-verify
+"""
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.graph import GraphFormatError, load_favorites_graph
+
+
+class Command(BaseCommand):
+    help = "Load a favorites graph snapshot and report its contents and load time"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            type=str,
+            nargs='?',
+            default='favorites.graph',
+            help='Snapshot file to load (default: favorites.graph)',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=10,
+            help='Show this many most favorited books from the snapshot (default: 10)',
+        )
+        parser.add_argument(
+            '--no-verify',
+            action='store_true',
+            help='Skip the checksum check',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        try:
+            graph = load_favorites_graph(options['path'], verify=not options['no_verify'])
+        except (OSError, GraphFormatError) as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+
+        try:
+            self.stdout.write(self.style.SUCCESS(f"Loaded {len(graph)} favorites in {elapsed * 1000:.1f} ms"))
+            if not len(graph):
+                return
+
+            self.stdout.write(f"  Readers: {len(set(graph.user_ids))}")
+            self.stdout.write(f"  Books:   {len(graph.book_table_ids)} ({len(set(graph.book_ids))} favorited)")
+            self.stdout.write(f"  Authors: {len(graph.author_names)}")
+            first = datetime.fromtimestamp(min(graph.created_at), tz=timezone.utc)
+            last = datetime.fromtimestamp(max(graph.created_at), tz=timezone.utc)
+            self.stdout.write(f"  Favorites from {first:%Y-%m-%d} to {last:%Y-%m-%d}")
+
+            if options['top']:
+                book_info = graph.book_info()
+                self.stdout.write(f"\nTop {options['top']} most favorited books:")
+                for rank, (book_id, count) in enumerate(Counter(graph.book_ids).most_common(options['top']), start=1):
+                    title, author = book_info.get(book_id, ('(unknown book)', ''))
+                    self.stdout.write(f"  {rank}. {title} — {author} ({count})")
+        finally:
+            graph.close()
@@ -0,0 +1,150 @@
+"""
+Closed-loop load test against the app, with a local Google Books stand-in.
+Usage:
+  python manage.py loadtest
+  python manage.py loadtest --users=20 --duration=60 --mix=homepage=50,autocomplete=50
+  python manage.py loadtest --google-latency-ms=800 --google-429-rate=0.1 --output=load.json
+  python manage.py loadtest --url=http://127.0.0.1:8000 --google-stub-port=8123 --server-pid=<gunicorn master pid>
+
+Without --url the app is served in-process (threaded WSGI server, one process)
+with GOOGLE_BOOKS_API_URL pointed at the stub. With --url the target must be
+started with GOOGLE_BOOKS_API_URL=http://127.0.0.1:<stub port>/books/v1/volumes
+to use the stub. Reports throughput, p50/p95/p99 latency and error rate per
+scenario (see books.benchmarks.loadtest). --server-pid adds the memory of that
+process and its workers before and after the run (Linux).
+
+The add_favorite and recommendations scenarios create guest accounts and
+favorites: run against a scratch database, or clean up with purge_guest_users.
+"""
+import json
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.test.utils import override_settings
+
+from books.benchmarks.google_books_server import GoogleBooksStubServer
+from books.benchmarks.loadtest import DEFAULT_MIX, load_catalog, parse_mix, run_load_test, server_memory
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Load test the app with concurrent virtual users and report latency percentiles per scenario"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=None, help='Base URL of a running server (default: serve the app in-process)')
+        parser.add_argument('--users', type=int, default=10, help='Concurrent virtual users (default: 10)')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run (default: 30)')
+        parser.add_argument(
+            '--mix',
+            default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+            help='Scenario weights (default: %(default)s)',
+        )
+        parser.add_argument('--think-time-ms', type=float, default=100, help='Mean pause between scenarios (default: 100)')
+        parser.add_argument('--google-latency-ms', type=float, default=200, help='Google Books stub latency (default: 200)')
+        parser.add_argument('--google-429-rate', type=float, default=0.0, help='Share of stub responses that are 429 (default: 0.0)')
+        parser.add_argument('--google-stub-port', type=int, default=0, help='Port for the Google Books stub (default: any free port)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument('--server-pid', type=int, default=None, help='Report memory of this process and its workers (with --url)')
+        parser.add_argument('--output', default=None, help='Write the summary to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be at least 1')
+        if options['duration'] <= 0:
+            raise CommandError('--duration must be positive')
+        if not 0 <= options['google_429_rate'] <= 1:
+            raise CommandError('--google-429-rate must be between 0 and 1')
+        if options['server_pid'] and not options['url']:
+            raise CommandError('--server-pid needs --url (the in-process server has no workers)')
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        catalog = load_catalog()
+        stub = GoogleBooksStubServer(
+            port=options['google_stub_port'],
+            latency_ms=options['google_latency_ms'],
+            rate_limited_ratio=options['google_429_rate'],
+            seed=options['seed'],
+        ).start()
+        self.stdout.write(f'Google Books stub at {stub.url}')
+        memory_before = server_memory(options['server_pid']) if options['server_pid'] else None
+        try:
+            if options['url']:
+                summary = self._run(options['url'], mix, catalog, options)
+            else:
+                with override_settings(GOOGLE_BOOKS_API_URL=stub.url):
+                    summary = self._run_in_process(mix, catalog, options)
+        finally:
+            stub.stop()
+
+        summary['google_books_stub'] = {'requests': stub.requests, 'rate_limited': stub.rate_limited}
+        if options['server_pid']:
+            summary['server_memory'] = {'before': memory_before, 'after': server_memory(options['server_pid'])}
+        summary['options'] = {
+            key: options[key]
+            for key in ('url', 'users', 'duration', 'think_time_ms', 'google_latency_ms', 'google_429_rate', 'seed')
+        }
+        summary['options']['mix'] = mix
+        self._print_summary(summary)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Results written to {options['output']}")
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def _run_in_process(self, mix, catalog, options):
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler, allow_reuse_address=True)
+        server.set_app(get_internal_wsgi_application())
+        thread = threading.Thread(target=server.serve_forever, name='loadtest-app', daemon=True)
+        thread.start()
+        try:
+            host, port = server.server_address[:2]
+            return self._run(f'http://{host}:{port}', mix, catalog, options)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def _run(self, base_url, mix, catalog, options):
+        self.stdout.write(
+            f"{options['users']} virtual users against {base_url} for {options['duration']:g}s "
+            f"(Google Books stub: {options['google_latency_ms']:g}ms, {options['google_429_rate']:.0%} 429s)"
+        )
+        return run_load_test(
+            base_url, options['users'], options['duration'], mix, catalog,
+            think_time_ms=options['think_time_ms'], seed=options['seed'],
+        )
+
+    def _print_summary(self, summary):
+        self.stdout.write(
+            f"\n{'scenario':<17} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>8}"
+        )
+        rows = list(summary['scenarios'].items()) + [('total', summary['total'])]
+        for name, row in rows:
+            line = (
+                f"{name:<17} {row['requests']:>8} {row['throughput_rps']:>8.2f} {self._ms(row['p50_ms'])} "
+                f"{self._ms(row['p95_ms'])} {self._ms(row['p99_ms'])} {row['error_rate']:>8.1%}"
+            )
+            self.stdout.write(self.style.WARNING(line) if row['errors'] else line)
+        google = summary['google_books_stub']
+        self.stdout.write(
+            f"\nGoogle Books stub: {google['requests']} requests, {google['rate_limited']} rate limited"
+        )
+        if 'server_memory' in summary:
+            self.stdout.write(f"\n{'process':<16} {'RSS MB':>16} {'PSS MB':>16} {'private MB':>16}   (before -> after)")
+            before = {process['pid']: process for process in summary['server_memory']['before']}
+            for process in summary['server_memory']['after']:
+                old = before.get(process['pid'], {})
+                self.stdout.write(f"{process['role'] + ' ' + str(process['pid']):<16} " + ' '.join(
+                    f"{old.get(key, '-'):>7} -> {process[key]:<6}" for key in ('rss_mb', 'pss_mb', 'private_mb')
+                ))
+
+    @staticmethod
+    def _ms(value):
+        return f'{value:>8.1f}' if value is not None else f"{'-':>8}"
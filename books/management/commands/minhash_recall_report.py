@@ -0,0 +1,94 @@
+"""
+Compare the approximate (MinHash/LSH) similar-reader engine with the exact one.
+Usage:
+  python manage.py minhash_recall_report
+  python manage.py minhash_recall_report --sample=500 --k=20 --seed=7
+
+For a random sample of readers, computes each reader's top-K neighbors with both
+engines and reports recall@K of the approximate engine (the share of exact
+neighbors it also found), how many candidates it re-ranked, and per-reader latency.
+Needs signatures (rebuild_minhash_signatures) but not RECOMMENDATION_ENGINE=minhash.
+"""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.minhash import candidate_readers, minhash_sizes
+from books.models import LSHBucket, UserFavoriteBook
+from books.neighbors import neighbors_k, similar_readers
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+class Command(BaseCommand):
+    help = "Report recall and latency of the MinHash/LSH neighbor engine against exact overlap"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sample',
+            type=int,
+            default=200,
+            help='Number of readers to test (default: 200)',
+        )
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=None,
+            help='Neighbors per reader (default: USER_NEIGHBORS_K)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Random seed for choosing readers',
+        )
+
+    def handle(self, *args, **options):
+        if not LSHBucket.objects.exists():
+            raise CommandError('No MinHash signatures found. Run rebuild_minhash_signatures first.')
+        k = options['k'] or neighbors_k()
+
+        reader_ids = list(UserFavoriteBook.objects.order_by().values_list('user_id', flat=True).distinct())
+        random.Random(options['seed']).shuffle(reader_ids)
+        reader_ids = reader_ids[:options['sample']]
+
+        recalls = []
+        exact_ms = []
+        approx_ms = []
+        candidates = []
+        for user_id in reader_ids:
+            started = time.perf_counter()
+            exact = similar_readers(user_id, k, engine='exact')
+            exact_ms.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            approx = similar_readers(user_id, k, engine='minhash')
+            approx_ms.append((time.perf_counter() - started) * 1000)
+
+            candidates.append(candidate_readers(user_id).exclude(user_id=user_id).distinct().count())
+            if exact:
+                found = {neighbor_id for neighbor_id, *_ in approx}
+                recalls.append(sum(1 for neighbor_id, *_ in exact if neighbor_id in found) / len(exact))
+
+        if not reader_ids:
+            self.stdout.write(self.style.WARNING('No readers with favorites to test'))
+            return
+
+        permutations, bands = minhash_sizes()
+        self.stdout.write(f'{len(reader_ids)} readers, top {k} neighbors, {permutations} permutations in {bands} bands')
+        self.stdout.write(
+            f'  {f"recall@{k}:":<17}mean {statistics.mean(recalls) if recalls else 0:.3f}, '
+            f'p10 {_percentile(recalls, 0.1):.3f}'
+        )
+        self.stdout.write(f'  {"candidates:":<17}mean {statistics.mean(candidates):.1f}, max {max(candidates)}')
+        for label, timings in (('exact', exact_ms), ('minhash', approx_ms)):
+            self.stdout.write(
+                f'  {label + " latency:":<17}p50 {_percentile(timings, 0.5):.2f}ms, '
+                f'p95 {_percentile(timings, 0.95):.2f}ms, mean {statistics.mean(timings):.2f}ms'
+            )
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -2,7 +2,6 @@ import csv
 import time
 import requests
 from django.core.management.base import BaseCommand
-from django.db.models import Count
 from django.db import IntegrityError
 from books.models import Book, Author
 from books.utils import smart_title_case
@@ -86,12 +85,11 @@ class Command(BaseCommand):
         Book.objects.update(is_popular=False)
         
         # Get top books by number of favorites
-        top_books = Book.objects.annotate(
-            favorite_count=Count('favorited_by')
-        ).order_by('-favorite_count')[:top_n]
+        book_ids = list(
+            Book.objects.order_by('-favorite_count').values_list('id', flat=True)[:top_n]
+        )
         
         # Mark them as popular
-        book_ids = [b.id for b in top_books]
         if book_ids:
             Book.objects.filter(id__in=book_ids).update(is_popular=True)
             self.stdout.write(self.style.SUCCESS(f'Marked {len(book_ids)} books as popular'))
@@ -0,0 +1,143 @@
+"""
+Precompute every active reader's recommendations with a pool of worker processes.
+Usage:
+  python manage.py precompute_recommendations
+  python manage.py precompute_recommendations --workers=8 --time-budget=1800
+  python manage.py precompute_recommendations --since
+  python manage.py precompute_recommendations --since=2026-01-31T00:00
+
+Readers are split into chunks handed to --workers processes; each worker opens its
+own database connection, computes recommendations with the configured engine and
+scoring, and upserts them into PrecomputedRecommendations. The recommendations page
+serves those results until the reader's favorites change.
+
+--since limits the run to readers touched since the last run (or the given time):
+readers who added favorites, readers with one of them as a neighbor, and readers
+without stored results.
+"""
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from books.models import PrecomputedRecommendations, UserFavoriteBook, UserNeighbor
+from books.recommendations import precompute_recommendations
+
+
+def _init_worker():
+    # Drop connection objects inherited from the parent so each worker opens its own
+    connections.close_all()
+
+
+def _precompute_chunk(args):
+    """Worker entry point. Returns (per-user compute seconds, readers skipped for the time budget)."""
+    user_ids, deadline = args
+    if deadline is not None and time.time() >= deadline:
+        return [], len(user_ids)
+    return list(precompute_recommendations(user_ids).values()), 0
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+class Command(BaseCommand):
+    help = "Precompute recommendations for active readers in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes (default: number of CPUs)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Readers per unit of work handed to a worker (default: 200)',
+        )
+        parser.add_argument(
+            '--since',
+            nargs='?',
+            const='last',
+            default=None,
+            help='Only readers touched since the last run, or since the given ISO datetime',
+        )
+        parser.add_argument(
+            '--time-budget',
+            type=float,
+            default=None,
+            help='Stop starting new chunks after this many seconds (default: no limit)',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--workers and --chunk-size must be at least 1')
+
+        readers = UserFavoriteBook.objects.filter(user__is_active=True)
+        since = self._since(options['since'])
+        if since is not None:
+            changed = UserFavoriteBook.objects.filter(created_at__gte=since).values('user_id')
+            readers = readers.filter(
+                Q(user_id__in=changed)
+                | Q(user_id__in=UserNeighbor.objects.filter(neighbor_id__in=changed).values('user_id'))
+                | ~Q(user_id__in=PrecomputedRecommendations.objects.values('user_id'))
+            )
+            self.stdout.write(f'Readers touched since {since:%Y-%m-%d %H:%M}')
+        user_ids = list(readers.order_by('user_id').values_list('user_id', flat=True).distinct())
+        if not user_ids:
+            self.stdout.write(self.style.SUCCESS('No readers to precompute'))
+            return
+
+        chunk_size = options['chunk_size']
+        started = time.monotonic()
+        deadline = time.time() + options['time_budget'] if options['time_budget'] is not None else None
+        chunks = [(user_ids[i:i + chunk_size], deadline) for i in range(0, len(user_ids), chunk_size)]
+
+        timings = []
+        skipped = 0
+        workers = min(options['workers'], len(chunks))
+        if workers > 1:
+            # Children must not share the parent's connections
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers, initializer=_init_worker) as pool:
+                results = pool.imap_unordered(_precompute_chunk, chunks)
+                for chunk_timings, chunk_skipped in results:
+                    timings.extend(chunk_timings)
+                    skipped += chunk_skipped
+        else:
+            for chunk in chunks:
+                chunk_timings, chunk_skipped = _precompute_chunk(chunk)
+                timings.extend(chunk_timings)
+                skipped += chunk_skipped
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{len(timings)} readers with {workers} worker(s) in {elapsed:.2f}s '
+            f'({len(timings) / elapsed if elapsed else len(timings):.0f} readers/s); '
+            f'per reader p50 {_percentile(timings, 0.5) * 1000:.1f}ms, p99 {_percentile(timings, 0.99) * 1000:.1f}ms'
+        )
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Time budget reached; {skipped} reader(s) were not precomputed. Run again with --since to continue.'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('Done'))
+
+    def _since(self, value):
+        if value is None:
+            return None
+        if value == 'last':
+            # No previous run means every reader is due
+            return PrecomputedRecommendations.objects.aggregate(last=Max('computed_at'))['last']
+        since = parse_datetime(value)
+        if since is None:
+            raise CommandError(f'--since must be an ISO datetime, got {value!r}')
+        return timezone.make_aware(since) if timezone.is_naive(since) else since
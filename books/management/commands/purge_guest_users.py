@@ -0,0 +1,167 @@
+"""
+Delete abandoned guest accounts (and their favorites) in small batches.
+Usage:
+  python manage.py purge_guest_users --dry-run
+  python manage.py purge_guest_users --retention-days=30 --chunk-size=500 --time-budget=300
+  python manage.py purge_guest_users --archive=purged_guests.jsonl
+
+Guests are only reachable through their session cookie, so once the session has
+expired the account can never be used again. Each chunk is deleted in its own short
+transaction, so this is safe to run against the live database.
+"""
+import json
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from books.favorites import favorites_removed
+from books.models import GuestAccount, UserFavoriteBook
+
+
+class Command(BaseCommand):
+    help = "Purge guest accounts with no login and no activity within the retention window"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=30,
+            help='Keep guests active within this many days (default: 30)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Guest accounts deleted per transaction (default: 500)',
+        )
+        parser.add_argument(
+            '--time-budget',
+            type=float,
+            default=None,
+            help='Stop starting new chunks after this many seconds (default: no limit)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.0,
+            help='Seconds to pause between chunks to reduce load (default: 0)',
+        )
+        parser.add_argument(
+            '--archive',
+            type=str,
+            default=None,
+            help='Append purged guests and their favorites to this JSON Lines file before deleting',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many guest accounts would be purged',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        time_budget = options['time_budget']
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+
+        candidates = self._candidates(cutoff)
+
+        if options['dry_run']:
+            guest_count = candidates.count()
+            favorites_count = UserFavoriteBook.objects.filter(user_id__in=candidates.values('user_id')).count()
+            self.stdout.write(self.style.WARNING(
+                f'Would purge {guest_count} guest account(s) with {favorites_count} favorite(s) '
+                f'inactive since {cutoff:%Y-%m-%d %H:%M}'
+            ))
+            return
+
+        archive = open(options['archive'], 'a', encoding='utf-8') if options['archive'] else None
+        started = time.monotonic()
+        users_deleted = 0
+        favorites_deleted = 0
+        chunks = 0
+
+        try:
+            while True:
+                if time_budget is not None and time.monotonic() - started >= time_budget:
+                    self.stdout.write(self.style.WARNING('Time budget reached, stopping. Run again to continue.'))
+                    break
+
+                user_ids = list(candidates.order_by('last_active_at').values_list('user_id', flat=True)[:chunk_size])
+                if not user_ids:
+                    break
+
+                if archive:
+                    self._archive(archive, user_ids)
+
+                chunk_started = time.monotonic()
+                with transaction.atomic():
+                    guest_favorites = UserFavoriteBook.objects.filter(user_id__in=user_ids)
+                    removed_pairs = list(guest_favorites.values_list('user_id', 'book_id'))
+                    chunk_favorites, _ = guest_favorites.delete()
+                    User.objects.filter(id__in=user_ids).delete()
+                    favorites_removed(removed_pairs)
+                chunk_elapsed = time.monotonic() - chunk_started
+
+                chunks += 1
+                users_deleted += len(user_ids)
+                favorites_deleted += chunk_favorites
+                rows = len(user_ids) + chunk_favorites
+                self.stdout.write(
+                    f'  Chunk {chunks}: {len(user_ids)} guests, {chunk_favorites} favorites '
+                    f'({rows / chunk_elapsed if chunk_elapsed else rows:.0f} rows/s)'
+                )
+
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        finally:
+            if archive:
+                archive.close()
+
+        elapsed = time.monotonic() - started
+        total_rows = users_deleted + favorites_deleted
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {users_deleted} guest account(s) and {favorites_deleted} favorite(s) '
+            f'in {elapsed:.1f}s ({total_rows / elapsed if elapsed else total_rows:.0f} rows/s)'
+        ))
+
+    def _candidates(self, cutoff):
+        """Guest markers that are past the retention window and were never used to log in."""
+        recently_active_users = UserFavoriteBook.objects.filter(created_at__gte=cutoff).values('user_id')
+        return (
+            GuestAccount.objects
+            .filter(
+                last_active_at__lt=cutoff,
+                user__last_login__isnull=True,
+                user__is_staff=False,
+                user__is_superuser=False,
+            )
+            .exclude(user_id__in=recently_active_users)
+        )
+
+    def _archive(self, archive, user_ids):
+        """Write one JSON line per guest with their favorites."""
+        favorites = {}
+        for user_id, book_id, title, author, explanation, created_at in (
+            UserFavoriteBook.objects.filter(user_id__in=user_ids)
+            .values_list('user_id', 'book_id', 'book__title', 'book__author__name', 'explanation', 'created_at')
+        ):
+            favorites.setdefault(user_id, []).append({
+                'book_id': book_id,
+                'title': title,
+                'author': author,
+                'explanation': explanation,
+                'created_at': created_at.isoformat(),
+            })
+
+        for user_id, username, date_joined in User.objects.filter(id__in=user_ids).values_list('id', 'username', 'date_joined'):
+            archive.write(json.dumps({
+                'user_id': user_id,
+                'username': username,
+                'date_joined': date_joined.isoformat(),
+                'favorites': favorites.get(user_id, []),
+            }) + '\n')
+        archive.flush()
@@ -0,0 +1,33 @@
+"""
+Recompute the BookCooccurrence table from UserFavoriteBook.
+Usage:
+  python manage.py rebuild_book_cooccurrence
+  python manage.py rebuild_book_cooccurrence --batch-size=10000
+
+The table is normally kept up to date by books.favorites; run this after bulk
+changes that bypass it (raw SQL, loaddata) or to repair drift.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.cooccurrence import rebuild_book_cooccurrence
+
+
+class Command(BaseCommand):
+    help = "Recompute book-pair co-occurrence counts used by 'also loved' recommendations"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per bulk insert (default: 5000)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = rebuild_book_cooccurrence(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {rows} co-occurrence rows in {time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,48 @@
+"""
+Recompute every reader's MinHash signature and LSH buckets (see books/minhash.py).
+Usage:
+  python manage.py rebuild_minhash_signatures
+  python manage.py rebuild_minhash_signatures --neighbors
+
+Run it before setting RECOMMENDATION_ENGINE=minhash, and after changing
+MINHASH_PERMUTATIONS or MINHASH_BANDS. Signatures are kept up to date by
+favorite changes only while the minhash engine is on.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.minhash import minhash_sizes, rebuild_signatures
+from books.neighbors import rebuild_user_neighbors
+
+
+class Command(BaseCommand):
+    help = "Recompute MinHash signatures and LSH buckets for every reader"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Readers written per batch (default: 1000)',
+        )
+        parser.add_argument(
+            '--neighbors',
+            action='store_true',
+            help='Rebuild the UserNeighbor table afterwards with the configured engine',
+        )
+
+    def handle(self, *args, **options):
+        permutations, bands = minhash_sizes()
+        started = time.monotonic()
+        readers = rebuild_signatures(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote signatures for {readers} readers ({permutations} permutations, {bands} bands) '
+            f'in {time.monotonic() - started:.2f}s'
+        ))
+        if options['neighbors']:
+            started = time.monotonic()
+            readers, rows = rebuild_user_neighbors()
+            self.stdout.write(self.style.SUCCESS(
+                f'Wrote {rows} neighbors for {readers} readers in {time.monotonic() - started:.2f}s'
+            ))
@@ -0,0 +1,62 @@
+"""
+Recompute every reader's top-K similar readers (the UserNeighbor table).
+Usage:
+  python manage.py rebuild_user_neighbors
+  python manage.py rebuild_user_neighbors --workers=4
+  python manage.py rebuild_user_neighbors --k=100
+
+Neighbor lists are kept up to date as favorites change, but removals can leave a
+reader with fewer or weaker neighbors than a full recompute would find, and some
+stored scores go stale (see books.neighbors), so run this from cron (e.g. nightly)
+and after changing RECOMMENDATION_SCORING.
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.neighbors import neighbors_k, rebuild_user_neighbors
+
+
+class Command(BaseCommand):
+    help = "Recompute each reader's most similar readers by the configured scoring strategy"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes computing neighbor lists (default: number of CPUs)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Readers per unit of work handed to a worker (default: 500)',
+        )
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=None,
+            help='Neighbors kept per reader (default: USER_NEIGHBORS_K)',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--workers and --chunk-size must be at least 1')
+        k = options['k'] or neighbors_k()
+
+        started = time.monotonic()
+
+        def progress(done, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {done}/{total} readers')
+
+        readers, rows = rebuild_user_neighbors(
+            workers=options['workers'], chunk_size=options['chunk_size'], k=k, progress=progress,
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {rows} neighbors (top {k}) for {readers} readers with {options["workers"]} worker(s) '
+            f'in {elapsed:.2f}s ({readers / elapsed if elapsed else readers:.0f} readers/s)'
+        ))
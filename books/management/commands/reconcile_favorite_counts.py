@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from books.favorites import reconcile_favorite_counts
+
+
+class Command(BaseCommand):
+    help = "Recompute Book.favorite_count from UserFavoriteBook and fix any drift"
+
+    def handle(self, *args, **options):
+        fixed = reconcile_favorite_counts()
+        if fixed:
+            self.stdout.write(self.style.WARNING(f'Corrected favorite_count on {fixed} book(s)'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All favorite counts are in sync'))
@@ -0,0 +1,33 @@
+"""
+Rebuild the homepage statistics snapshot.
+Usage:
+  python manage.py refresh_site_stats
+  python manage.py refresh_site_stats --if-stale   # e.g. every minute from cron
+"""
+from django.core.management.base import BaseCommand
+
+from books.stats import refresh_site_stats, refresh_site_stats_if_stale
+
+
+class Command(BaseCommand):
+    help = "Recompute the SiteStats snapshot shown on the homepage and How It Works page"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--if-stale',
+            action='store_true',
+            help='Only refresh if favorites changed since the last refresh',
+        )
+
+    def handle(self, *args, **options):
+        if options['if_stale']:
+            stats = refresh_site_stats_if_stale()
+            if stats is None:
+                self.stdout.write('Site stats are up to date')
+                return
+        else:
+            stats = refresh_site_stats()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Site stats refreshed: {stats.unique_readers} readers, {stats.total_favorites} favorites'
+        ))
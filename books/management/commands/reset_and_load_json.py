@@ -1,11 +1,82 @@
+"""
+Delete all data except superusers, then load a dumpdata-style JSON fixture.
+Usage:
+  python manage.py reset_and_load_json data.json
+  python manage.py reset_and_load_json data.json --noinput --batch-size=5000
+
+The fixture is parsed incrementally, so memory use stays flat no matter how large
+the file is. Superusers in the fixture are skipped and references to them are
+remapped to the existing superuser with the same username. Users, authors, books
+and favorites are bulk-inserted in that order; other models are saved one by one
+as loaddata would.
+"""
 import json
-import os
-import tempfile
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.core import serializers
 from django.core.management.base import BaseCommand
-from django.core.management import call_command
+from django.core.management.color import no_style
 from django.contrib.auth.models import User
+from books.favorites import rebuild_derived_data
 from books.models import Author, Book, UserFavoriteBook
-from django.db import transaction
+from django.db import connection, transaction
+
+# Tables emptied before loading, in foreign key dependency order
+BULK_MODELS = ['auth.user', 'books.author', 'books.book', 'books.userfavoritebook']
+
+
+def iter_json_array(f, read_size=1 << 16):
+    """Yield the elements of a top-level JSON array one at a time without reading the whole file."""
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        data = f.read(read_size)
+        if not data:
+            eof = True
+        buf = buf[pos:] + data
+        pos = 0
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    fill()
+    skip(' \t\r\n')
+    if pos >= len(buf) or buf[pos] != '[':
+        raise ValueError('Fixture must be a JSON array')
+    pos += 1
+
+    while True:
+        skip(' \t\r\n,')
+        if pos >= len(buf):
+            raise ValueError('Unexpected end of fixture')
+        if buf[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The element continues past the buffered data
+            fill()
+            continue
+        if end == len(buf) and not eof:
+            # A number ending the buffer may have more digits in the next read
+            fill()
+            continue
+        pos = end
+        yield item
 
 
 class Command(BaseCommand):
@@ -22,6 +93,12 @@ class Command(BaseCommand):
             action='store_true',
             help='Skip confirmation prompt',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Fixture objects buffered before they are written (default: 2000)',
+        )
 
     def handle(self, *args, **options):
         json_file = options['json_file']
@@ -75,112 +152,161 @@ class Command(BaseCommand):
         
         # Now load the JSON file, but filter out superusers to avoid conflicts
         self.stdout.write(self.style.WARNING(f'\nLoading data from {json_file}...'))
-        
+
         try:
-            # Get mapping of superuser usernames to their existing pks
-            existing_superusers = {
-                username: pk for username, pk in 
-                User.objects.filter(is_superuser=True).values_list('username', 'pk')
-            }
-            existing_superuser_usernames = set(existing_superusers.keys())
-            
-            # Read the JSON file
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # Build a mapping of JSON superuser pks to existing superuser pks
-            # This is needed to update foreign key references in UserFavoriteBook
-            superuser_pk_mapping = {}
-            superuser_data = None  # Store superuser data from JSON if no superuser exists
-            
-            # Filter out superusers from the data and build the mapping
-            filtered_data = []
-            superusers_skipped = 0
-            for item in data:
-                # Handle superusers - skip them but record the pk mapping
-                if item.get('model') == 'auth.user':
-                    username = item.get('fields', {}).get('username', '')
-                    is_superuser = item.get('fields', {}).get('is_superuser', False)
-                    json_pk = item.get('pk')
-                    
-                    if is_superuser or username in existing_superuser_usernames:
-                        # If superuser exists, map the JSON pk to the existing superuser pk
-                        if username in existing_superusers:
-                            existing_pk = existing_superusers[username]
-                            if json_pk != existing_pk:
-                                superuser_pk_mapping[json_pk] = existing_pk
-                        else:
-                            # No superuser exists - store the data to create it later
-                            superuser_data = item
-                        superusers_skipped += 1
-                        continue
-                
-                filtered_data.append(item)
-            
-            # If no superuser exists but we have superuser data, create it
-            if not existing_superusers and superuser_data:
-                self.stdout.write(self.style.WARNING('No superuser found. Creating superuser from JSON data...'))
-                user_fields = superuser_data.get('fields', {})
-                User.objects.create_superuser(
-                    username=user_fields.get('username', 'admin'),
-                    email=user_fields.get('email', ''),
-                    password='changeme123!'  # Set a default password - user should change it
-                )
-                new_superuser = User.objects.get(username=user_fields.get('username'))
-                superuser_pk_mapping[superuser_data.get('pk')] = new_superuser.pk
-                self.stdout.write(self.style.SUCCESS(f'Created superuser: {new_superuser.username} (pk={new_superuser.pk})'))
-                self.stdout.write(self.style.WARNING('IMPORTANT: Change the superuser password after first login!'))
-            
-            # Collect all superuser pks from JSON for reference
-            json_superuser_pks = set()
-            for item in data:
-                if item.get('model') == 'auth.user':
-                    if item.get('fields', {}).get('is_superuser') or item.get('fields', {}).get('username') in existing_superuser_usernames:
-                        json_superuser_pks.add(item.get('pk'))
-            
-            # Update foreign key references in UserFavoriteBook entries
-            # If they reference a superuser pk from JSON, map it to the existing superuser pk
-            # If no mapping exists (superuser doesn't exist and wasn't created), skip those entries
-            favorites_skipped = 0
-            final_filtered_data = []
-            for item in filtered_data:
-                if item.get('model') == 'books.userfavoritebook':
-                    user_pk = item.get('fields', {}).get('user')
-                    if user_pk in superuser_pk_mapping:
-                        item['fields']['user'] = superuser_pk_mapping[user_pk]
-                        final_filtered_data.append(item)
-                    elif user_pk in json_superuser_pks:
-                        # This references a superuser that we couldn't map - skip it
-                        favorites_skipped += 1
-                        continue
-                    else:
-                        final_filtered_data.append(item)
-                else:
-                    final_filtered_data.append(item)
-            
-            if favorites_skipped > 0:
-                self.stdout.write(self.style.WARNING(f'Skipped {favorites_skipped} UserFavoriteBook entries that reference unmapped superusers.'))
-            
-            filtered_data = final_filtered_data
-            
-            if superusers_skipped > 0:
-                self.stdout.write(self.style.WARNING(f'Skipped {superusers_skipped} superuser(s) from JSON file to avoid conflicts.'))
-            
-            # Create a temporary file with filtered data
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False, encoding='utf-8') as temp_file:
-                json.dump(filtered_data, temp_file, indent=2, ensure_ascii=False)
-                temp_file_path = temp_file.name
-            
-            try:
-                # Use Django's loaddata command with the filtered JSON
-                call_command('loaddata', temp_file_path, verbosity=1)
-                self.stdout.write(self.style.SUCCESS('\nData loaded successfully!'))
-            finally:
-                # Clean up temporary file
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
-                    
+            with open(json_file, 'r', encoding='utf-8') as f, transaction.atomic():
+                self._load(iter_json_array(f), options['batch_size'])
+            # Favorites were bulk inserted without going through books.favorites, and
+            # fixtures may predate Book.favorite_count, so recompute everything
+            rebuild_derived_data()
+            self.stdout.write(self.style.SUCCESS('\nData loaded successfully!'))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'\nError loading data: {str(e)}'))
             raise
 
+    def _load(self, items, batch_size):
+        # Get mapping of superuser usernames to their existing pks
+        self.existing_superusers = dict(User.objects.filter(is_superuser=True).values_list('username', 'pk'))
+        self.superuser_pk_mapping = {}  # JSON superuser pk -> existing superuser pk
+        self.json_superuser_pks = set()
+        self.superusers_skipped = 0
+        self.skipped_references = 0
+
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+        self.model_order = list(BULK_MODELS)
+        self.loaded = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.started = time.monotonic()
+
+        for item in items:
+            label = item.get('model', '').lower()
+            if label == 'auth.user' and self._skip_superuser(item):
+                continue
+            if not self._remap_user_references(label, item):
+                self.skipped_references += 1
+                continue
+
+            if label not in self.model_order:
+                self.model_order.append(label)
+            self.buffers[label].append(item)
+            self.buffered += 1
+            if self.buffered >= batch_size:
+                self._flush()
+        self._flush()
+
+        # Explicit pks were inserted, so move the id sequences past them (a no-op on SQLite)
+        models = [apps.get_model(label) for label in self.model_order if self.loaded[label]]
+        sequence_sql = connection.ops.sequence_reset_sql(no_style(), models)
+        if sequence_sql:
+            with connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+
+        if self.skipped_references > 0:
+            self.stdout.write(self.style.WARNING(f'Skipped {self.skipped_references} entries that reference unmapped superusers.'))
+        if self.superusers_skipped > 0:
+            self.stdout.write(self.style.WARNING(f'Skipped {self.superusers_skipped} superuser(s) from JSON file to avoid conflicts.'))
+
+        for label in self.model_order:
+            if self.loaded[label]:
+                seconds = self.seconds[label]
+                rate = self.loaded[label] / seconds if seconds else self.loaded[label]
+                self.stdout.write(self.style.SUCCESS(
+                    f'  {label}: {self.loaded[label]} objects in {seconds:.1f}s ({rate:.0f}/s)'
+                ))
+
+    def _skip_superuser(self, item):
+        """Skip superusers in the fixture, recording how their pk maps onto the database."""
+        fields = item.get('fields', {})
+        username = fields.get('username', '')
+        json_pk = item.get('pk')
+        if not fields.get('is_superuser', False) and username not in self.existing_superusers:
+            return False
+
+        self.json_superuser_pks.add(json_pk)
+        self.superusers_skipped += 1
+
+        if username in self.existing_superusers:
+            # If superuser exists, map the JSON pk to the existing superuser pk (even when
+            # they match, so favorites of that superuser are kept)
+            self.superuser_pk_mapping[json_pk] = self.existing_superusers[username]
+        elif not self.existing_superusers:
+            # No superuser exists - create one from the JSON data
+            self.stdout.write(self.style.WARNING('No superuser found. Creating superuser from JSON data...'))
+            new_superuser = User.objects.create_superuser(
+                username=username or 'admin',
+                email=fields.get('email', ''),
+                password='changeme123!'  # Set a default password - user should change it
+            )
+            self.existing_superusers[new_superuser.username] = new_superuser.pk
+            self.superuser_pk_mapping[json_pk] = new_superuser.pk
+            self.stdout.write(self.style.SUCCESS(f'Created superuser: {new_superuser.username} (pk={new_superuser.pk})'))
+            self.stdout.write(self.style.WARNING('IMPORTANT: Change the superuser password after first login!'))
+        return True
+
+    def _remap_user_references(self, label, item):
+        """
+        Point foreign keys to fixture superusers at the existing superuser.
+        Returns False if the object references a superuser that could not be mapped.
+        """
+        if not self.json_superuser_pks:
+            return True
+        model = apps.get_model(label)
+        fields = item.get('fields', {})
+        for field in model._meta.concrete_fields:
+            if not field.is_relation or field.related_model is not User:
+                continue
+            if field.primary_key:
+                value, key = item.get('pk'), None
+            else:
+                value, key = fields.get(field.name), field.name
+            if value in self.superuser_pk_mapping:
+                if key is None:
+                    item['pk'] = self.superuser_pk_mapping[value]
+                else:
+                    fields[key] = self.superuser_pk_mapping[value]
+            elif value in self.json_superuser_pks:
+                return False
+        return True
+
+    def _flush(self):
+        """Write the buffered objects, dependencies first."""
+        for label in self.model_order:
+            batch = self.buffers.pop(label, None)
+            if not batch:
+                continue
+            started = time.monotonic()
+            deserialized = list(serializers.deserialize('python', batch))
+            if label in BULK_MODELS:
+                self._bulk_insert(deserialized)
+            else:
+                for obj in deserialized:
+                    obj.save()
+            self.seconds[label] += time.monotonic() - started
+            self.loaded[label] += len(batch)
+
+        total = sum(self.loaded.values())
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f'  {total} objects loaded ({total / elapsed if elapsed else total:.0f}/s)')
+        self.buffered = 0
+
+    def _bulk_insert(self, deserialized):
+        """
+        Insert fixture objects with their own pks and timestamps.
+
+        bulk_create() would overwrite auto_now_add fields such as created_at, so this
+        uses a raw insert, the way loaddata's save_base(raw=True) does.
+        """
+        model = deserialized[0].object.__class__
+        objs = [d.object for d in deserialized]
+        fields = model._meta.local_concrete_fields
+        batch_size = max(connection.ops.bulk_batch_size(fields, objs), 1)
+        for i in range(0, len(objs), batch_size):
+            model._base_manager._insert(objs[i:i + batch_size], fields=fields, raw=True)
+
+        # Fixtures rarely carry many-to-many data (e.g. user groups); set it per object
+        for d in deserialized:
+            for accessor, values in (d.m2m_data or {}).items():
+                if values:
+                    getattr(d.object, accessor).set(values)
@@ -0,0 +1,67 @@
+"""
+Run the benchmark scenarios in books/benchmarks against the current database, offline.
+Usage:
+  python manage.py run_benchmarks
+  python manage.py run_benchmarks --repeat=10 --output=bench/main.json
+  python manage.py run_benchmarks --scenario=recommendations --compare=bench/main.json
+
+Each scenario records median wall time, query count and peak Python memory. Runs
+are rolled back, so the database is left as it was. Load a dataset first, e.g. with
+generate_synthetic_data, and compare JSON files between commits with --compare.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from books.benchmarks.runner import compare, load_results, run_benchmarks, write_results
+from books.benchmarks.scenarios import all_scenarios
+
+
+class Command(BaseCommand):
+    help = "Benchmark key pages and jobs (wall time, queries, peak memory)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            default=[],
+            help='Only scenarios whose name contains this; repeatable (default: all)',
+        )
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per scenario (default: 5)')
+        parser.add_argument('--output', default=None, help='Write results to this JSON file')
+        parser.add_argument('--compare', default=None, help='Baseline JSON file to compare against')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        scenarios = [
+            scenario for scenario in all_scenarios()
+            if not options['scenario'] or any(part in scenario.name for part in options['scenario'])
+        ]
+        if not scenarios:
+            raise CommandError('No scenario matches ' + ', '.join(options['scenario']))
+        baseline = load_results(options['compare']) if options['compare'] else None
+
+        self.stdout.write(f"{'scenario':<32} {'median ms':>10} {'queries':>8} {'peak KB':>10}")
+        results = run_benchmarks(scenarios, options['repeat'], progress=self._print_row)
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
+        if baseline is not None:
+            self._print_comparison(results, baseline)
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def _print_row(self, name, result):
+        self.stdout.write(
+            f"{name:<32} {result['wall_ms']['median']:>10.2f} {result['queries']:>8} {result['peak_memory_kb']:>10.1f}"
+        )
+
+    def _print_comparison(self, results, baseline):
+        self.stdout.write(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+        for name, metric, old, new, change in compare(results, baseline):
+            line = f'{name:<32} {metric:<15} {old:>10} -> {new:<10} {change:+.1f}%'
+            # Wall time is noisy; only call out large moves
+            threshold = 10 if metric == 'wall_ms' else 0
+            if change > threshold:
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
@@ -0,0 +1,42 @@
+"""
+Send the queued "new recommendations" emails (see books.recommendation_emails).
+Usage:
+  python manage.py send_recommendation_emails                  # e.g. every minute from cron
+  python manage.py send_recommendation_emails --loop           # as a worker process
+  python manage.py send_recommendation_emails --loop --interval=30 --limit=100
+
+With RECOMMENDATION_EMAILS_DEFERRED = True, saving favorites queues the saving
+reader; each run emails the readers who list a queued reader as a neighbor and
+removes the reader from the queue. Concurrent runs are safe: a reader is claimed by deleting its queue row before sending.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from books.recommendation_emails import send_queued_recommendation_emails
+
+
+class Command(BaseCommand):
+    help = "Send the recommendation emails queued when readers saved favorites"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running, draining the queue every --interval seconds')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds between runs with --loop (default: 10)')
+        parser.add_argument('--limit', type=int, default=None, help='Queued readers handled per run (default: all)')
+
+    def handle(self, *args, **options):
+        if options['interval'] <= 0 or (options['limit'] is not None and options['limit'] < 1):
+            raise CommandError('--interval and --limit must be positive')
+        while True:
+            started = time.monotonic()
+            readers, sent = send_queued_recommendation_emails(options['limit'])
+            if readers or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Sent {sent} email(s) for {readers} queued reader(s) in {time.monotonic() - started:.2f}s'
+                ))
+            if not options['loop']:
+                return
+            # A long-running process must not hold on to a connection the database dropped
+            close_old_connections()
+            time.sleep(options['interval'])
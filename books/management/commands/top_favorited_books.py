@@ -1,6 +1,5 @@
 from django.core.management.base import BaseCommand
-from django.db.models import Count
-from books.models import Book, UserFavoriteBook
+from books.models import Book
 
 
 class Command(BaseCommand):
@@ -27,7 +26,6 @@ class Command(BaseCommand):
         # Get books ordered by number of favorites
         top_books = (
             Book.objects
-            .annotate(favorite_count=Count('favorited_by'))
             .filter(favorite_count__gt=0)
             .order_by('-favorite_count', 'title')
             .select_related('author')[offset:offset + limit]
@@ -52,4 +50,4 @@ class Command(BaseCommand):
             self.stdout.write(f"{rank:<6} {favorite_count:<12} {title:<50} {author:<30}")
         
         self.stdout.write('-' * 100)
-        self.stdout.write(f'\nTotal books with favorites: {Book.objects.annotate(favorite_count=Count("favorited_by")).filter(favorite_count__gt=0).count()}')
+        self.stdout.write(f'\nTotal books with favorites: {Book.objects.filter(favorite_count__gt=0).count()}')
@@ -0,0 +1,289 @@
+"""
+In-process metrics: counters, gauges and fixed-bucket histograms, exported by the
+staff-only /metrics view in Prometheus text format.
+
+Each process keeps its own values and writes them to METRICS_DIR/metrics-<pid>.json
+at most every METRICS_FLUSH_SECONDS (and at exit); collect() merges the files of
+every process. Counters and histograms are summed, including those of workers that
+have since exited (their files are folded into metrics-archive.json), so they never
+go backwards. A gauge shows the most recently written value of a live process.
+"""
+import atexit
+import bisect
+import fcntl
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE_FILE = 'metrics-archive.json'
+LOCK_FILE = 'metrics.lock'
+
+_registry = {}
+_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', '') or os.path.join(tempfile.gettempdir(), 'books-metrics')
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labels)
+        self.values = {}
+        _registry[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labelnames)
+
+    def _state(self):
+        return {
+            'kind': self.kind,
+            'description': self.description,
+            'labels': self.labelnames,
+            'values': [[list(key), value] for key, value in self.values.items()],
+        }
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        _maybe_flush()
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = [value, time.time()]
+        _maybe_flush()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            # One count per bucket plus +Inf, then the sum of observed values
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+        _maybe_flush()
+
+    def _state(self):
+        state = super()._state()
+        state['buckets'] = self.buckets
+        return state
+
+
+def _state():
+    with _lock:
+        return {name: metric._state() for name, metric in _registry.items()}
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def flush():
+    """Write this process's values to its file in METRICS_DIR."""
+    directory = metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    _write_json(os.path.join(directory, f'metrics-{os.getpid()}.json'), _state())
+
+
+def _maybe_flush():
+    global _last_flush
+    now = time.monotonic()
+    if now - _last_flush < getattr(settings, 'METRICS_FLUSH_SECONDS', 5):
+        return
+    _last_flush = now
+    try:
+        flush()
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {metrics_dir()}: {e}")
+
+
+def _reset_after_fork():
+    # A forked child starts from zero, or the parent's values would be counted twice
+    global _lock, _last_flush
+    _lock = threading.Lock()
+    _last_flush = 0.0
+    for metric in _registry.values():
+        metric.values = {}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@atexit.register
+def _flush_at_exit():
+    if any(metric.values for metric in _registry.values()):
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _merge(merged, state, keep_gauges=True):
+    """Add one file's state to `merged` ({name: metric with values keyed by label tuple})."""
+    for name, metric in state.items():
+        target = merged.setdefault(name, {**metric, 'values': {}})
+        if metric['kind'] == 'histogram' and list(target.get('buckets', ())) != list(metric.get('buckets', ())):
+            continue  # Bucket layout changed between deploys; keep the first seen
+        for key, value in metric['values']:
+            key = tuple(key)
+            current = target['values'].get(key)
+            if metric['kind'] == 'counter':
+                target['values'][key] = (current or 0) + value
+            elif metric['kind'] == 'histogram':
+                target['values'][key] = value if current is None else [a + b for a, b in zip(current, value)]
+            elif keep_gauges and (current is None or value[1] > current[1]):
+                target['values'][key] = value
+    return merged
+
+
+def _serialize(merged):
+    return {
+        name: {**metric, 'values': [[list(key), value] for key, value in metric['values'].items()]}
+        for name, metric in merged.items()
+    }
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """Merged values of every process, folding the files of exited processes into the archive."""
+    flush()
+    directory = metrics_dir()
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_path = os.path.join(directory, ARCHIVE_FILE)
+        archived = _merge({}, _read_json(archive_path), keep_gauges=False)
+        live = []
+        dead = []
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+            if pid.isdigit():
+                (live if _pid_alive(int(pid)) else dead).append(path)
+
+        if dead:
+            # Counters and histograms of exited workers live on in the archive; gauges die with them
+            for path in dead:
+                _merge(archived, _read_json(path), keep_gauges=False)
+            _write_json(archive_path, _serialize(archived))
+            for path in dead:
+                os.remove(path)
+
+    merged = _merge({}, _serialize(archived))
+    for path in live:
+        _merge(merged, _read_json(path))
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(merged):
+    """Prometheus text exposition format (version 0.0.4) for collect() output."""
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['description']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key, value in sorted(metric['values'].items()):
+            labels = metric['labels']
+            if metric['kind'] == 'counter':
+                lines.append(f'{name}{_labels(labels, key)} {_number(value)}')
+            elif metric['kind'] == 'gauge':
+                lines.append(f'{name}{_labels(labels, key)} {_number(value[0])}')
+            else:
+                cumulative = 0
+                for bound, count in zip([*metric['buckets'], math.inf], value[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels, key, [("le", _number(bound))])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels, key)} {_number(value[-1])}')
+                lines.append(f'{name}_count{_labels(labels, key)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_LATENCY = Histogram(
+    'books_http_request_duration_seconds', 'Request latency by URL name', labels=('view', 'method'),
+)
+GOOGLE_BOOKS_CACHE = Counter(
+    'books_google_books_cache_total', 'Google Books cache lookups by endpoint and result (hit or miss)',
+    labels=('endpoint', 'result'),
+)
+GOOGLE_BOOKS_RATE_LIMITED = Counter(
+    'books_google_books_rate_limited_total', 'HTTP 429 responses from Google Books', labels=('endpoint',),
+)
+PRECOMPUTED_RECOMMENDATIONS = Counter(
+    'books_precomputed_recommendations_total',
+    'Recommendation lookups answered from PrecomputedRecommendations (hit) or computed (miss)', labels=('result',),
+)
+RECOMMENDATION_COMPUTE = Histogram(
+    'books_recommendation_compute_seconds', 'Time to compute one reader\'s recommendations', labels=('source',),
+)
+SIMILAR_USERS_SCANNED = Histogram(
+    'books_similar_users_scanned', 'Similar readers considered per recommendation computation', labels=('source',),
+    buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+EMAILS_SENT = Counter('books_emails_sent_total', 'Emails sent by kind', labels=('kind',))
@@ -0,0 +1,133 @@
+"""
+Request instrumentation: the Server-Timing header, the slow-request log and
+request latency metrics.
+
+Responses to staff get a Server-Timing header with time per stage (see
+books.timing) and the query count, e.g.
+
+    Server-Timing: db;dur=12.4;desc="9 queries", render;dur=30.1, total;dur=48.7
+
+Other visitors only get it with SERVER_TIMING_PUBLIC = True, since it reveals how
+long each stage of a page takes.
+
+Requests slower than SLOW_REQUEST_MS are logged to books.slow_requests as one JSON
+record, including the slowest SQL statements. Staff can profile a single request
+with ?_profile=1 (see books.profiling).
+"""
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from .metrics import REQUEST_LATENCY
+from .profiling import profile_request, profiling_requested, rate_limited
+from .timing import start_timings, stop_timings
+
+slow_request_logger = logging.getLogger('books.slow_requests')
+
+SQL_PREVIEW_LENGTH = 500
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'SERVER_TIMING_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'SLOW_REQUEST_MS', 1000)
+        self.top_sql = getattr(settings, 'SLOW_REQUEST_TOP_SQL', 5)
+        self.public = getattr(settings, 'SERVER_TIMING_PUBLIC', False)
+
+    def __call__(self, request):
+        timings, token = start_timings()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timings.record_query):
+                response = self.get_response(request)
+        finally:
+            stop_timings(token)
+        total = time.perf_counter() - started
+
+        if self.public or self._is_staff(request):
+            response['Server-Timing'] = self._header(timings, total)
+        if total * 1000 >= self.slow_ms:
+            self._log_slow_request(request, response, timings, total)
+        return response
+
+    def _is_staff(self, request):
+        # request.user is set further down the stack, by AuthenticationMiddleware
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_staff)
+
+    def _header(self, timings, total):
+        metrics = []
+        for stage, (seconds, count) in sorted(timings.stages.items()):
+            if stage == 'db':
+                metrics.append(f'db;dur={_ms(seconds)};desc="{count} queries"')
+            else:
+                metrics.append(f'{stage};dur={_ms(seconds)}')
+        metrics.append(f'total;dur={_ms(total)}')
+        return ', '.join(metrics)
+
+    def _log_slow_request(self, request, response, timings, total):
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user_id': getattr(request, 'user', None) and request.user.id,
+            'total_ms': _ms(total),
+            'query_count': len(timings.queries),
+            'stages': {
+                stage: {'ms': _ms(seconds), 'count': count} for stage, (seconds, count) in sorted(timings.stages.items())
+            },
+            'top_sql': [
+                {'ms': _ms(seconds), 'sql': sql[:SQL_PREVIEW_LENGTH]}
+                for seconds, sql in timings.top_queries(self.top_sql)
+            ],
+        }
+        slow_request_logger.warning(
+            'Slow request %s %s took %sms: %s', request.method, request.path, record['total_ms'], json.dumps(record),
+            extra={'slow_request': record},
+        )
+
+
+class RequestMetricsMiddleware:
+    """Records each request's latency in books.metrics, labelled by URL name."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - started,
+            view=match.view_name if match else 'unmatched',
+            method=request.method,
+        )
+        return response
+
+
+class ProfilingMiddleware:
+    """Runs staff requests that ask for it under cProfile; must come after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling_requested(request) or not request.user.is_staff:
+            return self.get_response(request)
+        if rate_limited(request.user):
+            response = self.get_response(request)
+            response['X-Profile-Run'] = 'rate-limited'
+            return response
+        return profile_request(self.get_response, request)
@@ -0,0 +1,61 @@
+"""
+Migration operations that build and drop indexes without locking writes on PostgreSQL.
+
+AddIndexConcurrently / RemoveIndexConcurrently behave like AddIndex / RemoveIndex,
+but on PostgreSQL they run CREATE/DROP INDEX CONCURRENTLY, so the favorites tables
+stay writable while a large index builds. Other databases get the plain statements,
+keeping SQLite development and tests working. Concurrent index builds cannot run in a
+transaction; migrations using these must set `atomic = False`.
+"""
+from django.db import NotSupportedError
+from django.db.migrations.operations import AddIndex, RemoveIndex
+
+
+def _concurrently(schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return False
+    if schema_editor.connection.in_atomic_block:
+        raise NotSupportedError(
+            'Concurrent index operations cannot run inside a transaction; set atomic = False on the migration.'
+        )
+    return True
+
+
+class AddIndexConcurrently(AddIndex):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not _concurrently(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not _concurrently(schema_editor):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+    def describe(self):
+        return super().describe() + ' (concurrently on PostgreSQL)'
+
+
+class RemoveIndexConcurrently(RemoveIndex):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not _concurrently(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = from_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+            schema_editor.remove_index(model, index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not _concurrently(schema_editor):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = to_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+            schema_editor.add_index(model, index, concurrently=True)
+
+    def describe(self):
+        return super().describe() + ' (concurrently on PostgreSQL)'
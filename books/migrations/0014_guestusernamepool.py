@@ -0,0 +1,38 @@
+# Generated by Django 4.2.27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_add_user_read_book'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GuestUsernamePool',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Guest Username Pool Entry',
+                'verbose_name_plural': 'Guest Username Pool',
+            },
+        ),
+        # Unrelated to the pool: 0013 created UserReadBook's indexes under names that
+        # differ from the ones models.py declares, and makemigrations picked the drift up
+        # here. Left in place because databases that already ran 0014 have the new names.
+        migrations.RenameIndex(
+            model_name='userreadbook',
+            new_name='books_userr_user_id_a3883a_idx',
+            old_name='books_userre_user_id_idx',
+        ),
+        migrations.RenameIndex(
+            model_name='userreadbook',
+            new_name='books_userr_book_id_f975ff_idx',
+            old_name='books_userre_book_id_idx',
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def mark_existing_guests(apps, schema_editor):
+    """
+    Backfill markers for guests created before GuestAccount existed.
+    Guests got a generated name ending in '_' and a hashed random password, and never
+    logged in or set an email. Imported readers store raw (unhashed) passwords, so the
+    '$' check keeps them out.
+    """
+    User = apps.get_model('auth', 'User')
+    GuestAccount = apps.get_model('books', 'GuestAccount')
+    guests = User.objects.filter(
+        username__endswith='_',
+        password__contains='$',
+        last_login__isnull=True,
+        email='',
+        is_staff=False,
+        is_superuser=False,
+    ).values_list('id', 'date_joined')
+    GuestAccount.objects.bulk_create(
+        [GuestAccount(user_id=user_id, last_active_at=date_joined) for user_id, date_joined in guests.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0014_guestusernamepool'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GuestAccount',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='guest_account', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_active_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text='When the guest last added or removed a favorite')),
+            ],
+        ),
+        migrations.RunPython(mark_existing_guests, migrations.RunPython.noop),
+    ]
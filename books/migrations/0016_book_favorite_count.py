@@ -0,0 +1,42 @@
+# Generated by Django 4.2.27
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_favorite_count(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    UserFavoriteBook = apps.get_model('books', 'UserFavoriteBook')
+    Book.objects.update(
+        favorite_count=Coalesce(
+            Subquery(
+                UserFavoriteBook.objects.filter(book_id=OuterRef('pk'))
+                .order_by()
+                .values('book_id')
+                .annotate(count=Count('id'))
+                .values('count')
+            ),
+            Value(0),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0015_guestaccount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='favorite_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_favorite_count, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-favorite_count', 'title'], name='books_book_favorit_724a4d_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0016_book_favorite_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unique_readers', models.PositiveIntegerField(default=0)),
+                ('total_favorites', models.PositiveIntegerField(default=0)),
+                ('top_favorites', models.JSONField(default=list, help_text='Top 10 most favorited books: title, author, count')),
+                ('recent_favorites', models.JSONField(default=list, help_text='10 most recently favorited books: title, author')),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+                ('is_stale', models.BooleanField(default=False, help_text='Favorites changed since the last refresh')),
+            ],
+            options={
+                'verbose_name': 'Site Stats',
+                'verbose_name_plural': 'Site Stats',
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.27
+
+from collections import Counter
+from itertools import combinations
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_cooccurrence(apps, schema_editor):
+    BookCooccurrence = apps.get_model('books', 'BookCooccurrence')
+    UserFavoriteBook = apps.get_model('books', 'UserFavoriteBook')
+    counts = Counter()
+    current_user = None
+    books = []
+    for user_id, book_id in UserFavoriteBook.objects.order_by('user_id', 'book_id').values_list('user_id', 'book_id').iterator():
+        if user_id != current_user:
+            counts.update(combinations(books, 2))
+            current_user = user_id
+            books = []
+        books.append(book_id)
+    counts.update(combinations(books, 2))
+
+    rows = []
+    for (a, b), count in counts.items():
+        rows.append(BookCooccurrence(book_a_id=a, book_b_id=b, count=count))
+        rows.append(BookCooccurrence(book_a_id=b, book_b_id=a, count=count))
+    BookCooccurrence.objects.bulk_create(rows, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0017_sitestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookCooccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('book_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cooccurrences', to='books.book')),
+                ('book_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='books.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book_a', '-count'], name='books_bookc_book_a__3ec364_idx')],
+                'unique_together': {('book_a', 'book_b')},
+            },
+        ),
+        migrations.RunPython(populate_cooccurrence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.27
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_neighbors(apps, schema_editor):
+    UserFavoriteBook = apps.get_model('books', 'UserFavoriteBook')
+    UserNeighbor = apps.get_model('books', 'UserNeighbor')
+    k = getattr(settings, 'USER_NEIGHBORS_K', 50)
+    user_books = defaultdict(list)
+    book_readers = defaultdict(list)
+    for user_id, book_id in UserFavoriteBook.objects.values_list('user_id', 'book_id').iterator():
+        user_books[user_id].append(book_id)
+        book_readers[book_id].append(user_id)
+
+    rows = []
+    for user_id, book_ids in user_books.items():
+        overlaps = defaultdict(set)
+        for book_id in book_ids:
+            for neighbor_id in book_readers[book_id]:
+                if neighbor_id != user_id:
+                    overlaps[neighbor_id].add(book_id)
+        for neighbor_id, shared in sorted(overlaps.items(), key=lambda item: (-len(item[1]), item[0]))[:k]:
+            rows.append(UserNeighbor(
+                user_id=user_id, neighbor_id=neighbor_id,
+                overlap_count=len(shared), overlap_book_ids=sorted(shared),
+            ))
+    UserNeighbor.objects.bulk_create(rows, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0018_bookcooccurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('overlap_count', models.PositiveIntegerField(default=0)),
+                ('overlap_book_ids', models.JSONField(default=list)),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-overlap_count'], name='books_usern_user_id_a9fb5b_idx')],
+                'unique_together': {('user', 'neighbor')},
+            },
+        ),
+        migrations.RunPython(populate_neighbors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('books', '0020_minhash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecomputedRecommendations',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='precomputed_recommendations', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('readers', models.JSONField(default=dict, help_text='Similar reader id -> overlap ids, score and credited book ids')),
+                ('scoring', models.CharField(max_length=20)),
+                ('computed_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Precomputed Recommendations',
+                'verbose_name_plural': 'Precomputed Recommendations',
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0021_precomputedrecommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('query_count', models.PositiveIntegerField(default=0)),
+                ('profile', models.BinaryField(blank=True, help_text='pstats data; empty if over PROFILE_MAX_BYTES', null=True)),
+                ('summary', models.TextField(blank=True, help_text='Top functions by cumulative time')),
+                ('sql_log', models.JSONField(blank=True, default=list, help_text="[{'ms': ..., 'sql': ...}] in execution order")),
+                ('truncated', models.BooleanField(default=False, help_text='Profile or SQL log was cut to fit the size cap')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='profile_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
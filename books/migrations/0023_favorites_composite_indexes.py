@@ -0,0 +1,83 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from books.migration_operations import AddIndexConcurrently, RemoveIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Indexes are built with CREATE INDEX CONCURRENTLY on PostgreSQL, which cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0022_profilerun'),
+    ]
+
+    operations = [
+        # Build the composite indexes first so queries are never left without one
+        AddIndexConcurrently(
+            model_name='tobereadbook',
+            index=models.Index(fields=['user', '-created_at'], name='books_tober_user_id_86cbed_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='userfavoritebook',
+            index=models.Index(fields=['book', 'user'], name='books_userf_book_id_0915a1_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='userfavoritebook',
+            index=models.Index(fields=['user', '-created_at', 'book'], name='books_userf_user_id_7fc6ca_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='userfavoritebook',
+            index=models.Index(fields=['created_at', 'book'], name='books_userf_created_62eaca_idx'),
+        ),
+        # Then drop the single-column indexes they make redundant
+        RemoveIndexConcurrently(
+            model_name='tobereadbook',
+            name='books_tober_user_id_467c78_idx',
+        ),
+        RemoveIndexConcurrently(
+            model_name='tobereadbook',
+            name='books_tober_book_id_c0e095_idx',
+        ),
+        RemoveIndexConcurrently(
+            model_name='userfavoritebook',
+            name='books_userf_user_id_948d74_idx',
+        ),
+        RemoveIndexConcurrently(
+            model_name='userfavoritebook',
+            name='books_userf_book_id_ed94dd_idx',
+        ),
+        RemoveIndexConcurrently(
+            model_name='userreadbook',
+            name='books_userr_user_id_a3883a_idx',
+        ),
+        RemoveIndexConcurrently(
+            model_name='userreadbook',
+            name='books_userr_book_id_f975ff_idx',
+        ),
+        # Foreign keys covered by a composite or unique index no longer need their own
+        migrations.AlterField(
+            model_name='tobereadbook',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='tbr_books', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='userfavoritebook',
+            name='book',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorited_by', to='books.book'),
+        ),
+        migrations.AlterField(
+            model_name='userfavoritebook',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorite_books', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='userreadbook',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='read_books', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.27 on 2026-10-19 00:52
+
+from django.db import migrations, models
+
+from books.migration_operations import AddIndexConcurrently, RemoveIndexConcurrently
+
+
+def copy_overlap_counts(apps, schema_editor):
+    # The score under the default 'overlap' strategy; with any other RECOMMENDATION_SCORING
+    # run rebuild_user_neighbors afterwards so the lists are selected by that score
+    UserNeighbor = apps.get_model('books', 'UserNeighbor')
+    UserNeighbor.objects.update(score=models.F('overlap_count'))
+
+
+class Migration(migrations.Migration):
+    # Indexes are built with CREATE INDEX CONCURRENTLY on PostgreSQL, which cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('books', '0023_favorites_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userneighbor',
+            name='score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(copy_overlap_counts, migrations.RunPython.noop, atomic=True),
+        AddIndexConcurrently(
+            model_name='userneighbor',
+            index=models.Index(fields=['user', '-score'], name='books_usern_user_id_7ab074_idx'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='userneighbor',
+            name='books_usern_user_id_a9fb5b_idx',
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.27 on 2026-10-19 00:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('books', '0024_userneighbor_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedRecommendationEmails',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('site_url', models.CharField(blank=True, help_text='Base URL for links in the emails', max_length=200)),
+                ('queued_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Queued Recommendation Emails',
+                'verbose_name_plural': 'Queued Recommendation Emails',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.27 on 2026-10-19 01:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def summarize_neighbor_lists(apps, schema_editor):
+    UserNeighbor = apps.get_model('books', 'UserNeighbor')
+    UserNeighborList = apps.get_model('books', 'UserNeighborList')
+    UserNeighborList.objects.bulk_create(
+        [
+            UserNeighborList(user_id=row['user_id'], size=row['size'], weakest_score=row['weakest'])
+            for row in UserNeighbor.objects.values('user_id').annotate(
+                size=models.Count('id'), weakest=models.Min('score'),
+            ).iterator()
+        ],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('books', '0025_queuedrecommendationemails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserNeighborList',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('weakest_score', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.RunPython(summarize_neighbor_lists, migrations.RunPython.noop),
+    ]
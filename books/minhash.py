@@ -0,0 +1,169 @@
+"""
+MinHash signatures and LSH buckets for approximate similar-reader lookup.
+
+When a few books are favorited by most readers, every reader shares a favorite with
+nearly everyone and exact overlap means scanning the whole favorites table. With
+RECOMMENDATION_ENGINE = 'minhash', books.neighbors only considers readers whose
+signatures agree on at least one LSH band (MINHASH_BANDS bands of
+MINHASH_PERMUTATIONS / MINHASH_BANDS rows each) and re-ranks those candidates by exact
+overlap. Readers with Jaccard similarity s become candidates with probability
+1 - (1 - s ** rows) ** bands; minhash_recall_report measures the result against the
+exact engine.
+"""
+import hashlib
+import random
+import struct
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import LSHBucket, ReaderSignature, UserFavoriteBook
+
+MERSENNE_PRIME = (1 << 61) - 1
+# Fixed so every process derives the same hash functions
+HASH_SEED = 20240601
+
+
+def engine_enabled():
+    return getattr(settings, 'RECOMMENDATION_ENGINE', 'exact') == 'minhash'
+
+
+def minhash_sizes():
+    permutations = getattr(settings, 'MINHASH_PERMUTATIONS', 64)
+    bands = getattr(settings, 'MINHASH_BANDS', 32)
+    if bands < 1 or permutations % bands:
+        raise ValueError('MINHASH_PERMUTATIONS must be a positive multiple of MINHASH_BANDS')
+    return permutations, bands
+
+
+@lru_cache(maxsize=None)
+def _hash_params(permutations):
+    rng = random.Random(HASH_SEED)
+    return tuple((rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(permutations))
+
+
+def signature(book_ids, permutations=None):
+    """MinHash signature of a set of book ids (a list of `permutations` ints)."""
+    permutations = permutations or minhash_sizes()[0]
+    book_ids = list(book_ids)
+    return [
+        min(((a * book_id + b) % MERSENNE_PRIME for book_id in book_ids), default=MERSENNE_PRIME)
+        for a, b in _hash_params(permutations)
+    ]
+
+
+def _merge(signature_a, signature_b):
+    return [min(a, b) for a, b in zip(signature_a, signature_b)]
+
+
+def band_keys(sig, bands=None):
+    """One signed 64-bit bucket key per band; the band number is part of the key."""
+    bands = bands or minhash_sizes()[1]
+    rows = len(sig) // bands
+    keys = []
+    for band in range(bands):
+        digest = hashlib.blake2b(
+            struct.pack(f'<H{rows}Q', band, *sig[band * rows:(band + 1) * rows]), digest_size=8
+        ).digest()
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+def candidate_readers(user_id):
+    """Subquery of readers sharing at least one LSH bucket with `user_id` (including the reader)."""
+    return LSHBucket.objects.filter(
+        bucket__in=LSHBucket.objects.filter(user_id=user_id).values('bucket')
+    ).values('user_id')
+
+
+def _save(signatures):
+    """Store {user_id: signature or None} and replace those readers' buckets."""
+    LSHBucket.objects.filter(user_id__in=signatures.keys()).delete()
+    ReaderSignature.objects.filter(user_id__in=[u for u, sig in signatures.items() if sig is None]).delete()
+    kept = {u: sig for u, sig in signatures.items() if sig is not None}
+    ReaderSignature.objects.bulk_create(
+        [ReaderSignature(user_id=u, signature=sig) for u, sig in kept.items()],
+        update_conflicts=True, unique_fields=['user'], update_fields=['signature', 'updated_at'],
+    )
+    LSHBucket.objects.bulk_create(
+        [LSHBucket(user_id=u, bucket=key) for u, sig in kept.items() for key in band_keys(sig)],
+        batch_size=5000,
+    )
+
+
+def minhash_favorites_changed(pairs, added):
+    """
+    Update signatures after favorites given as (user_id, book_id) pairs were added or
+    deleted. Additions fold the new books into the stored signature; deletions
+    recompute it from the reader's remaining favorites. No-op unless the engine is on.
+    """
+    if not engine_enabled():
+        return
+    changed = defaultdict(set)
+    for user_id, book_id in pairs:
+        changed[user_id].add(book_id)
+
+    stored = {}
+    if added:
+        stored = dict(ReaderSignature.objects.filter(user_id__in=changed.keys()).values_list('user_id', 'signature'))
+    permutations = minhash_sizes()[0]
+    recompute = [u for u in changed if len(stored.get(u) or ()) != permutations]
+    favorites = defaultdict(list)
+    for user_id, book_id in UserFavoriteBook.objects.filter(user_id__in=recompute).values_list('user_id', 'book_id'):
+        favorites[user_id].append(book_id)
+
+    signatures = {}
+    for user_id, book_ids in changed.items():
+        if user_id in stored and user_id not in recompute:
+            signatures[user_id] = _merge(stored[user_id], signature(book_ids, permutations))
+        else:
+            signatures[user_id] = signature(favorites[user_id], permutations) if favorites[user_id] else None
+    _save(signatures)
+
+
+def rebuild_signatures(batch_size=1000, progress=None):
+    """Recompute every reader's signature and buckets. Returns the number of readers."""
+    permutations = minhash_sizes()[0]
+    readers = 0
+    batch = {}
+
+    def flush():
+        nonlocal readers
+        _save(batch)
+        readers += len(batch)
+        batch.clear()
+        if progress:
+            progress(readers)
+
+    with transaction.atomic():
+        ReaderSignature.objects.all().delete()
+        LSHBucket.objects.all().delete()
+        current_user = None
+        books = []
+        for user_id, book_id in (
+            UserFavoriteBook.objects.order_by('user_id').values_list('user_id', 'book_id').iterator(chunk_size=10000)
+        ):
+            if user_id != current_user:
+                if books:
+                    batch[current_user] = signature(books, permutations)
+                    if len(batch) >= batch_size:
+                        flush()
+                current_user = user_id
+                books = []
+            books.append(book_id)
+        if books:
+            batch[current_user] = signature(books, permutations)
+        flush()
+    return readers
+
+
+def load_buckets():
+    """({bucket: [user ids]}, {user_id: [buckets]}) for the whole table, for bulk neighbor rebuilds."""
+    bucket_users = defaultdict(list)
+    user_buckets = defaultdict(list)
+    for bucket, user_id in LSHBucket.objects.values_list('bucket', 'user_id').iterator(chunk_size=10000):
+        bucket_users[bucket].append(user_id)
+        user_buckets[user_id].append(bucket)
+    return bucket_users, user_buckets
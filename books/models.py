@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class Author(models.Model):
@@ -83,12 +84,17 @@ class Book(models.Model):
     # Track when the book entry was created
     created_at = models.DateTimeField(auto_now_add=True, null=True)
 
+    # Number of UserFavoriteBook rows for this book, kept in sync by books.favorites
+    # (run reconcile_favorite_counts to fix drift)
+    favorite_count = models.PositiveIntegerField(default=0)
+
     class Meta:
         # This tells the DB: "You can have many books named 'It',
         # and many books by 'King', but only ONE 'It' by 'King'."
         unique_together = ("title", "author")
         indexes = [
             models.Index(fields=["is_popular", "title"]),  # For faster popular book searches
+            models.Index(fields=["-favorite_count", "title"]),  # For most-favorited rankings
         ]
 
     def __str__(self):
@@ -97,16 +103,18 @@ class Book(models.Model):
 
 class UserFavoriteBook(models.Model):
     """Tracks books that users love (no ratings, just favorites)"""
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="favorite_books")
-    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="favorited_by")
+    # Lookups by user are served by the (user, book) unique index, by book by (book, user)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="favorite_books", db_index=False)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="favorited_by", db_index=False)
     explanation = models.TextField(max_length=500, blank=True, help_text="Why you love this book")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ("user", "book")
         indexes = [
-            models.Index(fields=["user"]),
-            models.Index(fields=["book"]),
+            models.Index(fields=["book", "user"]),  # Readers of a set of books, without touching the table
+            models.Index(fields=["user", "-created_at", "book"]),  # My books, newest first; covers the digest
+            models.Index(fields=["created_at", "book"]),  # Recent favorites and the weekly digest
         ]
 
     def __str__(self):
@@ -115,7 +123,7 @@ class UserFavoriteBook(models.Model):
 
 class ToBeReadBook(models.Model):
     """Tracks books users plan to read next."""
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tbr_books")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tbr_books", db_index=False)
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="wanted_by")
     note = models.TextField(max_length=500, blank=True, help_text="Optional notes or why it's on your TBR")
     created_at = models.DateTimeField(auto_now_add=True)
@@ -123,8 +131,7 @@ class ToBeReadBook(models.Model):
     class Meta:
         unique_together = ("user", "book")
         indexes = [
-            models.Index(fields=["user"]),
-            models.Index(fields=["book"]),
+            models.Index(fields=["user", "-created_at"]),  # The TBR list, newest first
         ]
         ordering = ("-created_at",)
 
@@ -134,16 +141,13 @@ class ToBeReadBook(models.Model):
 
 class UserReadBook(models.Model):
     """Tracks books a user has marked as read (from recommendations)."""
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="read_books")
+    # Lookups by user are served by the (user, book) unique index
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="read_books", db_index=False)
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="read_by")
     marked_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ("user", "book")
-        indexes = [
-            models.Index(fields=["user"]),
-            models.Index(fields=["book"]),
-        ]
         ordering = ("-marked_at",)
 
     def __str__(self):
@@ -184,4 +188,187 @@ class UserEmailPreferences(models.Model):
 
     def __str__(self):
         status = "subscribed" if self.receive_recommendation_emails else "unsubscribed"
-        return f"{self.user.username} - {status}"
\ No newline at end of file
+        return f"{self.user.username} - {status}"
+
+class GuestUsernamePool(models.Model):
+    """Pre-generated, collision-checked usernames claimed when a guest account is created."""
+    username = models.CharField(max_length=150, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Guest Username Pool Entry"
+        verbose_name_plural = "Guest Username Pool"
+
+    def __str__(self):
+        return self.username
+
+
+class GuestAccount(models.Model):
+    """Marks a throwaway account created for an anonymous visitor's favorites."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="guest_account")
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_active_at = models.DateTimeField(default=timezone.now, db_index=True, help_text="When the guest last added or removed a favorite")
+
+    def __str__(self):
+        return f"Guest {self.user.username}"
+
+
+class SiteStats(models.Model):
+    """Single-row snapshot of the public favorites statistics (see books.stats)."""
+    unique_readers = models.PositiveIntegerField(default=0)
+    total_favorites = models.PositiveIntegerField(default=0)
+    top_favorites = models.JSONField(default=list, help_text="Top 10 most favorited books: title, author, count")
+    recent_favorites = models.JSONField(default=list, help_text="10 most recently favorited books: title, author")
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+    is_stale = models.BooleanField(default=False, help_text="Favorites changed since the last refresh")
+
+    class Meta:
+        verbose_name = "Site Stats"
+        verbose_name_plural = "Site Stats"
+
+    def __str__(self):
+        return f"Site stats ({self.refreshed_at})"
+
+    @property
+    def version(self):
+        """Changes on every refresh; used to key cached pages and template fragments."""
+        return int(self.refreshed_at.timestamp()) if self.refreshed_at else 0
+
+
+class BookCooccurrence(models.Model):
+    """
+    Number of readers who love both book_a and book_b. Stored in both directions so
+    "readers who loved X also loved" is a single index range scan (see books.cooccurrence).
+    """
+    book_a = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="cooccurrences")
+    book_b = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="+")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("book_a", "book_b")
+        indexes = [
+            models.Index(fields=["book_a", "-count"]),  # For "also loved" lookups
+        ]
+
+    def __str__(self):
+        return f"{self.book_a_id} & {self.book_b_id}: {self.count}"
+
+
+class UserNeighbor(models.Model):
+    """
+    One of a reader's top-K most similar readers by the RECOMMENDATION_SCORING
+    strategy, with the shared book ids and the score. Maintained by books.neighbors.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="neighbors")
+    neighbor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    overlap_count = models.PositiveIntegerField(default=0)
+    overlap_book_ids = models.JSONField(default=list)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ("user", "neighbor")
+        indexes = [
+            models.Index(fields=["user", "-score"]),  # A reader's neighbors, most similar first
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} ~ {self.neighbor_id}: {self.score:g}"
+
+
+class UserNeighborList(models.Model):
+    """
+    Size and weakest score of a reader's UserNeighbor list, so offering the reader a
+    new neighbor needs no aggregate over the list. weakest_score is exact after a
+    rebuild or a refresh of the reader's own list and a lower bound otherwise.
+    Maintained by books.neighbors.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="+")
+    size = models.PositiveIntegerField(default=0)
+    weakest_score = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.size} neighbors, weakest {self.weakest_score:g}"
+
+
+class ReaderSignature(models.Model):
+    """A reader's MinHash signature over their favorite book ids (see books.minhash)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="minhash_signature")
+    signature = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Signature for {self.user_id}"
+
+
+class LSHBucket(models.Model):
+    """One LSH band of a reader's signature; readers sharing a bucket are similar-reader candidates."""
+    bucket = models.BigIntegerField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bucket", "user"]),  # Readers in the same bucket
+        ]
+
+    def __str__(self):
+        return f"{self.bucket}: {self.user_id}"
+
+
+class PrecomputedRecommendations(models.Model):
+    """
+    A reader's recommendations as computed by precompute_recommendations, before
+    hydration (see books.recommendations). Deleted whenever the favorites of the reader
+    or of one of their neighbors change.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="precomputed_recommendations")
+    readers = models.JSONField(default=dict, help_text="Similar reader id -> overlap ids, score and credited book ids")
+    scoring = models.CharField(max_length=20)
+    computed_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Precomputed Recommendations"
+        verbose_name_plural = "Precomputed Recommendations"
+
+    def __str__(self):
+        return f"Recommendations for {self.user_id} ({self.computed_at})"
+
+
+class QueuedRecommendationEmails(models.Model):
+    """
+    A reader whose new favorites haven't been announced yet to the readers who list
+    them as a neighbor. Drained by send_recommendation_emails (see books.recommendation_emails).
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="+")
+    site_url = models.CharField(max_length=200, blank=True, help_text="Base URL for links in the emails")
+    queued_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "Queued Recommendation Emails"
+        verbose_name_plural = "Queued Recommendation Emails"
+
+    def __str__(self):
+        return f"Emails for readers following {self.user_id} ({self.queued_at})"
+
+
+class ProfileRun(models.Model):
+    """
+    One staff request run under cProfile (see books.profiling), with the SQL it ran.
+    `profile` holds the marshalled pstats data, downloadable from the admin.
+    """
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="profile_runs")
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    profile = models.BinaryField(null=True, blank=True, help_text="pstats data; empty if over PROFILE_MAX_BYTES")
+    summary = models.TextField(blank=True, help_text="Top functions by cumulative time")
+    sql_log = models.JSONField(default=list, blank=True, help_text="[{'ms': ..., 'sql': ...}] in execution order")
+    truncated = models.BooleanField(default=False, help_text="Profile or SQL log was cut to fit the size cap")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ("-created_at",)
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f}ms, {self.created_at})"
@@ -0,0 +1,325 @@
+"""
+Each reader's top-K most similar readers, kept in UserNeighbor.
+
+Readers are ranked by the RECOMMENDATION_SCORING strategy (books.scoring), so with
+'idf' readers who only share bestsellers don't crowd out readers sharing rarer
+books; the score is stored with each row. Every strategy is symmetric, which is what
+lets a change to one reader re-rank that reader inside other readers' lists.
+
+Finding similar readers means joining the favorites table on itself, so it is done
+when favorites change instead of on every page view or email: books.favorites
+refreshes the changed reader's own list exactly and adjusts the lists of readers who
+share the changed books; each list's size and weakest score, kept in
+UserNeighborList, tell whether the changed reader now ranks in it. Removals only
+shrink other readers' lists (a reader pushed out of someone's top K earlier is not
+brought back), and stored scores that depend on more than the shared books (a
+reader's favorite count for jaccard and cosine, book popularity for idf) are only
+refreshed for the pairs sharing a changed book, so rebuild_user_neighbors is run
+periodically to recompute everything.
+
+With RECOMMENDATION_ENGINE = 'minhash' only readers sharing an LSH bucket are
+compared (see books.minhash); overlaps are still exact.
+"""
+import heapq
+import multiprocessing
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Count
+
+from . import minhash
+from .models import UserFavoriteBook, UserNeighbor, UserNeighborList
+from .scoring import NEEDS_READER_SIZES, idf_weight, idf_weights, scoring_strategy
+
+
+def neighbors_k():
+    return getattr(settings, 'USER_NEIGHBORS_K', 50)
+
+
+def _top_neighbors(overlaps, k, score):
+    """
+    [(neighbor_id, sorted shared book ids, score)] for the k highest-scoring readers,
+    lowest id first on ties. `score(neighbor_id, shared_ids)` scores one pair.
+    """
+    scored = ((score(neighbor_id, book_ids), neighbor_id, book_ids) for neighbor_id, book_ids in overlaps.items())
+    ranked = heapq.nsmallest(k, scored, key=lambda row: (-row[0], row[1]))
+    return [(neighbor_id, sorted(book_ids), value) for value, neighbor_id, book_ids in ranked]
+
+
+def _live_scorer(user_id):
+    """
+    score(neighbor_id, shared_ids) for the configured strategy, loading only what it
+    needs: favorite counts of everyone sharing a book with the reader for jaccard and
+    cosine (one query), idf weights of the reader's books for idf (two).
+    """
+    name, scorer, _threshold = scoring_strategy()
+    my_book_ids = UserFavoriteBook.objects.filter(user_id=user_id).values('book_id')
+    sizes = {}
+    if name in NEEDS_READER_SIZES:
+        readers = UserFavoriteBook.objects.filter(book_id__in=my_book_ids).values('user_id')
+        sizes = dict(
+            UserFavoriteBook.objects.filter(user_id__in=readers)
+            .values('user_id').annotate(total=Count('id')).values_list('user_id', 'total')
+        )
+    weights = idf_weights(my_book_ids) if name == 'idf' else {}
+    my_count = sizes.get(user_id, 0)
+    return lambda neighbor_id, shared_ids: scorer(shared_ids, my_count, sizes.get(neighbor_id, 0), weights)
+
+
+def _use_minhash(engine):
+    return engine == 'minhash' if engine else minhash.engine_enabled()
+
+
+def _overlaps_for(user_id, engine=None):
+    my_book_ids = UserFavoriteBook.objects.filter(user_id=user_id).values('book_id')
+    rows = UserFavoriteBook.objects.filter(book_id__in=my_book_ids).exclude(user_id=user_id)
+    if _use_minhash(engine):
+        rows = rows.filter(user_id__in=minhash.candidate_readers(user_id))
+    overlaps = defaultdict(set)
+    for neighbor_id, book_id in rows.values_list('user_id', 'book_id'):
+        overlaps[neighbor_id].add(book_id)
+    return overlaps
+
+
+def similar_readers(user_id, k=None, engine=None):
+    """Compute a reader's top-k neighbors now with the given ('exact' or 'minhash') or configured engine."""
+    return _top_neighbors(_overlaps_for(user_id, engine), k or neighbors_k(), _live_scorer(user_id))
+
+
+def _list_summary(rows):
+    """(size, weakest score) of a neighbor list given as rows ending in the score."""
+    return len(rows), min((row[-1] for row in rows), default=0)
+
+
+def _save_list_summaries(summaries):
+    """Store {user_id: (size, weakest score)} in UserNeighborList."""
+    UserNeighborList.objects.bulk_create(
+        [
+            UserNeighborList(user_id=user_id, size=max(size, 0), weakest_score=weakest)
+            for user_id, (size, weakest) in summaries.items()
+        ],
+        update_conflicts=True, unique_fields=['user'], update_fields=['size', 'weakest_score'],
+    )
+
+
+def _refresh_user(user_id, changed_book_ids, k):
+    overlaps = _overlaps_for(user_id)
+    score = _live_scorer(user_id)
+
+    # The changed reader's own list is recomputed exactly
+    top = _top_neighbors(overlaps, k, score)
+    UserNeighbor.objects.filter(user_id=user_id).delete()
+    UserNeighbor.objects.bulk_create([
+        UserNeighbor(
+            user_id=user_id, neighbor_id=neighbor_id,
+            overlap_count=len(book_ids), overlap_book_ids=book_ids, score=value,
+        )
+        for neighbor_id, book_ids, value in top
+    ])
+    changed_lists = {user_id: _list_summary(top)}
+
+    # Readers of the changed books now share more (or fewer) books with this reader.
+    # They are passed to the database as a subquery, not as a list of ids.
+    readers = UserFavoriteBook.objects.filter(book_id__in=changed_book_ids).exclude(user_id=user_id)
+    if minhash.engine_enabled():
+        readers = readers.filter(user_id__in=minhash.candidate_readers(user_id))
+    readers = readers.values('user_id')
+    affected = set(readers.values_list('user_id', flat=True))
+    if affected:
+        lists = {
+            other_id: (size, weakest)
+            for other_id, size, weakest in UserNeighborList.objects.filter(user_id__in=readers).values_list(
+                'user_id', 'size', 'weakest_score',
+            )
+        }
+        listing = UserNeighbor.objects.filter(user_id__in=readers, neighbor_id=user_id)
+        existing = set(listing.values_list('user_id', flat=True))
+
+        # Rows listing this reader are replaced rather than bulk_update()d, which would
+        # build a CASE per row: one DELETE and one INSERT however many readers list it
+        listing.delete()
+        kept = []
+        for other_id in existing:
+            size, weakest = lists.get(other_id, (0, 0))
+            if overlaps.get(other_id):
+                # Scores are symmetric, so this is also where user_id ranks for other_id
+                value = score(other_id, overlaps[other_id])
+                kept.append(UserNeighbor(
+                    user_id=other_id, neighbor_id=user_id,
+                    overlap_count=len(overlaps[other_id]), overlap_book_ids=sorted(overlaps[other_id]), score=value,
+                ))
+                if value < weakest:
+                    changed_lists[other_id] = (size, value)
+            else:
+                changed_lists[other_id] = (size - 1, weakest)
+        UserNeighbor.objects.bulk_create(kept)
+
+        candidates = {
+            other_id: (sorted(overlaps[other_id]), score(other_id, overlaps[other_id]))
+            for other_id in affected - existing if overlaps.get(other_id)
+        }
+        if candidates:
+            changed_lists.update(_offer_neighbor(user_id, candidates, k, lists))
+    _save_list_summaries(changed_lists)
+
+
+def _offer_neighbor(user_id, candidates, k, lists):
+    """
+    Add user_id to each candidate reader's list if it ranks in their top k, evicting
+    their weakest neighbor. `candidates` maps reader ids to (shared book ids, score),
+    `lists` reader ids to their stored (size, weakest score). Returns the new
+    (size, weakest score) of the lists that changed.
+    """
+    full = {
+        other_id for other_id, (_book_ids, value) in candidates.items()
+        if lists.get(other_id, (0, 0))[0] >= k and value >= lists[other_id][1]
+    }
+
+    # Entries of each full list that the candidate could outrank, weakest (lowest
+    # score, then highest neighbor id) first
+    outranked = defaultdict(list)
+    if full:
+        for row_id, other_id, neighbor_id, value in UserNeighbor.objects.filter(
+            user_id__in=full, score__lte=max(candidates[other_id][1] for other_id in full),
+        ).values_list('id', 'user_id', 'neighbor_id', 'score'):
+            outranked[other_id].append((value, -neighbor_id, row_id))
+        for rows in outranked.values():
+            rows.sort()
+
+    created = []
+    evicted = []
+    changed_lists = {}
+    for other_id, (_book_ids, value) in candidates.items():
+        size, weakest = lists.get(other_id, (0, 0))
+        if size < k:
+            created.append(other_id)
+            changed_lists[other_id] = (size + 1, min(weakest, value) if size else value)
+        elif outranked.get(other_id) and (value, -user_id) > outranked[other_id][0][:2]:
+            created.append(other_id)
+            evicted.append(outranked[other_id][0][2])
+            # Every entry not loaded scores above the highest candidate score
+            changed_lists[other_id] = (size, min([row[0] for row in outranked[other_id][1:]] + [value]))
+
+    UserNeighbor.objects.filter(id__in=evicted).delete()
+    UserNeighbor.objects.bulk_create([
+        UserNeighbor(
+            user_id=other_id, neighbor_id=user_id,
+            overlap_count=len(candidates[other_id][0]), overlap_book_ids=candidates[other_id][0],
+            score=candidates[other_id][1],
+        )
+        for other_id in created
+    ])
+    return changed_lists
+
+
+def neighbors_favorites_changed(pairs):
+    """Update neighbor lists after favorites given as (user_id, book_id) pairs were added or deleted."""
+    changed = defaultdict(set)
+    for user_id, book_id in pairs:
+        changed[user_id].add(book_id)
+    k = neighbors_k()
+    for user_id, book_ids in changed.items():
+        _refresh_user(user_id, book_ids, k)
+
+
+# Favorites index shared with forked rebuild workers (copy-on-write)
+_rebuild_index = None
+
+
+def _rebuild_chunk(args):
+    user_ids, k = args
+    user_books, book_readers, buckets, scorer, weights = _rebuild_index
+    rows = []
+    for user_id in user_ids:
+        my_count = len(user_books[user_id])
+
+        def score(neighbor_id, shared_ids):
+            return scorer(shared_ids, my_count, len(user_books[neighbor_id]), weights)
+
+        overlaps = defaultdict(set)
+        if buckets is not None:
+            bucket_users, user_buckets = buckets
+            my_books = set(user_books[user_id])
+            candidates = {other_id for bucket in user_buckets[user_id] for other_id in bucket_users[bucket]}
+            candidates.discard(user_id)
+            for other_id in candidates:
+                shared = my_books.intersection(user_books[other_id])
+                if shared:
+                    overlaps[other_id] = shared
+        else:
+            for book_id in user_books[user_id]:
+                for neighbor_id in book_readers[book_id]:
+                    if neighbor_id != user_id:
+                        overlaps[neighbor_id].add(book_id)
+        rows.extend((user_id, *neighbor) for neighbor in _top_neighbors(overlaps, k, score))
+    return len(user_ids), rows
+
+
+def rebuild_user_neighbors(workers=1, chunk_size=500, batch_size=5000, k=None, progress=None):
+    """
+    Recompute every reader's neighbors from the favorites table, fanning the work
+    out over `workers` forked processes. Returns (readers, rows written).
+    """
+    global _rebuild_index
+
+    k = k or neighbors_k()
+    user_books = defaultdict(list)
+    book_readers = defaultdict(list)
+    for user_id, book_id in UserFavoriteBook.objects.values_list('user_id', 'book_id').iterator(chunk_size=10000):
+        user_books[user_id].append(book_id)
+        book_readers[book_id].append(user_id)
+
+    user_ids = sorted(user_books)
+    chunks = [(user_ids[i:i + chunk_size], k) for i in range(0, len(user_ids), chunk_size)]
+    name, scorer, _threshold = scoring_strategy()
+    # Same weights as books.scoring.idf_weights, from the favorites just read
+    weights = (
+        {book_id: idf_weight(len(user_books), len(readers)) for book_id, readers in book_readers.items()}
+        if name == 'idf' else {}
+    )
+    buckets = minhash.load_buckets() if minhash.engine_enabled() else None
+    _rebuild_index = (user_books, book_readers, buckets, scorer, weights)
+
+    written = 0
+    done = 0
+    pool = None
+    try:
+        # Workers only use the index; close connections first so no child inherits
+        # (and later tears down) a socket or file handle the parent is using. That is
+        # not possible inside a caller's transaction, so run serially there.
+        if workers > 1 and len(chunks) > 1 and not connection.in_atomic_block:
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            results = pool.imap_unordered(_rebuild_chunk, chunks)
+        else:
+            results = map(_rebuild_chunk, chunks)
+        with transaction.atomic():
+            UserNeighbor.objects.all().delete()
+            UserNeighborList.objects.all().delete()
+            for chunk_users, rows in results:
+                UserNeighbor.objects.bulk_create(
+                    [
+                        UserNeighbor(user_id=u, neighbor_id=n, overlap_count=len(ids), overlap_book_ids=ids, score=value)
+                        for u, n, ids, value in rows
+                    ],
+                    batch_size=batch_size,
+                )
+                lists = defaultdict(list)
+                for row in rows:
+                    lists[row[0]].append(row)
+                UserNeighborList.objects.bulk_create(
+                    [UserNeighborList(user_id=u, size=len(user_rows), weakest_score=min(row[-1] for row in user_rows))
+                     for u, user_rows in lists.items()],
+                    batch_size=batch_size,
+                )
+                written += len(rows)
+                done += chunk_users
+                if progress:
+                    progress(done, len(user_ids))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _rebuild_index = None
+    return len(user_ids), written
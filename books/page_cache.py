@@ -0,0 +1,78 @@
+"""
+Rendered-page cache for public pages viewed by anonymous visitors.
+
+Anonymous pages are rendered once with a placeholder CSRF token in their forms
+(see books.context_processors.page_cache) and stored in the cache. Every anonymous
+visitor gets the same bytes and no cookie, so a CDN or reverse proxy may cache them
+too; the forms fetch the visitor's own token from csrf_token_view when submitted.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+CSRF_TOKEN_PLACEHOLDER = 'csrftokenplaceholder0000000000000000000000000000000000000000000'
+
+PAGE_CACHE_KEY_PREFIX = 'public_page'
+
+
+def _is_cacheable(request):
+    """Only anonymous GET/HEAD requests without pending flash messages share a rendered page."""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # len() loads pending messages without marking them as displayed
+    return len(messages.get_messages(request)) == 0
+
+
+def _patch_headers(response, anonymous):
+    patch_vary_headers(response, ('Cookie',))
+    if anonymous:
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=getattr(settings, 'PUBLIC_PAGE_BROWSER_MAX_AGE', 60),
+            s_maxage=getattr(settings, 'PUBLIC_PAGE_CACHE_TIMEOUT', 300),
+        )
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+
+
+def cache_public_page(version=None):
+    """
+    Serve anonymous GET requests for the decorated view from the rendered-page cache.
+
+    `version` is an optional callable(request) whose return value is part of the cache
+    key, so refreshing the data behind the page (e.g. SiteStats) invalidates it.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not _is_cacheable(request):
+                response = view_func(request, *args, **kwargs)
+                _patch_headers(response, anonymous=False)
+                return response
+
+            page_version = version(request) if version else ''
+            cache_key = f"{PAGE_CACHE_KEY_PREFIX}:{request.path}:{page_version}"
+            cached = cache.get(cache_key)
+
+            if cached is None:
+                request._page_cache_render = True
+                response = view_func(request, *args, **kwargs)
+                request._page_cache_render = False
+                if response.status_code != 200 or getattr(response, 'streaming', False):
+                    return response
+                cached = (response.content, response['Content-Type'])
+                cache.set(cache_key, cached, getattr(settings, 'PUBLIC_PAGE_CACHE_TIMEOUT', 300))
+
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            _patch_headers(response, anonymous=True)
+            return response
+        return _wrapped_view
+    return decorator
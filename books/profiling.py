@@ -0,0 +1,113 @@
+"""
+On-demand profiling of single requests, for capturing production hot paths.
+
+A staff user adds `?_profile=1` to any URL (or sends `X-Profile: 1`); the request
+runs under cProfile and is saved as a ProfileRun with its SQL log. The response
+carries `X-Profile-Run: <id>`, and the run can be downloaded from the admin as a
+.prof file (python -m pstats, snakeviz).
+
+Safeguards: staff only, at most PROFILE_RATE_LIMIT_PER_HOUR runs per user, the
+profile is dropped (the text summary is kept) above PROFILE_MAX_BYTES, the SQL log
+is capped at PROFILE_MAX_QUERIES statements, and only the newest PROFILE_RUNS_KEEP
+runs are kept.
+"""
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import ProfileRun
+
+logger = logging.getLogger(__name__)
+
+QUERY_PARAM = '_profile'
+HEADER = 'HTTP_X_PROFILE'
+SUMMARY_FUNCTIONS = 40
+SQL_PREVIEW_LENGTH = 2000
+
+
+def profiling_requested(request):
+    return request.GET.get(QUERY_PARAM) == '1' or request.META.get(HEADER) == '1'
+
+
+def rate_limited(user):
+    limit = getattr(settings, 'PROFILE_RATE_LIMIT_PER_HOUR', 10)
+    since = timezone.now() - timedelta(hours=1)
+    return ProfileRun.objects.filter(user=user, created_at__gte=since).count() >= limit
+
+
+class _SQLLog:
+    def __init__(self, max_queries):
+        self.max_queries = max_queries
+        self.entries = []
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            if len(self.entries) < self.max_queries:
+                self.entries.append({
+                    'ms': round((time.perf_counter() - started) * 1000, 2),
+                    'sql': sql[:SQL_PREVIEW_LENGTH],
+                })
+
+
+def _summary(profiler):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(SUMMARY_FUNCTIONS)
+    return out.getvalue()
+
+
+def profile_request(get_response, request):
+    """Run the request under cProfile and save a ProfileRun; returns the response."""
+    sql_log = _SQLLog(getattr(settings, 'PROFILE_MAX_QUERIES', 1000))
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    with connection.execute_wrapper(sql_log):
+        profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+    duration = time.perf_counter() - started
+
+    profiler.create_stats()
+    data = marshal.dumps(profiler.stats)
+    max_bytes = getattr(settings, 'PROFILE_MAX_BYTES', 5 * 1024 * 1024)
+    truncated = sql_log.count > len(sql_log.entries)
+    if len(data) > max_bytes:
+        logger.warning(f"Profile of {request.path} is {len(data)} bytes (cap {max_bytes}); keeping the summary only")
+        data = None
+        truncated = True
+
+    run = ProfileRun.objects.create(
+        user=request.user,
+        method=request.method,
+        path=request.get_full_path()[:500],
+        status_code=response.status_code,
+        duration_ms=round(duration * 1000, 1),
+        query_count=sql_log.count,
+        profile=data,
+        summary=_summary(profiler),
+        sql_log=sql_log.entries,
+        truncated=truncated,
+    )
+    _prune()
+    response['X-Profile-Run'] = str(run.pk)
+    return response
+
+
+def _prune():
+    keep = getattr(settings, 'PROFILE_RUNS_KEEP', 100)
+    stale = ProfileRun.objects.order_by('-created_at', '-pk').values_list('pk', flat=True)[keep:]
+    ProfileRun.objects.filter(pk__in=list(stale)).delete()
@@ -0,0 +1,108 @@
+"""
+Query budgets: the most SQL queries a view or function is allowed to run.
+
+    @query_budget(12)
+    def recommendation_view(request): ...
+
+    with query_budget(3, 'digest fan-out'):
+        ...
+
+With QUERY_BUDGETS_ENFORCED on (books.test_query_budgets turns it on), going
+over budget raises QueryBudgetExceeded, listing every query with the application
+code that issued it. Otherwise the overrun is only logged, and queries are counted
+without capturing stacks.
+"""
+import logging
+import os
+import traceback
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+# Application frames shown per query in a report
+ORIGIN_FRAMES = 3
+SQL_PREVIEW_LENGTH = 300
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def budgets_enforced():
+    return getattr(settings, 'QUERY_BUDGETS_ENFORCED', False)
+
+
+def _is_app_frame(filename):
+    base_dir = str(settings.BASE_DIR)
+    return (
+        filename.startswith(base_dir)
+        and 'site-packages' not in filename
+        and os.path.basename(filename) != 'query_budget.py'
+    )
+
+
+def _origin():
+    """The innermost application frames on the stack, outermost first."""
+    frames = [frame for frame in traceback.extract_stack() if _is_app_frame(frame.filename)]
+    base_dir = str(settings.BASE_DIR)
+    return [
+        f'{os.path.relpath(frame.filename, base_dir)}:{frame.lineno} in {frame.name}'
+        for frame in frames[-ORIGIN_FRAMES:]
+    ]
+
+
+class query_budget(ContextDecorator):
+    """
+    Context manager / decorator allowing at most `max_queries` queries on `using`.
+    As a decorator it also sets `query_budget` on the wrapped function, so tests can
+    look up a view's budget.
+    """
+
+    def __init__(self, max_queries, label=None, using=DEFAULT_DB_ALIAS):
+        self.max_queries = max_queries
+        self.label = label
+        self.using = using
+        self.queries = []
+
+    def __call__(self, func):
+        if self.label is None:
+            self.label = func.__qualname__
+        wrapped = super().__call__(func)
+        wrapped.query_budget = self.max_queries
+        return wrapped
+
+    def _recreate_cm(self):
+        # A fresh instance per call, so concurrent calls of a decorated view don't share state
+        return type(self)(self.max_queries, self.label, self.using)
+
+    def __enter__(self):
+        self.queries = []
+        self._enforced = budgets_enforced()
+        self._wrapper = connections[self.using].execute_wrapper(self._record)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._wrapper.__exit__(exc_type, exc, tb)
+        if exc_type is None and len(self.queries) > self.max_queries:
+            if self._enforced:
+                raise QueryBudgetExceeded(self.report())
+            logger.warning(
+                '%s ran %d queries (budget %d)', self.label or 'query_budget', len(self.queries), self.max_queries,
+            )
+        return False
+
+    def _record(self, execute, sql, params, many, context):
+        self.queries.append((sql, _origin() if self._enforced else []))
+        return execute(sql, params, many, context)
+
+    def report(self):
+        lines = [f'{self.label or "query_budget"} ran {len(self.queries)} queries, budget {self.max_queries}:']
+        for i, (sql, origin) in enumerate(self.queries, start=1):
+            preview = sql if len(sql) <= SQL_PREVIEW_LENGTH else sql[:SQL_PREVIEW_LENGTH] + '...'
+            lines.append(f'  {i}. {preview}')
+            lines.extend(f'       at {frame}' for frame in origin)
+        return '\n'.join(lines)
@@ -0,0 +1,149 @@
+"""
+Hot queries and their plans, checked by the check_query_plans command.
+
+The querysets behind search, my-books, the homepage snapshot and recommendations
+are built by small functions in the modules that run them, registered here with
+the arguments to explain them with:
+
+    @hot_query('my_books.favorites', lambda sample: {'user_id': sample.user_id})
+    def my_favorites(user_id):
+        return UserFavoriteBook.objects.filter(user_id=user_id)...
+
+explain_hot_queries() runs EXPLAIN (EXPLAIN QUERY PLAN on SQLite) for each one and
+reports full scans, temp B-trees and sorts that touch large tables.
+"""
+import importlib
+import re
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+# Modules defining hot queries; imported so their @hot_query decorators run
+HOT_QUERY_MODULES = ('books.services', 'books.views', 'books.stats', 'books.recommendations', 'books.cooccurrence')
+
+HOT_QUERIES = {}
+
+SQLITE_SCAN = re.compile(r'\bSCAN (\w+)')
+SQLITE_TEMP_BTREE = re.compile(r'USE TEMP B-TREE FOR ([A-Z ]+)')
+POSTGRES_SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+POSTGRES_SORT = re.compile(r'^\s*(?:->\s*)?(?:Incremental )?Sort\b', re.MULTILINE)
+
+
+def hot_query(name, arguments):
+    """Register a queryset builder; `arguments(sample)` returns its keyword arguments."""
+    def decorator(func):
+        HOT_QUERIES[name] = (func, arguments)
+        return func
+    return decorator
+
+
+def load_hot_queries():
+    for module in HOT_QUERY_MODULES:
+        importlib.import_module(module)
+    return HOT_QUERIES
+
+
+@dataclass
+class PlanSample:
+    """Realistic arguments for the hot queries, taken from the current database."""
+    user_id: int
+    book_id: int
+    book_ids: list
+    query: str
+    since: object = field(default_factory=lambda: timezone.now() - timedelta(days=7))
+
+    @property
+    def exclude_user_ids(self):
+        return [self.user_id]
+
+    @classmethod
+    def from_database(cls):
+        from .models import Book, UserFavoriteBook
+
+        # The reader with the most favorites and the most favorited book are the worst cases
+        heaviest = (
+            UserFavoriteBook.objects.values('user_id').annotate(count=Count('id')).order_by('-count', 'user_id').first()
+        )
+        book = Book.objects.order_by('-favorite_count', 'id').first()
+        if heaviest is None or book is None:
+            return None
+        book_ids = list(UserFavoriteBook.objects.filter(user_id=heaviest['user_id']).values_list('book_id', flat=True))
+        # A fragment from the middle of a title, as typed into the search box
+        words = [word for word in book.title.split() if len(word) >= 4]
+        query = words[0][1:4].lower() if words else book.title[:3].lower()
+        return cls(user_id=heaviest['user_id'], book_id=book.id, book_ids=book_ids, query=query)
+
+
+def table_sizes(tables):
+    """{table: row count} for the given tables."""
+    sizes = {}
+    with connection.cursor() as cursor:
+        for table in tables:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            sizes[table] = cursor.fetchone()[0]
+    return sizes
+
+
+def _queryset_tables(queryset):
+    query = queryset.query.clone()
+    query.get_compiler(connection=connection).setup_query()
+    return {join.table_name for join in query.alias_map.values()} or {queryset.model._meta.db_table}
+
+
+def plan_findings(plan, base_table, tables, large_tables):
+    """
+    Problems in an EXPLAIN plan, as stable strings for the baseline: full scans of
+    large tables, and temp B-trees / sorts / filesorts when the queried table is large.
+    """
+    large_base = base_table in large_tables
+    findings = set()
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        # Subqueries name their tables by alias (U0, ...); count those as large when the base table is
+        findings.update(
+            f'scan {table}' for table in SQLITE_SCAN.findall(plan)
+            if table in large_tables or (large_base and table not in tables)
+        )
+        if large_base:
+            findings.update(f'temp b-tree for {purpose.strip().lower()}' for purpose in SQLITE_TEMP_BTREE.findall(plan))
+    elif vendor == 'postgresql':
+        findings.update(f'scan {table}' for table in POSTGRES_SEQ_SCAN.findall(plan) if table in large_tables)
+        if large_base and POSTGRES_SORT.search(plan):
+            findings.add('sort')
+    elif large_base:
+        if 'Using filesort' in plan:
+            findings.add('filesort')
+        if 'Using temporary' in plan:
+            findings.add('temporary table')
+    return sorted(findings)
+
+
+def explain_hot_queries(sample, large_table_rows, names=None):
+    """[(name, plan, findings)] for every registered hot query (or those in `names`)."""
+    queries = {
+        name: func(**arguments(sample))
+        for name, (func, arguments) in sorted(load_hot_queries().items())
+        if not names or name in names
+    }
+    tables = {name: _queryset_tables(queryset) for name, queryset in queries.items()}
+    sizes = table_sizes(set().union(*tables.values())) if tables else {}
+    large_tables = {table for table, rows in sizes.items() if rows >= large_table_rows}
+    return [
+        (name, plan, plan_findings(plan, queryset.model._meta.db_table, tables[name], large_tables))
+        for name, queryset in queries.items()
+        for plan in [queryset.explain()]
+    ]
+
+
+def compare_to_baseline(results, baseline):
+    """(regressions, fixed): findings not in the baseline, and baseline findings no longer seen."""
+    regressions = []
+    fixed = []
+    for name, _plan, findings in results:
+        known = set(baseline.get(name, []))
+        regressions.extend((name, finding) for finding in findings if finding not in known)
+        fixed.extend((name, finding) for finding in sorted(known - set(findings)))
+    return regressions, fixed
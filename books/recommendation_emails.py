@@ -0,0 +1,235 @@
+"""
+Emails telling readers that someone among their most similar readers added new
+favorites.
+
+By default they are sent while the favorites are saved, so a save by a reader whom
+many others follow renders and sends one email per follower before the redirect
+(about 1,400 emails and a 4s median on the 2,000-reader benchmark dataset). With
+RECOMMENDATION_EMAILS_DEFERRED = True the request only queues the saving reader (one
+insert) and send_recommendation_emails sends them from cron or a worker process;
+turn it on only where that command runs, or the queue just grows.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import get_connection, send_mail
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from .metrics import EMAILS_SENT
+from .models import Book, QueuedRecommendationEmails, UserEmailPreferences, UserFavoriteBook, UserNeighbor
+from .timing import timed_stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SITE_URL = 'https://www.greatmindsreadalike.org'
+
+
+def emails_deferred():
+    return getattr(settings, 'RECOMMENDATION_EMAILS_DEFERRED', False)
+
+
+def site_base_url(request):
+    """Base URL for links in emails: SITE_BASE_URL, else the request's host, without a trailing slash."""
+    site_url = getattr(settings, 'SITE_BASE_URL', '')
+    if not site_url:
+        # Try to build from request, otherwise use default Heroku domain
+        try:
+            site_url = request.build_absolute_uri('/').rstrip('/')
+            # If site_url is malformed (e.g., just '/'), use default
+            if not site_url or site_url.startswith('http:///') or site_url.startswith('https:///'):
+                site_url = DEFAULT_SITE_URL
+        except Exception:
+            site_url = DEFAULT_SITE_URL
+
+    # Ensure site_url includes "www." if it's greatmindsreadalike.org
+    if site_url and 'greatmindsreadalike.org' in site_url and 'www.' not in site_url:
+        site_url = site_url.replace('https://greatmindsreadalike.org', DEFAULT_SITE_URL)
+        site_url = site_url.replace('http://greatmindsreadalike.org', DEFAULT_SITE_URL)
+
+    # Ensure site_url doesn't end with a slash (except for root)
+    if site_url and site_url != '/' and site_url.endswith('/'):
+        site_url = site_url.rstrip('/')
+    return site_url
+
+
+def queue_recommendation_emails(user_id, site_url):
+    """
+    Announce a reader's new favorites to the readers who list them as a neighbor:
+    queued for send_recommendation_emails, or sent now if deferral is off. A reader
+    already waiting in the queue is not queued twice.
+    """
+    if not emails_deferred():
+        return send_new_recommendation_emails(user_id, site_url)
+    QueuedRecommendationEmails.objects.bulk_create(
+        [QueuedRecommendationEmails(user_id=user_id, site_url=site_url)], ignore_conflicts=True,
+    )
+    return 0
+
+
+def send_queued_recommendation_emails(limit=None):
+    """Send the emails for queued readers, oldest first. Returns (readers handled, emails sent)."""
+    queued = QueuedRecommendationEmails.objects.order_by('queued_at').values_list('user_id', 'site_url')
+    readers = 0
+    sent = 0
+    for user_id, site_url in queued[:limit] if limit else queued:
+        # Deleting the row claims it, so concurrent runs don't email the same readers twice
+        claimed, _ = QueuedRecommendationEmails.objects.filter(user_id=user_id).delete()
+        if not claimed:
+            continue
+        readers += 1
+        sent += send_new_recommendation_emails(user_id, site_url)
+    return readers, sent
+
+
+def send_new_recommendation_emails(user_id, site_url):
+    """
+    Email every reader (User A) who has `user_id` (User B) among their most similar
+    readers, has an email address and is due, about books their similar readers added
+    this week that they haven't favorited. Returns the number of emails sent.
+    """
+    # Readers who have User B among their most similar readers and have an email
+    # address (authenticated users only)
+    similar_users = (
+        User.objects.filter(
+            neighbors__neighbor_id=user_id,
+            email__isnull=False,
+            email__gt='',  # Email is not empty
+            is_active=True
+        )
+        .exclude(id=user_id)  # Exclude User B
+    )
+
+    # Everything the loop needs is loaded up front in a fixed number of queries, so the
+    # cost doesn't grow with how many readers follow User B
+    now = timezone.now()
+    seven_days_ago = now - timedelta(days=7)
+    recipients = {user.id: user for user in similar_users}
+    UserEmailPreferences.objects.bulk_create(
+        [UserEmailPreferences(user_id=recipient_id) for recipient_id in recipients], ignore_conflicts=True,
+    )
+    # Skip readers who unsubscribed or were emailed less than a week ago
+    due_ids = set(
+        UserEmailPreferences.objects.filter(
+            user_id__in=recipients, receive_recommendation_emails=True,
+        ).exclude(last_recommendation_email_sent__gt=seven_days_ago).values_list('user_id', flat=True)
+    )
+    if not due_ids:
+        return 0
+
+    # Each due reader's (User A's) favorites and most similar readers
+    favorite_book_ids = {reader_id: set() for reader_id in due_ids}
+    for reader_id, book_id in UserFavoriteBook.objects.filter(user_id__in=due_ids).values_list('user_id', 'book_id'):
+        favorite_book_ids[reader_id].add(book_id)
+    neighbor_ids = {reader_id: [] for reader_id in due_ids}
+    new_similar_users_this_week = dict.fromkeys(due_ids, 0)
+    for reader_id, neighbor_id, joined in UserNeighbor.objects.filter(user_id__in=due_ids).values_list(
+        'user_id', 'neighbor_id', 'neighbor__date_joined',
+    ):
+        neighbor_ids[reader_id].append(neighbor_id)
+        # New users (authenticated + guest) who joined in the last 7 days with mutual favorites
+        if joined >= seven_days_ago:
+            new_similar_users_this_week[reader_id] += 1
+    neighbor_favorites = {}
+    for neighbor_id, book_id, created_at in UserFavoriteBook.objects.filter(
+        user_id__in={n for ids in neighbor_ids.values() for n in ids},
+    ).values_list('user_id', 'book_id', 'created_at'):
+        neighbor_favorites.setdefault(neighbor_id, []).append((book_id, created_at))
+
+    pending = []
+    for reader_id in due_ids:
+        mine = favorite_book_ids[reader_id]
+        recommended = set()
+        new_book_ids = set()
+        for neighbor_id in neighbor_ids[reader_id]:
+            for book_id, created_at in neighbor_favorites.get(neighbor_id, ()):
+                if book_id not in mine:
+                    recommended.add(book_id)
+                    # Books User A doesn't have that their similar readers added in the past 7 days
+                    if created_at >= seven_days_ago:
+                        new_book_ids.add(book_id)
+        # Only send email if there are new books
+        if new_book_ids:
+            # Limit to 10 books for the email; the total counts all unique recommended books
+            # (not just from past 7 days), as on the recommendations page
+            pending.append((recipients[reader_id], sorted(new_book_ids)[:10], len(recommended)))
+    books = Book.objects.select_related('author').in_bulk(
+        {book_id for _, book_ids, _ in pending for book_id in book_ids}
+    )
+
+    sent_ids = []
+    mail_connection = get_connection(fail_silently=True)
+    if pending:
+        # Opened once, so every email reuses the SMTP session instead of reconnecting
+        with timed_stage('email'):
+            mail_connection.open()
+    for user_a, book_ids, total_recommendations_count in pending:
+        books_for_email = [books[book_id] for book_id in book_ids if book_id in books]
+        if not books_for_email:
+            continue
+        try:
+            _send_email(
+                mail_connection, user_a, site_url, books_for_email, total_recommendations_count,
+                new_similar_users_this_week[user_a.id],
+            )
+            sent_ids.append(user_a.id)
+            EMAILS_SENT.inc(kind='recommendations')
+        except Exception as e:
+            # Log error but don't break the flow
+            logger.error(f"Error sending recommendation email to {user_a.email}: {str(e)}")
+    mail_connection.close()
+
+    # Record when the emails were sent
+    UserEmailPreferences.objects.filter(user_id__in=sent_ids).update(last_recommendation_email_sent=now, updated_at=now)
+    return len(sent_ids)
+
+
+def _send_email(mail_connection, user_a, site_url, books_for_email, total_recommendations_count, new_similar_users):
+    additional_count = max(0, total_recommendations_count - 10)
+    subject = 'Your Weekly Book Recommendations!'
+
+    # Generate unsubscribe token
+    token = default_token_generator.make_token(user_a)
+    uid = urlsafe_base64_encode(force_bytes(user_a.pk))
+    unsubscribe_url = f"{site_url}{reverse('unsubscribe_recommendations', kwargs={'uidb64': uid, 'token': token})}"
+
+    # Create email content
+    html_message = render_to_string('registration/email_new_recommendations.html', {
+        'user': user_a,
+        'new_books': books_for_email,
+        'total_recommendations_count': total_recommendations_count,
+        'additional_count': additional_count,
+        'new_similar_users_this_week': new_similar_users,
+        'site_url': site_url,
+        'site_name': 'Great Minds Read Alike',
+        'unsubscribe_url': unsubscribe_url,
+    })
+    plain_message = f"Hi {user_a.username},\n\n"
+    plain_message += "Great news! Other readers who share some of your favorite books have added new favorites that you might love, too.\n\n"
+    if new_similar_users > 0:
+        plain_message += f"{new_similar_users} new reader(s) with similar taste joined this week.\n\n"
+    plain_message += "Here are the books they added that you haven't listed as favorites yet:\n\n"
+    for book in books_for_email:
+        plain_message += f"- {book.title} by {book.author.name}\n"
+    if additional_count > 0:
+        plain_message += f"\nThere are {additional_count} more recommendations waiting for you on your recommendations page!\n"
+    plain_message += f"\nVisit {site_url}{reverse('recommendations')} to see more recommendations!\n\n"
+    plain_message += f"\nIf you no longer wish to receive these emails, you can unsubscribe here: {unsubscribe_url}\n\n"
+    plain_message += "Happy reading!\n— Great Minds Read Alike"
+
+    with timed_stage('email'):
+        send_mail(
+            subject,
+            plain_message,
+            settings.DEFAULT_FROM_EMAIL,
+            [user_a.email],
+            html_message=html_message,
+            fail_silently=True,  # Don't break the flow if email fails
+            connection=mail_connection,
+        )
@@ -0,0 +1,442 @@
+"""
+Reader-to-reader recommendations: find readers who share favorites with me and
+suggest the other books they love.
+
+For a known reader the similar readers come from their precomputed top-K
+UserNeighbor list (see books.neighbors). Otherwise overlaps are computed either
+from the database (two queries) or, when RECOMMENDATION_GRAPH_DIR is set and
+build_recommendation_graph has been run, from a memory-mapped CSR graph that every
+gunicorn worker shares through the page cache. Either way the database is only
+touched afterwards to hydrate the books, readers and explanations that end up on
+the page. Similar readers are ranked and pruned by the strategy in books.scoring.
+"""
+import array
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .graph import GraphFormatError, Section, read_snapshot, write_snapshot
+from .metrics import PRECOMPUTED_RECOMMENDATIONS, RECOMMENDATION_COMPUTE, SIMILAR_USERS_SCANNED
+from .models import Book, PrecomputedRecommendations, UserFavoriteBook, UserNeighbor
+from .query_plans import hot_query
+from .scoring import NEEDS_READER_SIZES, idf_weights, scoring_strategy
+
+logger = logging.getLogger(__name__)
+
+GRAPH_POINTER_FILE = 'CURRENT'
+GRAPH_GENERATIONS_KEPT = 2
+
+
+class RecommendationGraph:
+    """
+    Favorites as two CSR adjacency lists over a memory-mapped snapshot:
+    user -> favorite books and book -> readers. All arrays are zero-copy int64
+    views of the file, so workers mapping the same generation share its pages.
+    """
+
+    SECTIONS = ('UIDS', 'UOFF', 'UBKS', 'BIDS', 'BOFF', 'BUSR', 'META')
+
+    def __init__(self, generation, mm, sections):
+        self.generation = generation
+        self._mm = mm
+        self.user_ids = sections['UIDS'].values()
+        self.user_offsets = sections['UOFF'].values()
+        self.user_books = sections['UBKS'].values()
+        self.book_ids = sections['BIDS'].values()
+        self.book_offsets = sections['BOFF'].values()
+        self.book_readers = sections['BUSR'].values()
+        # favorites count and highest favorite id at build time
+        self.favorites_count, self.max_favorite_id = sections['META'].values()
+
+    @staticmethod
+    def _row(ids, offsets, values, key):
+        index = bisect.bisect_left(ids, key)
+        if index == len(ids) or ids[index] != key:
+            return ()
+        return values[offsets[index]:offsets[index + 1]]
+
+    def books_of(self, user_id):
+        return self._row(self.user_ids, self.user_offsets, self.user_books, user_id)
+
+    def readers_of(self, book_id):
+        return self._row(self.book_ids, self.book_offsets, self.book_readers, book_id)
+
+
+def _csr_arrays(pairs):
+    """Build (keys, offsets, values) CSR arrays from (key, value) pairs sorted by key."""
+    keys = array.array('q')
+    offsets = array.array('q', [0])
+    values = array.array('q')
+    for key, value in pairs:
+        if not keys or keys[-1] != key:
+            if keys:
+                offsets.append(len(values))
+            keys.append(key)
+        values.append(value)
+    if keys:
+        offsets.append(len(values))
+    return keys, offsets, values
+
+
+def build_recommendation_graph(directory, chunk_size=10000):
+    """
+    Write a new generation of the recommendation graph to `directory` and point
+    CURRENT at it. Returns (generation, favorites written).
+    """
+    os.makedirs(directory, exist_ok=True)
+    max_favorite_id = UserFavoriteBook.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    user_ids, user_offsets, user_books = _csr_arrays(
+        UserFavoriteBook.objects.order_by('user_id', 'book_id')
+        .values_list('user_id', 'book_id').iterator(chunk_size=chunk_size)
+    )
+    book_ids, book_offsets, book_readers = _csr_arrays(
+        UserFavoriteBook.objects.order_by('book_id', 'user_id')
+        .values_list('book_id', 'user_id').iterator(chunk_size=chunk_size)
+    )
+
+    # Fixed int64 columns so workers can use them straight from the map
+    sections = [
+        Section.ints('UIDS', user_ids, delta=False, typecode='q'),
+        Section.ints('UOFF', user_offsets, delta=False, typecode='q'),
+        Section.ints('UBKS', user_books, delta=False, typecode='q'),
+        Section.ints('BIDS', book_ids, delta=False, typecode='q'),
+        Section.ints('BOFF', book_offsets, delta=False, typecode='q'),
+        Section.ints('BUSR', book_readers, delta=False, typecode='q'),
+        Section.ints('META', [len(user_books), max_favorite_id], delta=False, typecode='q'),
+    ]
+
+    generation = (_read_generation(directory) or 0) + 1
+    write_snapshot(os.path.join(directory, f'graph-{generation}.csr'), sections)
+
+    # Swap generations by atomically replacing the pointer file
+    pointer = os.path.join(directory, GRAPH_POINTER_FILE)
+    with open(f'{pointer}.tmp{os.getpid()}', 'w') as f:
+        f.write(f'{generation}\n')
+    os.replace(f'{pointer}.tmp{os.getpid()}', pointer)
+
+    # Workers may still map the previous generation; unlinking a mapped file is safe
+    for name in os.listdir(directory):
+        if name.startswith('graph-') and name.endswith('.csr'):
+            old_generation = int(name[len('graph-'):-len('.csr')])
+            if old_generation <= generation - GRAPH_GENERATIONS_KEPT:
+                os.unlink(os.path.join(directory, name))
+
+    return generation, len(user_books)
+
+
+def _read_generation(directory):
+    try:
+        with open(os.path.join(directory, GRAPH_POINTER_FILE)) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def load_recommendation_graph(directory, generation=None):
+    """Map the current (or the given) generation of the graph, or return None if there isn't one."""
+    generation = generation or _read_generation(directory)
+    if generation is None:
+        return None
+    mm, sections = read_snapshot(os.path.join(directory, f'graph-{generation}.csr'), verify=False)
+    missing = [name for name in RecommendationGraph.SECTIONS if name not in sections]
+    if missing:
+        sections.clear()
+        mm.close()
+        raise GraphFormatError(f'Recommendation graph {generation} is missing sections: {", ".join(missing)}')
+    return RecommendationGraph(generation, mm, sections)
+
+
+_shared_graph = None
+_shared_graph_checked_at = 0.0
+_shared_graph_lock = threading.Lock()
+
+
+def get_shared_graph():
+    """
+    Return this process's mapping of the current recommendation graph, or None
+    if RECOMMENDATION_GRAPH_DIR is unset or no graph has been built.
+
+    The pointer file is re-read at most every RECOMMENDATION_GRAPH_CHECK_SECONDS;
+    when its generation changes the new file is mapped and swapped in, and the
+    old mapping is released once requests using it finish.
+    """
+    global _shared_graph, _shared_graph_checked_at
+
+    directory = getattr(settings, 'RECOMMENDATION_GRAPH_DIR', '')
+    if not directory:
+        return None
+
+    interval = getattr(settings, 'RECOMMENDATION_GRAPH_CHECK_SECONDS', 30)
+    if time.monotonic() - _shared_graph_checked_at < interval:
+        return _shared_graph
+
+    with _shared_graph_lock:
+        if time.monotonic() - _shared_graph_checked_at >= interval:
+            generation = _read_generation(directory)
+            if generation is not None and (_shared_graph is None or _shared_graph.generation != generation):
+                try:
+                    _shared_graph = load_recommendation_graph(directory, generation)
+                except (OSError, GraphFormatError) as e:
+                    logger.error(f"Could not load recommendation graph generation {generation}: {e}")
+            _shared_graph_checked_at = time.monotonic()
+    return _shared_graph
+
+
+@hot_query(
+    'recommendations.similar_reader_favorites',
+    lambda sample: {'my_book_ids': sample.book_ids, 'exclude_user_ids': sample.exclude_user_ids},
+)
+def similar_reader_favorite_rows(my_book_ids, exclude_user_ids):
+    """(user_id, book_id) for every favorite of every reader sharing a favorite with me."""
+    similar_user_ids = (
+        UserFavoriteBook.objects.filter(book_id__in=my_book_ids)
+        .exclude(user_id__in=exclude_user_ids)
+        .values('user_id')
+    )
+    return UserFavoriteBook.objects.filter(user_id__in=similar_user_ids).values_list('user_id', 'book_id')
+
+
+def _similar_reader_favorites_db(my_book_ids, exclude_user_ids):
+    """{user_id: set of favorite book ids} for every reader sharing a favorite with me."""
+    their_favorites = defaultdict(set)
+    for user_id, book_id in similar_reader_favorite_rows(my_book_ids, exclude_user_ids):
+        their_favorites[user_id].add(book_id)
+    return their_favorites
+
+
+def _similar_reader_favorites_graph(graph, my_book_ids, exclude_user_ids):
+    similar_user_ids = set()
+    for book_id in my_book_ids:
+        similar_user_ids.update(graph.readers_of(book_id))
+    similar_user_ids.difference_update(exclude_user_ids)
+    return {user_id: set(graph.books_of(user_id)) for user_id in similar_user_ids}
+
+
+def _favorites_of(graph, user_ids):
+    """{user_id: set of favorite book ids} for the given readers."""
+    if graph is not None:
+        return {user_id: set(graph.books_of(user_id)) for user_id in user_ids}
+    their_favorites = defaultdict(set)
+    for user_id, book_id in UserFavoriteBook.objects.filter(user_id__in=user_ids).values_list('user_id', 'book_id'):
+        their_favorites[user_id].add(book_id)
+    return their_favorites
+
+
+def _favorite_counts(graph, user_ids):
+    if graph is not None:
+        return {user_id: len(graph.books_of(user_id)) for user_id in user_ids}
+    return dict(
+        UserFavoriteBook.objects.filter(user_id__in=user_ids)
+        .values('user_id').annotate(count=Count('id')).values_list('user_id', 'count')
+    )
+
+
+@hot_query(
+    'recommendations.neighbor_overlaps',
+    lambda sample: {'user_id': sample.user_id, 'exclude_user_ids': sample.exclude_user_ids},
+)
+def stored_neighbor_overlaps(user_id, exclude_user_ids):
+    return (
+        UserNeighbor.objects.filter(user_id=user_id)
+        .exclude(neighbor_id__in=exclude_user_ids)
+        .values_list('neighbor_id', 'overlap_book_ids')
+    )
+
+
+def _scored_neighbor_favorites(graph, user_id, my_book_ids, exclude_user_ids, name, score, threshold):
+    """
+    Score the reader's stored neighbors from their stored overlaps and load favorites
+    only for those at or above the threshold. Returns (scores, their favorites).
+    """
+    overlaps = {}
+    for neighbor_id, book_ids in stored_neighbor_overlaps(user_id, exclude_user_ids):
+        shared = my_book_ids.intersection(book_ids)
+        if shared:
+            overlaps[neighbor_id] = shared
+    sizes = _favorite_counts(graph, overlaps.keys()) if name in NEEDS_READER_SIZES else {}
+    scores = {neighbor_id: score(shared, sizes.get(neighbor_id, 0)) for neighbor_id, shared in overlaps.items()}
+    scores = {neighbor_id: value for neighbor_id, value in scores.items() if value >= threshold}
+    return scores, _favorites_of(graph, scores.keys())
+
+
+def find_recommendations(my_book_ids, exclude_user_ids=(), user_id=None, scoring=None):
+    """
+    Work out recommendations without hydrating anything. With `user_id` only that
+    reader's stored neighbors are considered. Readers are scored with `scoring` (or
+    RECOMMENDATION_SCORING, see books.scoring) and dropped below its threshold.
+
+    Returns {user_id: {'overlap_ids', 'score', 'book_ids'}} for every similar reader;
+    each recommended book is credited to the reader with the highest score (lowest
+    user id on ties), so `book_ids` is empty for readers who add nothing new.
+    """
+    my_book_ids = set(my_book_ids)
+    if not my_book_ids:
+        return {}
+
+    name, scorer, threshold = scoring_strategy(scoring)
+    weights = idf_weights(my_book_ids) if name == 'idf' else {}
+
+    def score(shared_ids, their_count):
+        return scorer(shared_ids, len(my_book_ids), their_count, weights)
+
+    started = time.perf_counter()
+    graph = get_shared_graph()
+    if user_id is not None:
+        source = 'neighbors'
+        scores, their_favorites = _scored_neighbor_favorites(
+            graph, user_id, my_book_ids, exclude_user_ids, name, score, threshold
+        )
+    else:
+        if graph is not None:
+            source = 'graph'
+            their_favorites = _similar_reader_favorites_graph(graph, my_book_ids, set(exclude_user_ids))
+        else:
+            source = 'database'
+            their_favorites = _similar_reader_favorites_db(my_book_ids, exclude_user_ids)
+        scores = {
+            reader_id: score(my_book_ids & book_ids, len(book_ids))
+            for reader_id, book_ids in their_favorites.items()
+        }
+
+    readers = {}
+    best_reader = {}  # book_id -> (score, user_id)
+    for reader_id in sorted(their_favorites):
+        book_ids = their_favorites[reader_id]
+        overlap_ids = my_book_ids & book_ids
+        reader_score = scores.get(reader_id, 0)
+        if not overlap_ids or reader_score < threshold:
+            continue
+        readers[reader_id] = {'overlap_ids': overlap_ids, 'score': reader_score, 'book_ids': []}
+        for book_id in sorted(book_ids - my_book_ids):
+            if book_id not in best_reader or reader_score > best_reader[book_id][0]:
+                best_reader[book_id] = (reader_score, reader_id)
+
+    for book_id, (_, reader_id) in sorted(best_reader.items()):
+        readers[reader_id]['book_ids'].append(book_id)
+
+    RECOMMENDATION_COMPUTE.observe(time.perf_counter() - started, source=source)
+    SIMILAR_USERS_SCANNED.observe(len(their_favorites), source=source)
+    return readers
+
+
+def precompute_recommendations(user_ids):
+    """
+    Compute and store recommendations for the given readers with the configured
+    engine and scoring. Returns {user_id: compute seconds}.
+    """
+    favorites = defaultdict(set)
+    for user_id, book_id in UserFavoriteBook.objects.filter(user_id__in=user_ids).values_list('user_id', 'book_id'):
+        favorites[user_id].add(book_id)
+
+    name = scoring_strategy()[0]
+    rows = []
+    timings = {}
+    for user_id in user_ids:
+        if user_id not in favorites:
+            continue
+        started = time.perf_counter()
+        readers = find_recommendations(favorites[user_id], {user_id}, user_id=user_id)
+        timings[user_id] = time.perf_counter() - started
+        rows.append(PrecomputedRecommendations(
+            user_id=user_id,
+            readers={
+                str(reader_id): {
+                    'overlap_ids': sorted(data['overlap_ids']),
+                    'score': data['score'],
+                    'book_ids': data['book_ids'],
+                }
+                for reader_id, data in readers.items()
+            },
+            scoring=name,
+            computed_at=timezone.now(),
+        ))
+    PrecomputedRecommendations.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['user'], update_fields=['readers', 'scoring', 'computed_at'],
+    )
+    return timings
+
+
+def load_precomputed_recommendations(user_id, exclude_user_ids=()):
+    """find_recommendations() output stored for the reader, or None if there is none for the current scoring."""
+    stored = (
+        PrecomputedRecommendations.objects.filter(user_id=user_id, scoring=scoring_strategy()[0])
+        .values_list('readers', flat=True).first()
+    )
+    if stored is None:
+        return None
+    return {
+        int(reader_id): {'overlap_ids': set(data['overlap_ids']), 'score': data['score'], 'book_ids': data['book_ids']}
+        for reader_id, data in stored.items()
+        if int(reader_id) not in exclude_user_ids
+    }
+
+
+def invalidate_precomputed_recommendations(user_ids):
+    """
+    Drop the stored recommendations of the given readers and of every reader whose
+    neighbor list includes one of them, since those are built from their favorites.
+    """
+    user_ids = list(user_ids)
+    listing = UserNeighbor.objects.filter(neighbor_id__in=user_ids).values('user_id')
+    PrecomputedRecommendations.objects.filter(Q(user_id__in=user_ids) | Q(user_id__in=listing)).delete()
+
+
+def get_recommendation_groups(my_book_ids, exclude_user_ids=(), user_id=None, scoring=None):
+    """
+    Recommendations grouped by similar reader, highest score first, hydrated for
+    recommendations.html. Uses the reader's precomputed recommendations when there
+    are any. Returns (groups, similar readers count, recommended books count).
+    """
+    readers = None
+    if user_id is not None and scoring is None:
+        readers = load_precomputed_recommendations(user_id, exclude_user_ids)
+        PRECOMPUTED_RECOMMENDATIONS.inc(result='miss' if readers is None else 'hit')
+    if readers is None:
+        readers = find_recommendations(my_book_ids, exclude_user_ids, user_id=user_id, scoring=scoring)
+    recommending = {user_id: data for user_id, data in readers.items() if data['book_ids']}
+    if not recommending:
+        return [], len(readers), 0
+
+    book_ids = set()
+    for data in recommending.values():
+        book_ids.update(data['book_ids'])
+        book_ids.update(data['overlap_ids'])
+    books = Book.objects.select_related('author').in_bulk(book_ids)
+    users = User.objects.in_bulk(recommending.keys())
+    explanations = {
+        (user_id, book_id): explanation
+        for user_id, book_id, explanation in UserFavoriteBook.objects.filter(
+            user_id__in=recommending.keys(),
+            book_id__in={book_id for data in recommending.values() for book_id in data['book_ids']},
+        ).values_list('user_id', 'book_id', 'explanation')
+    }
+
+    groups = []
+    recommendations_count = 0
+    for user_id, data in recommending.items():
+        recommended_books = [
+            {'book': books[book_id], 'explanation': explanations.get((user_id, book_id), '')}
+            for book_id in data['book_ids']
+            if book_id in books
+        ]
+        if user_id not in users or not recommended_books:
+            continue
+        recommendations_count += len(recommended_books)
+        groups.append({
+            'similar_user': users[user_id],
+            'overlap_count': len(data['overlap_ids']),
+            'score': data['score'],
+            'overlapping_titles': [books[book_id].title for book_id in sorted(data['overlap_ids']) if book_id in books],
+            'recommended_books': recommended_books,
+        })
+
+    groups.sort(key=lambda group: group['score'], reverse=True)
+    return groups, len(readers), recommendations_count
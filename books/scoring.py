@@ -0,0 +1,81 @@
+"""
+How similar readers are scored before their favorites become recommendations.
+
+RECOMMENDATION_SCORING picks the strategy:
+
+    overlap   number of shared favorites (the original ranking)
+    jaccard   shared / all favorites of either reader
+    cosine    shared / sqrt(my favorites * their favorites)
+    idf       shared favorites weighted by log(1 + readers / book favorite_count), so
+              sharing a book nearly everyone loves counts for little
+
+The same strategy picks which readers fill each reader's stored top-K neighbor list
+(books.neighbors). Every score is symmetric: score(a, b) == score(b, a).
+
+Neighbors scoring below the strategy's threshold (RECOMMENDATION_SCORE_THRESHOLDS)
+are dropped before their favorites are expanded into candidate books.
+"""
+import math
+
+from django.conf import settings
+
+from .models import Book
+from .stats import get_site_stats
+
+DEFAULT_THRESHOLDS = {
+    'overlap': 1,
+    'jaccard': 0.01,
+    'cosine': 0.02,
+    'idf': 1.0,
+}
+
+
+def overlap_score(shared_ids, my_count, their_count, weights):
+    return len(shared_ids)
+
+
+def jaccard_score(shared_ids, my_count, their_count, weights):
+    union = my_count + their_count - len(shared_ids)
+    return len(shared_ids) / union if union else 0.0
+
+
+def cosine_score(shared_ids, my_count, their_count, weights):
+    return len(shared_ids) / math.sqrt(my_count * their_count) if my_count and their_count else 0.0
+
+
+def idf_score(shared_ids, my_count, their_count, weights):
+    # Summed in id order so a pair scores the same float whichever side computes it
+    return sum(weights.get(book_id, 0.0) for book_id in sorted(shared_ids))
+
+
+SCORERS = {
+    'overlap': overlap_score,
+    'jaccard': jaccard_score,
+    'cosine': cosine_score,
+    'idf': idf_score,
+}
+
+# Strategies that need each neighbor's total number of favorites
+NEEDS_READER_SIZES = {'jaccard', 'cosine'}
+
+
+def scoring_strategy(name=None):
+    """Return (name, score function, threshold) for `name` or RECOMMENDATION_SCORING."""
+    name = name or getattr(settings, 'RECOMMENDATION_SCORING', 'overlap')
+    if name not in SCORERS:
+        raise ValueError(f"Unknown RECOMMENDATION_SCORING {name!r}; choose from {', '.join(SCORERS)}")
+    thresholds = {**DEFAULT_THRESHOLDS, **getattr(settings, 'RECOMMENDATION_SCORE_THRESHOLDS', {})}
+    return name, SCORERS[name], thresholds[name]
+
+
+def idf_weight(readers, favorite_count):
+    return math.log(1 + max(readers, 1) / max(favorite_count, 1))
+
+
+def idf_weights(book_ids):
+    """{book_id: log(1 + readers / favorite_count)} for the given books."""
+    readers = get_site_stats().unique_readers
+    return {
+        book_id: idf_weight(readers, favorite_count)
+        for book_id, favorite_count in Book.objects.filter(id__in=book_ids).values_list('id', 'favorite_count')
+    }
@@ -2,15 +2,23 @@ import requests
 import hashlib
 import logging
 import time
+from django.conf import settings
 from django.core.cache import cache
 from django.db.models import Q
 from books.models import Book, Author
+from books.metrics import GOOGLE_BOOKS_CACHE, GOOGLE_BOOKS_RATE_LIMITED
+from books.query_plans import hot_query
+from books.timing import timed_stage
 
 logger = logging.getLogger(__name__)
 
 # Create a session for connection pooling (reuses TCP connections)
 _session = requests.Session()
 
+def google_books_api_url():
+    """The volumes endpoint; GOOGLE_BOOKS_API_URL points it at a stand-in (see the loadtest command)."""
+    return getattr(settings, 'GOOGLE_BOOKS_API_URL', 'https://www.googleapis.com/books/v1/volumes')
+
 def sanitize_cache_key(query):
     """
     Sanitize a query string for use in cache keys.
@@ -26,6 +34,16 @@ def sanitize_cache_key(query):
         return hashlib.md5(sanitized.encode('utf-8')).hexdigest()
     return sanitized
 
+@hot_query('search.popular_books', lambda sample: {'query': sample.query, 'popular_only': True})
+@hot_query('search.all_books', lambda sample: {'query': sample.query})
+def books_matching(query, popular_only=False):
+    """Books whose title or author name contains `query`, with their authors."""
+    books = Book.objects.filter(Q(title__icontains=query) | Q(author__name__icontains=query))
+    if popular_only:
+        books = books.filter(is_popular=True)
+    return books.select_related('author')
+
+
 def search_database_books(query):
     """
     Search for books in the local database: popular books first, then any book
@@ -36,12 +54,8 @@ def search_database_books(query):
     if not query.strip():
         return []
     
-    match = Q(title__icontains=query) | Q(author__name__icontains=query)
-    
     # 1) Search popular books first (fast, prioritized)
-    popular_books = Book.objects.filter(
-        is_popular=True
-    ).filter(match).select_related('author')[:5]
+    popular_books = books_matching(query, popular_only=True)[:5]
     
     results = []
     for book in popular_books:
@@ -57,7 +71,7 @@ def search_database_books(query):
     # This ensures books in the database appear even if not marked popular
     if len(results) < 5:
         seen_titles_author = {(r['title'].lower(), r['author'].lower()) for r in results}
-        all_books = Book.objects.filter(match).select_related('author')
+        all_books = books_matching(query)
         
         for book in all_books:
             if len(results) >= 5:
@@ -140,9 +154,11 @@ def search_google_books(query):
     cached_results = cache.get(cache_key)
     if cached_results is not None:
         logger.debug(f"Google Books cache hit for query: {query}")
+        GOOGLE_BOOKS_CACHE.inc(endpoint='search', result='hit')
         return cached_results
+    GOOGLE_BOOKS_CACHE.inc(endpoint='search', result='miss')
     
-    url = "https://www.googleapis.com/books/v1/volumes"
+    url = google_books_api_url()
     # Increase maxResults to get more options, then we'll limit to 5 after filtering
     params = {'q': query, 'maxResults': 10}
     
@@ -155,7 +171,8 @@ def search_google_books(query):
     for attempt in range(max_retries + 1):
         # Add timeout to prevent hanging on slow API responses
         try:
-            response = _session.get(url, params=params, timeout=5)
+            with timed_stage('google'):
+                response = _session.get(url, params=params, timeout=5)
         except requests.exceptions.Timeout:
             logger.warning(f"Google Books API timeout for query: {query}")
             return []
@@ -165,6 +182,7 @@ def search_google_books(query):
         
         # Handle rate limiting (429) - retry with exponential backoff
         if response.status_code == 429:
+            GOOGLE_BOOKS_RATE_LIMITED.inc(endpoint='search')
             if attempt < max_retries:
                 wait_time = retry_delay * (2 ** attempt)
                 logger.warning(f"Google Books API rate limited (429) for query: {query}. Retrying in {wait_time} seconds... (attempt {attempt + 1}/{max_retries + 1})")
@@ -246,18 +264,23 @@ def get_book_details(title, author):
     # Check cache first
     cached_result = cache.get(cache_key)
     if cached_result is not None:
+        GOOGLE_BOOKS_CACHE.inc(endpoint='details', result='hit')
         return cached_result
+    GOOGLE_BOOKS_CACHE.inc(endpoint='details', result='miss')
     
-    url = "https://www.googleapis.com/books/v1/volumes"
+    url = google_books_api_url()
     params = {'q': f'intitle:"{title}"+inauthor:"{author}"', 'maxResults': 1}
     
     try:
-        response = _session.get(url, params=params, timeout=5)
+        with timed_stage('google'):
+            response = _session.get(url, params=params, timeout=5)
     except requests.exceptions.Timeout:
         return None
     except requests.exceptions.RequestException:
         return None
     
+    if response.status_code == 429:
+        GOOGLE_BOOKS_RATE_LIMITED.inc(endpoint='details')
     if response.status_code == 200:
         data = response.json()
         items = data.get('items', [])
@@ -0,0 +1,108 @@
+"""
+Precomputed statistics for the homepage and How It Works page.
+
+The public pages read a single SiteStats row instead of aggregating the favorites
+table on every request. The snapshot is rebuilt by the refresh_site_stats command
+(run it periodically) and by a debounced trigger whenever favorites change.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Book, SiteStats, UserFavoriteBook
+from .query_plans import hot_query
+
+SITE_STATS_PK = 1
+
+
+@hot_query('homepage.recent_favorites', lambda sample: {})
+def favorites_newest_first():
+    return (
+        UserFavoriteBook.objects.order_by('-created_at')
+        .values_list('book_id', 'book__title', 'book__author__name')
+    )
+
+
+@hot_query('homepage.top_favorites', lambda sample: {})
+def most_favorited_books():
+    return (
+        Book.objects.filter(favorite_count__gt=0)
+        .order_by('-favorite_count', 'title')
+        .values_list('title', 'author__name', 'favorite_count')
+    )
+
+
+def _recent_favorites(limit=10):
+    """The `limit` most recently favorited books, newest first, without a GROUP BY."""
+    recent = []
+    seen_book_ids = set()
+    for book_id, title, author in favorites_newest_first().iterator(chunk_size=100):
+        if book_id in seen_book_ids:
+            continue
+        seen_book_ids.add(book_id)
+        recent.append({'title': title, 'author': author})
+        if len(recent) >= limit:
+            break
+    return recent
+
+
+def compute_site_stats():
+    """Aggregate the statistics shown on the public pages."""
+    top_favorites = [
+        {'title': title, 'author': author, 'count': count}
+        for title, author, count in most_favorited_books()[:10]
+    ]
+    return {
+        'unique_readers': UserFavoriteBook.objects.values('user').distinct().count(),
+        'total_favorites': UserFavoriteBook.objects.count(),
+        'top_favorites': top_favorites,
+        'recent_favorites': _recent_favorites(),
+    }
+
+
+def refresh_site_stats():
+    """Recompute the snapshot now and return it."""
+    now = timezone.now()
+    # Clear the stale flag before computing so writes during the refresh flag it again
+    SiteStats.objects.filter(pk=SITE_STATS_PK).update(is_stale=False, refreshed_at=now)
+    stats, _ = SiteStats.objects.update_or_create(
+        pk=SITE_STATS_PK,
+        defaults={**compute_site_stats(), 'refreshed_at': now},
+    )
+    return stats
+
+
+def refresh_site_stats_if_stale():
+    """Recompute the snapshot only if favorites changed since the last refresh."""
+    claimed = SiteStats.objects.filter(pk=SITE_STATS_PK, is_stale=True).update(is_stale=False)
+    if claimed or not SiteStats.objects.filter(pk=SITE_STATS_PK).exists():
+        return refresh_site_stats()
+    return None
+
+
+def get_site_stats():
+    """Return the current snapshot (a single-row read), creating it on first use."""
+    stats = SiteStats.objects.filter(pk=SITE_STATS_PK).first()
+    if stats is None:
+        stats = refresh_site_stats()
+    return stats
+
+
+def site_stats_changed():
+    """
+    Debounced trigger for favorite writes.
+    Refreshes at most once per SITE_STATS_DEBOUNCE_SECONDS; writes inside that window
+    only flag the snapshot as stale for the next write or refresh_site_stats --if-stale.
+    """
+    debounce = getattr(settings, 'SITE_STATS_DEBOUNCE_SECONDS', 60)
+    now = timezone.now()
+    # Conditional UPDATE so only one concurrent writer wins the refresh
+    claimed = SiteStats.objects.filter(
+        pk=SITE_STATS_PK,
+        refreshed_at__lt=now - timedelta(seconds=debounce),
+    ).update(refreshed_at=now)
+    if claimed:
+        refresh_site_stats()
+    else:
+        SiteStats.objects.filter(pk=SITE_STATS_PK, is_stale=False).update(is_stale=True)
@@ -0,0 +1,81 @@
+"""Management commands and the helpers they share with the views."""
+import io
+import json
+from unittest import mock
+
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase
+
+from books.management.commands.reset_and_load_json import iter_json_array
+from books.models import GuestUsernamePool
+from books.utils import claim_guest_username
+
+
+class IterJsonArrayTests(SimpleTestCase):
+    def _items(self, text, read_size=3):
+        return list(iter_json_array(io.StringIO(text), read_size=read_size))
+
+    def test_objects_split_across_reads(self):
+        objects = [
+            {'model': 'books.author', 'pk': pk, 'fields': {'name': f'Author {pk}', 'tags': [pk, None, True]}}
+            for pk in range(20)
+        ]
+        text = json.dumps(objects, indent=2)
+        for read_size in (1, 2, 3, 7, 64):
+            with self.subTest(read_size=read_size):
+                self.assertEqual(self._items(text, read_size), objects)
+
+    def test_strings_with_brackets_braces_and_escaped_quotes(self):
+        objects = [
+            {'title': 'The ] and [ of it', 'note': '{not: "an object"}'},
+            {'title': 'Ends with a backslash \\', 'quote': '\\"]},{"'},
+            {'title': 'Unicode é 📚'},
+        ]
+        for text in (json.dumps(objects), json.dumps(objects, ensure_ascii=False)):
+            self.assertEqual(self._items(text), objects)
+
+    def test_numbers_split_across_reads(self):
+        self.assertEqual(self._items('[12345, 6.78e9, -1]'), [12345, 6.78e9, -1])
+
+    def test_empty_array(self):
+        for text in ('[]', '  [ \n ]  '):
+            with self.subTest(text=text):
+                self.assertEqual(self._items(text), [])
+
+    def test_malformed_input(self):
+        for text in ('', '{"model": "books.book"}', '\n[', '[{"pk": 1}, {"pk": }]', '[{"pk": 1', '[{"pk": 1}'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    self._items(text)
+
+
+class GuestUsernamePoolTests(TestCase):
+    def test_fill_stops_at_the_target(self):
+        call_command('fill_guest_username_pool', target=50, batch_size=20, stdout=io.StringIO())
+        self.assertEqual(GuestUsernamePool.objects.count(), 50)
+        out = io.StringIO()
+        call_command('fill_guest_username_pool', target=50, stdout=out)
+        self.assertIn('already has 50', out.getvalue())
+
+    def test_claims_keep_trying_the_pool_after_losing_races(self):
+        call_command('fill_guest_username_pool', target=6, stdout=io.StringIO())
+        pooled = set(GuestUsernamePool.objects.values_list('username', flat=True))
+        real_delete = QuerySet.delete
+        races = []
+
+        def delete_claimed_by_another_worker(queryset):
+            # The first four claims find their row already taken
+            if queryset.model is GuestUsernamePool and len(races) < 4:
+                races.append(real_delete(queryset))
+                return 0, {}
+            return real_delete(queryset)
+
+        with mock.patch.object(QuerySet, 'delete', delete_claimed_by_another_worker), \
+                mock.patch('books.utils.generate_guest_username', return_value='fallback_') as fallback:
+            self.assertIn(claim_guest_username(), pooled)
+            self.assertEqual(len(races), 4)
+            fallback.assert_not_called()
+
+            claim_guest_username()
+            self.assertEqual(claim_guest_username(), 'fallback_')
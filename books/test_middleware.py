@@ -0,0 +1,33 @@
+"""Who gets the Server-Timing header, and that slow requests are logged for everyone."""
+from django.contrib.auth.models import User
+from django.test import Client, TestCase, override_settings
+
+
+@override_settings(SERVER_TIMING_ENABLED=True, SERVER_TIMING_PUBLIC=False)
+class ServerTimingTests(TestCase):
+    def _get(self, user=None):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        return client.get('/robots.txt')
+
+    def test_anonymous_responses_have_no_header(self):
+        self.assertNotIn('Server-Timing', self._get())
+
+    def test_non_staff_responses_have_no_header(self):
+        self.assertNotIn('Server-Timing', self._get(User.objects.create(username='reader')))
+
+    def test_staff_responses_have_the_header(self):
+        response = self._get(User.objects.create(username='staff', is_staff=True))
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(SERVER_TIMING_PUBLIC=True)
+    def test_public_setting_sends_it_to_everyone(self):
+        self.assertIn('total;dur=', self._get()['Server-Timing'])
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_without_the_header(self):
+        with self.assertLogs('books.slow_requests', 'WARNING') as logs:
+            response = self._get()
+        self.assertNotIn('Server-Timing', response)
+        self.assertIn('/robots.txt', logs.output[0])
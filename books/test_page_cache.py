@@ -0,0 +1,45 @@
+"""Anonymous public pages are shareable by a CDN, and their forms still pass the CSRF check."""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+
+from books.page_cache import CSRF_TOKEN_PLACEHOLDER
+
+
+# Pages render without collectstatic's manifest
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PublicPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_visitors_get_identical_pages_without_cookies(self):
+        for path in ('/', '/terms-of-use/'):
+            first = Client().get(path)
+            second = Client().get(path)
+            self.assertEqual(first.content, second.content)
+            self.assertIn(CSRF_TOKEN_PLACEHOLDER, first.content.decode())
+            for response in (first, second):
+                self.assertEqual(dict(response.cookies), {})
+                self.assertIn('public', response['Cache-Control'])
+                self.assertIn('s-maxage=', response['Cache-Control'])
+                self.assertIn('Cookie', response['Vary'])
+
+    def test_signed_in_pages_stay_private(self):
+        client = Client()
+        client.force_login(User.objects.create(username='reader'))
+        response = client.get('/terms-of-use/')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn(CSRF_TOKEN_PLACEHOLDER, response.content.decode())
+
+    def test_forms_on_cached_pages_post_with_the_fetched_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.get('/terms-of-use/')
+        feedback = {'rating': 5, 'message': 'Lovely site', 'page_url': '/terms-of-use/'}
+
+        feedback['csrfmiddlewaretoken'] = CSRF_TOKEN_PLACEHOLDER
+        self.assertEqual(client.post('/feedback/submit/', feedback).status_code, 403)
+
+        response = client.get('/api/csrf-token/')
+        self.assertIn('no-cache', response['Cache-Control'])
+        feedback['csrfmiddlewaretoken'] = response.json()['token']
+        self.assertEqual(client.post('/feedback/submit/', feedback).status_code, 200)
@@ -0,0 +1,246 @@
+"""
+Query budgets for every URL in books/urls.py and the admin changelists.
+
+Each case runs against a generated dataset at two sizes. It must stay within the
+view's declared budget (see books.query_budget), and its query count must not grow
+with the data, which is how N+1 regressions show up.
+"""
+from contextlib import nullcontext
+from io import StringIO
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from books import urls as books_urls
+from books.benchmarks.stubs import offline_google_books
+from books.favorites import favorites_added
+from books.models import Book, ToBeReadBook, UserFavoriteBook
+from books.query_budget import QueryBudgetExceeded, query_budget
+from books.utils import create_guest_user
+
+DATASET_SIZES = (
+    {'readers': 20, 'books': 60, 'favorites_per_reader': 8},
+    {'readers': 80, 'books': 240, 'favorites_per_reader': 8},
+)
+
+# Small enough that readers' neighbor lists are full at both sizes, so saves and removals
+# run the eviction paths a production-sized dataset (K=50) does
+NEIGHBORS_K = 5
+
+# Favorite upkeep runs some statements only when there is work for them (the saver
+# entering other readers' lists: list sizes, weakest entries, evictions, inserts), so
+# the same save can differ by those four; an N+1 grows far faster between the two sizes
+SCALING_TOLERANCE = 4
+
+# Changelists are Django's code; ours only decides what each row loads
+ADMIN_CHANGELIST_BUDGET = 12
+
+GUEST_FAVORITES = 5
+
+PASSWORD = 'Budget-Pass-123!'
+
+
+class Dataset:
+    """The objects the URL cases need, looked up in the current dataset."""
+
+    def __init__(self, staff):
+        readers = User.objects.filter(username__startswith='synth_reader_').annotate(
+            favorites=Count('favorite_books'),
+        ).order_by('-favorites', 'id')
+        self.reader = readers[0]
+        self.staff = staff
+        # A guest with a typical handful of favorites, the same at every size
+        self.guest = create_guest_user()
+        UserFavoriteBook.objects.bulk_create([
+            UserFavoriteBook(user=self.guest, book=book) for book in Book.objects.order_by('id')[:GUEST_FAVORITES]
+        ])
+        favorites_added((self.guest.id, book_id) for book_id in self.guest.favorite_books.values_list('book_id', flat=True))
+        self.favorite = self.reader.favorite_books.select_related('book__author').first().book
+        self.others = list(
+            Book.objects.exclude(favorited_by__user=self.reader).select_related('author').order_by('-favorite_count', 'id')[:3]
+        )
+        self.book = Book.objects.order_by('-favorite_count', 'id').first()
+        ToBeReadBook.objects.bulk_create([ToBeReadBook(user=self.reader, book=book) for book in self.others])
+        self.uid = urlsafe_base64_encode(force_bytes(self.reader.pk))
+        self.token = default_token_generator.make_token(self.reader)
+
+
+def _favorites_form(books):
+    return {
+        'title': [book.title for book in books],
+        'author': [book.author.name for book in books],
+        'isbn': [book.isbn or '' for book in books],
+        'explanation': ['' for _ in books],
+    }
+
+
+# route in books/urls.py -> [(label, who, method, path(d), data(d))]; who is
+# 'anonymous', 'guest' (session-backed guest reader), 'reader' or 'staff'
+URL_CASES = {
+    '': [('home', 'anonymous', 'get', lambda d: '/', None)],
+    'how-it-works/': [('how_it_works', 'anonymous', 'get', lambda d: '/how-it-works/', None)],
+    'register/': [('register_guest_merge', 'guest', 'post', lambda d: '/register/', lambda d: {
+        'username': 'budget_new_reader', 'email': 'budget_new_reader@example.com',
+        'password1': PASSWORD, 'password2': PASSWORD,
+    })],
+    'rate/': [('rate_redirect', 'anonymous', 'get', lambda d: '/rate/', None)],
+    'rate/save/': [('rate_save_redirect', 'anonymous', 'get', lambda d: '/rate/save/', None)],
+    'add-favorite/': [('add_favorite_search', 'reader', 'get', lambda d: '/add-favorite/', lambda d: {'q': 'offline budget search'})],
+    'add-favorite/save/': [
+        ('save_favorite', 'reader', 'post', lambda d: '/add-favorite/save/', lambda d: _favorites_form(d.others)),
+        ('save_favorite_guest', 'guest', 'post', lambda d: '/add-favorite/save/', lambda d: _favorites_form(d.others)),
+    ],
+    'remove-favorite/': [('remove_favorite', 'reader', 'post', lambda d: '/remove-favorite/', lambda d: {
+        'title': d.favorite.title, 'author': d.favorite.author.name,
+    })],
+    'my-books/': [
+        ('my_books', 'reader', 'get', lambda d: '/my-books/', None),
+        ('my_books_guest', 'guest', 'get', lambda d: '/my-books/', None),
+    ],
+    'tbr/': [('tbr_list', 'reader', 'get', lambda d: '/tbr/', None)],
+    'tbr/remove/': [('remove_tbr', 'reader', 'post', lambda d: '/tbr/remove/', lambda d: {
+        'title': d.others[0].title, 'author': d.others[0].author.name,
+    })],
+    'recommend/': [
+        ('recommendations', 'reader', 'get', lambda d: '/recommend/', None),
+        ('recommendations_guest', 'guest', 'get', lambda d: '/recommend/', None),
+    ],
+    'recommend/mark-read/': [('mark_read', 'reader', 'post', lambda d: '/recommend/mark-read/', lambda d: {'book_id': d.book.id})],
+    'terms-of-use/': [('terms_of_use', 'anonymous', 'get', lambda d: '/terms-of-use/', None)],
+    'privacy-policy/': [('privacy_policy', 'anonymous', 'get', lambda d: '/privacy-policy/', None)],
+    'api/search/': [('autocomplete', 'anonymous', 'get', lambda d: '/api/search/', lambda d: {'term': d.book.title[:6]})],
+    'api/book-info/': [('book_info', 'anonymous', 'get', lambda d: '/api/book-info/', lambda d: {
+        'title': d.book.title, 'author': d.book.author.name,
+    })],
+    'api/also-loved/<int:book_id>/': [('also_loved', 'anonymous', 'get', lambda d: f'/api/also-loved/{d.book.id}/', None)],
+    'api/csrf-token/': [('csrf_token', 'anonymous', 'get', lambda d: '/api/csrf-token/', None)],
+    'feedback/submit/': [('feedback', 'reader', 'post', lambda d: '/feedback/submit/', lambda d: {
+        'rating': 5, 'message': 'Budget test', 'page_url': '/recommend/',
+    })],
+    'password-reset/': [('password_reset', 'anonymous', 'post', lambda d: '/password-reset/', lambda d: {'email': d.reader.email})],
+    'password-reset/done/': [('password_reset_done', 'anonymous', 'get', lambda d: '/password-reset/done/', None)],
+    'password-reset-confirm/<str:uidb64>/<str:token>/set-password/': [(
+        'password_reset_set', 'anonymous', 'get',
+        lambda d: f'/password-reset-confirm/{d.uid}/{d.token}/set-password/', None,
+    )],
+    'password-reset-confirm/<str:uidb64>/<str:token>/': [(
+        'password_reset_confirm', 'anonymous', 'get', lambda d: f'/password-reset-confirm/{d.uid}/{d.token}/', None,
+    )],
+    'password-reset-complete/': [('password_reset_complete', 'anonymous', 'get', lambda d: '/password-reset-complete/', None)],
+    'forgot-username/': [('forgot_username', 'anonymous', 'post', lambda d: '/forgot-username/', lambda d: {'email': d.reader.email})],
+    'unsubscribe/<str:uidb64>/<str:token>/': [(
+        'unsubscribe', 'anonymous', 'get', lambda d: f'/unsubscribe/{d.uid}/{d.token}/', None,
+    )],
+    'sitemap.xml': [('sitemap', 'anonymous', 'get', lambda d: '/sitemap.xml', None)],
+    'robots.txt': [('robots', 'anonymous', 'get', lambda d: '/robots.txt', None)],
+    'export/top-favorited-books-100-200.csv': [(
+        'export_csv', 'staff', 'get', lambda d: '/export/top-favorited-books-100-200.csv', None,
+    )],
+    'metrics': [('metrics', 'staff', 'get', lambda d: '/metrics', None)],
+    'export/top-favorited-books.csv': [(
+        'export_csv_range', 'staff', 'get', lambda d: '/export/top-favorited-books.csv', lambda d: {'offset': 0, 'limit': 1000},
+    )],
+}
+
+
+class QueryBudgetTests(TestCase):
+    def test_under_budget_passes(self):
+        with override_settings(QUERY_BUDGETS_ENFORCED=True), query_budget(2) as budget:
+            list(User.objects.all())
+        self.assertEqual(len(budget.queries), 1)
+
+    def test_over_budget_reports_sql_and_origin(self):
+        with override_settings(QUERY_BUDGETS_ENFORCED=True):
+            with self.assertRaises(QueryBudgetExceeded) as raised:
+                with query_budget(1, 'two queries'):
+                    list(User.objects.all())
+                    list(Book.objects.all())
+        report = str(raised.exception)
+        self.assertIn('two queries ran 2 queries, budget 1', report)
+        self.assertIn('FROM "books_book"', report)
+        self.assertIn('books/test_query_budgets.py', report)
+
+    def test_over_budget_only_logs_when_not_enforced(self):
+        with override_settings(QUERY_BUDGETS_ENFORCED=False), self.assertLogs('books.query_budget', 'WARNING'):
+            with query_budget(0, 'logged'):
+                list(User.objects.all())
+
+    def test_decorator_exposes_budget(self):
+        view = resolve(reverse('recommendations')).func
+        self.assertIsInstance(view.query_budget, int)
+
+
+@override_settings(
+    QUERY_BUDGETS_ENFORCED=True,
+    RECOMMENDATION_ENGINE='exact',
+    USER_NEIGHBORS_K=NEIGHBORS_K,
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    # Pages render without collectstatic's manifest
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class URLQueryBudgetTests(TestCase):
+    def test_every_url_has_a_case(self):
+        routes = {str(pattern.pattern) for pattern in books_urls.urlpatterns}
+        self.assertEqual(routes - set(URL_CASES), set(), 'Add a case to URL_CASES for new URLs')
+        self.assertEqual(set(URL_CASES) - routes, set(), 'URL_CASES lists URLs that no longer exist')
+
+    def test_query_counts_stay_in_budget_and_flat(self):
+        staff = User.objects.create_user('budget_staff', 'staff@example.com', PASSWORD, is_staff=True, is_superuser=True)
+        counts = []
+        for size in DATASET_SIZES:
+            call_command('generate_synthetic_data', clear=True, stdout=StringIO(), **size)
+            with offline_google_books():
+                counts.append(self._measure(Dataset(staff)))
+
+        small, large = counts
+        grew = {case: (small[case], large[case]) for case in small if large[case] > small[case] + SCALING_TOLERANCE}
+        self.assertEqual(grew, {}, 'Query counts grow with data size (small, large)')
+
+    def _client(self, who, dataset):
+        client = Client(HTTP_HOST='localhost')
+        if who == 'reader':
+            client.force_login(dataset.reader)
+        elif who == 'staff':
+            client.force_login(dataset.staff)
+        elif who == 'guest':
+            session = client.session
+            session['guest_user_id'] = dataset.guest.id
+            session.save()
+        return client
+
+    def _cases(self):
+        for cases in URL_CASES.values():
+            yield from cases
+        for model in admin.site._registry:
+            name = f'admin_{model._meta.app_label}_{model._meta.model_name}_changelist'
+            url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+            yield name, 'staff', 'get', lambda d, url=url: url, None
+
+    def _measure(self, dataset):
+        counts = {}
+        for label, who, method, path, data in self._cases():
+            cache.clear()
+            with transaction.atomic():
+                client = self._client(who, dataset)
+                url = path(dataset)
+                # Views enforce their own declared budgets; admin pages get a shared one here
+                budget = query_budget(ADMIN_CHANGELIST_BUDGET, label) if url.startswith('/admin/') else nullcontext()
+                with CaptureQueriesContext(connection) as queries:
+                    with budget:
+                        response = getattr(client, method)(url, data(dataset) if data else None)
+                        if getattr(response, 'streaming', False):
+                            b''.join(response.streaming_content)
+                self.assertLess(response.status_code, 400, f'{label}: {response.status_code}')
+                counts[label] = len(queries)
+                transaction.set_rollback(True)
+        return counts
@@ -1,3 +1,396 @@
-from django.test import TestCase
+"""
+Behaviour of the favorites bookkeeping in books.favorites and the derived data it
+maintains. Query counts per URL are covered by books.test_query_budgets.
+"""
+import os
+import random
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.db.models import Count, Min
+from django.test import Client, TestCase, override_settings
+
+from books.cooccurrence import rebuild_book_cooccurrence
+from books.favorites import favorites_added, favorites_removed
+from books.graph import HEADER, GraphFormatError, dump_favorites_graph, load_favorites_graph
+from books.minhash import rebuild_signatures
+from books.models import (
+    Author, Book, BookCooccurrence, LSHBucket, PrecomputedRecommendations, QueuedRecommendationEmails,
+    ReaderSignature, UserFavoriteBook, UserNeighbor, UserNeighborList,
+)
+from books.neighbors import rebuild_user_neighbors
+from books.recommendations import precompute_recommendations
+from books.stats import refresh_site_stats
+
+
+def _reader(username):
+    # No password: hashing one per reader would dominate the run time, and tests log in with force_login
+    return User.objects.create(username=username, email=f'{username}@example.com')
+
+
+def _books(count, prefix='Book'):
+    author = Author.objects.create(name=f'{prefix} Author')
+    return [Book.objects.create(title=f'{prefix} {i}', author=author) for i in range(count)]
+
+
+class FavoriteCountTests(TestCase):
+    def test_removing_a_favorite_with_a_drifted_count_stops_at_zero(self):
+        reader = _reader('reader')
+        book = _books(1)[0]
+        # Created behind books.favorites' back, so favorite_count is still 0
+        UserFavoriteBook.objects.create(user=reader, book=book)
+
+        client = Client()
+        client.force_login(reader)
+        response = client.post('/remove-favorite/', {'title': book.title, 'author': book.author.name})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(UserFavoriteBook.objects.filter(user=reader, book=book).exists())
+        book.refresh_from_db()
+        self.assertEqual(book.favorite_count, 0)
+
+
+class FavoriteSequenceTestCase(TestCase):
+    """
+    A few readers and books, changed through books.favorites the way the views do,
+    so incrementally maintained tables can be compared with a full rebuild.
+    """
+    readers_count = 8
+    books_count = 12
+
+    def setUp(self):
+        self.readers = [_reader(f'reader{i}') for i in range(self.readers_count)]
+        self.books = _books(self.books_count)
+
+    def add(self, reader, books):
+        UserFavoriteBook.objects.bulk_create([UserFavoriteBook(user=reader, book=book) for book in books])
+        favorites_added((reader.id, book.id) for book in books)
+
+    def remove(self, reader, books):
+        UserFavoriteBook.objects.filter(user=reader, book__in=books).delete()
+        favorites_removed((reader.id, book.id) for book in books)
+
+    def apply_random_changes(self, seed, steps, removals=True):
+        """Each step a random reader adds (or, with `removals`, toggles) one to three random books."""
+        rng = random.Random(seed)
+        for _ in range(steps):
+            reader = rng.choice(self.readers)
+            books = rng.sample(self.books, rng.randint(1, 3))
+            favorited = set(reader.favorite_books.filter(book__in=books).values_list('book_id', flat=True))
+            added = [book for book in books if book.id not in favorited]
+            removed = [book for book in books if book.id in favorited] if removals else []
+            if added:
+                self.add(reader, added)
+            if removed:
+                self.remove(reader, removed)
+
+
+class CooccurrenceMaintenanceTests(FavoriteSequenceTestCase):
+    def _table(self):
+        return {(a, b): count for a, b, count in BookCooccurrence.objects.values_list('book_a_id', 'book_b_id', 'count')}
+
+    def _assert_matches_rebuild(self):
+        incremental = self._table()
+        rebuild_book_cooccurrence()
+        self.assertEqual(incremental, self._table())
+
+    def test_additions_match_rebuild(self):
+        self.apply_random_changes(seed=1, steps=40, removals=False)
+        self._assert_matches_rebuild()
+
+    def test_additions_and_removals_match_rebuild(self):
+        self.apply_random_changes(seed=2, steps=80)
+        self._assert_matches_rebuild()
+
+    def test_removing_every_favorite_empties_the_table(self):
+        self.add(self.readers[0], self.books[:4])
+        self.add(self.readers[1], self.books[2:6])
+        self.remove(self.readers[0], self.books[:4])
+        self.remove(self.readers[1], self.books[2:6])
+        self.assertEqual(self._table(), {})
+
+
+@override_settings(USER_NEIGHBORS_K=3, RECOMMENDATION_ENGINE='exact')
+class NeighborMaintenanceTests(FavoriteSequenceTestCase):
+    def _lists(self):
+        lists = {}
+        for user_id, neighbor_id, count, book_ids in UserNeighbor.objects.values_list(
+            'user_id', 'neighbor_id', 'overlap_count', 'overlap_book_ids',
+        ):
+            lists.setdefault(user_id, []).append((neighbor_id, count, sorted(book_ids)))
+        return {user_id: sorted(rows, key=lambda row: (-row[1], row[0])) for user_id, rows in lists.items()}
+
+    def _favorites(self):
+        favorites = {reader.id: set() for reader in self.readers}
+        for user_id, book_id in UserFavoriteBook.objects.values_list('user_id', 'book_id'):
+            favorites[user_id].add(book_id)
+        return favorites
+
+    def test_additions_match_rebuild(self):
+        self.apply_random_changes(seed=3, steps=40, removals=False)
+        incremental = self._lists()
+        rebuild_user_neighbors()
+        self.assertEqual(incremental, self._lists())
+        # With 8 readers and K=3 most lists are full, so eviction was exercised
+        self.assertTrue(any(len(rows) == 3 for rows in incremental.values()))
+
+    def test_removals_keep_stored_overlaps_exact(self):
+        self.apply_random_changes(seed=4, steps=80)
+        favorites = self._favorites()
+        for user_id, rows in self._lists().items():
+            self.assertLessEqual(len(rows), 3)
+            for neighbor_id, count, book_ids in rows:
+                shared = sorted(favorites[user_id] & favorites[neighbor_id])
+                self.assertTrue(shared, f'{user_id} keeps {neighbor_id} without a shared favorite')
+                self.assertEqual((count, book_ids), (len(shared), shared))
+
+    def test_stored_list_sizes_are_exact_and_weakest_scores_a_lower_bound(self):
+        def actual():
+            return {
+                row['user_id']: (row['size'], row['weakest'])
+                for row in UserNeighbor.objects.values('user_id').annotate(size=Count('id'), weakest=Min('score'))
+            }
+
+        def stored():
+            return {
+                user_id: (size, weakest)
+                for user_id, size, weakest in UserNeighborList.objects.filter(size__gt=0).values_list(
+                    'user_id', 'size', 'weakest_score',
+                )
+            }
+
+        self.apply_random_changes(seed=9, steps=80)
+        lists = actual()
+        self.assertEqual(stored().keys(), lists.keys())
+        for user_id, (size, weakest) in stored().items():
+            self.assertEqual(size, lists[user_id][0])
+            self.assertLessEqual(weakest, lists[user_id][1])
+
+        rebuild_user_neighbors()
+        self.assertEqual(stored(), actual())
+
+    def test_changed_readers_own_list_is_exact(self):
+        self.apply_random_changes(seed=5, steps=60)
+        reader = self.readers[0]
+        self.add(reader, [book for book in self.books[:3] if not reader.favorite_books.filter(book=book).exists()])
+        self.remove(reader, [self.books[0]])
+        incremental = self._lists().get(reader.id)
+        rebuild_user_neighbors()
+        self.assertEqual(incremental, self._lists().get(reader.id))
+
+    @override_settings(USER_NEIGHBORS_K=2)
+    def test_removal_shrinks_other_lists_until_rebuild(self):
+        reader_c, reader_b, reader_x, reader_y = self.readers[:4]
+        b0, b1, b2 = self.books[:3]
+        self.add(reader_c, [b0, b1, b2])
+        self.add(reader_b, [b0, b1])
+        self.add(reader_x, [b2])
+        self.add(reader_y, [b2])
+        # Y ties with X on one shared book and loses on id, so C's list is full without Y
+        self.assertEqual(self._lists()[reader_c.id], [(reader_b.id, 2, [b0.id, b1.id]), (reader_x.id, 1, [b2.id])])
+
+        self.remove(reader_b, [b0, b1])
+        # B is dropped but Y, pushed out earlier, is not brought back (documented in books.neighbors)
+        self.assertEqual(self._lists()[reader_c.id], [(reader_x.id, 1, [b2.id])])
+        self.assertEqual(UserNeighborList.objects.get(user=reader_c).size, 1)
+
+        rebuild_user_neighbors()
+        self.assertEqual(self._lists()[reader_c.id], [(reader_x.id, 1, [b2.id]), (reader_y.id, 1, [b2.id])])
+
+    def test_changed_readers_own_list_matches_rebuild_for_each_scoring(self):
+        reader = self.readers[0]
+        for scoring in ('jaccard', 'cosine', 'idf'):
+            with self.subTest(scoring=scoring), self.settings(RECOMMENDATION_SCORING=scoring):
+                self.apply_random_changes(seed=8, steps=40)
+                refresh_site_stats()
+                self.add(reader, [book for book in self.books[:4] if not reader.favorite_books.filter(book=book).exists()])
+                self.remove(reader, [self.books[0]])
+                incremental = list(reader.neighbors.values_list('neighbor_id', 'score').order_by('-score', 'neighbor_id'))
+                rebuild_user_neighbors()
+                self.assertEqual(
+                    incremental, list(reader.neighbors.values_list('neighbor_id', 'score').order_by('-score', 'neighbor_id')),
+                )
+
+    @override_settings(USER_NEIGHBORS_K=1)
+    def test_idf_fills_slots_with_rare_shared_books_over_bestsellers(self):
+        reader, rare_fan, *crowd = self.readers
+        bestseller_a, bestseller_b, rare = self.books[:3]
+        for other in crowd:
+            self.add(other, [bestseller_a, bestseller_b])
+        self.add(rare_fan, [rare])
+        self.add(reader, [bestseller_a, bestseller_b, rare])
+        # By overlap the crowd, sharing both bestsellers, takes the only slot
+        self.assertEqual(list(reader.neighbors.values_list('neighbor_id', flat=True)), [crowd[0].id])
+
+        with self.settings(RECOMMENDATION_SCORING='idf'):
+            # log(1 + 8/2) for the rare book beats 2 * log(1 + 8/7) for the bestsellers
+            refresh_site_stats()
+            self.remove(reader, [rare])
+            self.add(reader, [rare])
+            self.assertEqual(list(reader.neighbors.values_list('neighbor_id', flat=True)), [rare_fan.id])
+            rebuild_user_neighbors()
+            self.assertEqual(list(reader.neighbors.values_list('neighbor_id', flat=True)), [rare_fan.id])
+
+
+@override_settings(RECOMMENDATION_ENGINE='minhash', MINHASH_PERMUTATIONS=16, MINHASH_BANDS=8)
+class MinHashMaintenanceTests(FavoriteSequenceTestCase):
+    def _state(self):
+        signatures = dict(ReaderSignature.objects.values_list('user_id', 'signature'))
+        buckets = sorted(LSHBucket.objects.values_list('user_id', 'bucket'))
+        return signatures, buckets
+
+    def _assert_matches_rebuild(self):
+        incremental = self._state()
+        rebuild_signatures()
+        self.assertEqual(incremental, self._state())
+
+    def test_additions_match_rebuild(self):
+        # Additions fold new books into the stored signature instead of recomputing it
+        self.apply_random_changes(seed=6, steps=40, removals=False)
+        self._assert_matches_rebuild()
+
+    def test_additions_and_removals_match_rebuild(self):
+        self.apply_random_changes(seed=7, steps=80)
+        self._assert_matches_rebuild()
+
+    def test_reader_without_favorites_has_no_signature_or_buckets(self):
+        reader = self.readers[0]
+        self.add(reader, self.books[:3])
+        self.remove(reader, self.books[:3])
+        self.assertFalse(ReaderSignature.objects.filter(user=reader).exists())
+        self.assertFalse(LSHBucket.objects.filter(user=reader).exists())
+
+
+@override_settings(
+    RECOMMENDATION_ENGINE='exact',
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class PrecomputedRecommendationsTests(FavoriteSequenceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.reader_a, self.reader_b, self.reader_c = self.readers[:3]
+        self.add(self.reader_a, self.books[:2])
+        self.add(self.reader_b, self.books[:3])
+        precompute_recommendations([self.reader_a.id])
+        self.client.force_login(self.reader_a)
+
+    def test_stored_recommendations_are_used(self):
+        response = self.client.get('/recommend/')
+        self.assertContains(response, self.books[2].title)
+        self.assertTrue(PrecomputedRecommendations.objects.filter(user=self.reader_a).exists())
+
+    def test_neighbor_adding_a_book_shows_on_the_readers_page(self):
+        self.add(self.reader_b, [self.books[3]])
+        self.assertFalse(PrecomputedRecommendations.objects.filter(user=self.reader_a).exists())
+        self.assertContains(self.client.get('/recommend/'), self.books[3].title)
+
+    def test_neighbor_removing_a_book_drops_it_from_the_readers_page(self):
+        self.remove(self.reader_b, [self.books[2]])
+        self.assertNotContains(self.client.get('/recommend/'), self.books[2].title)
+
+    def test_reader_leaving_a_neighbor_list_invalidates_it(self):
+        # B no longer shares anything with A, so A's list drops B and A's stored page must go too
+        self.remove(self.reader_b, self.books[:2])
+        self.assertFalse(PrecomputedRecommendations.objects.filter(user=self.reader_a).exists())
+        self.assertNotContains(self.client.get('/recommend/'), self.books[2].title)
+
+    def test_unrelated_readers_keep_their_stored_recommendations(self):
+        self.add(self.reader_c, self.books[5:7])
+        self.assertTrue(PrecomputedRecommendations.objects.filter(user=self.reader_a).exists())
+
+
+@override_settings(RECOMMENDATION_ENGINE='exact', RECOMMENDATION_EMAILS_DEFERRED=True)
+class RecommendationEmailTests(FavoriteSequenceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.reader_a, self.reader_b = self.readers[:2]
+        self.add(self.reader_a, self.books[:2])
+        self.client.force_login(self.reader_b)
+
+    def save(self, books):
+        return self.client.post('/add-favorite/save/', {
+            'title': [book.title for book in books],
+            'author': [book.author.name for book in books],
+            'isbn': ['' for _ in books],
+            'explanation': ['' for _ in books],
+        })
+
+    def test_saving_queues_the_emails_instead_of_sending_them(self):
+        self.assertEqual(self.save(self.books[:3]).status_code, 302)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(list(QueuedRecommendationEmails.objects.values_list('user_id', flat=True)), [self.reader_b.id])
+
+    def test_command_emails_readers_following_the_queued_reader(self):
+        self.save(self.books[:3])
+        call_command('send_recommendation_emails', stdout=StringIO())
+        self.assertEqual([message.to for message in mail.outbox], [[self.reader_a.email]])
+        self.assertIn(self.books[2].title, mail.outbox[0].body)
+        self.assertFalse(QueuedRecommendationEmails.objects.exists())
+
+        # Emailed less than a week ago, so the next save doesn't email reader A again
+        self.save(self.books[3:4])
+        call_command('send_recommendation_emails', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(RECOMMENDATION_EMAILS_DEFERRED=False)
+    def test_emails_are_sent_in_the_request_when_not_deferred(self):
+        self.save(self.books[:3])
+        self.assertEqual([message.to for message in mail.outbox], [[self.reader_a.email]])
+        self.assertFalse(QueuedRecommendationEmails.objects.exists())
+
+
+class GraphSnapshotTests(FavoriteSequenceTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'favorites.graph')
+        self.apply_random_changes(seed=10, steps=30)
+        # A non-ASCII title and out-of-order timestamps within a reader
+        Book.objects.filter(id=self.books[0].id).update(title='Cien años de soledad')
+        UserFavoriteBook.objects.filter(id=UserFavoriteBook.objects.order_by('id').first().id).update(
+            created_at=datetime(2001, 2, 3, tzinfo=dt_timezone.utc),
+        )
+
+    def test_dump_then_load_matches_the_favorites_table(self):
+        favorites, _size = dump_favorites_graph(self.path, chunk_size=7)
+        graph = load_favorites_graph(self.path)
+        try:
+            self.assertEqual(len(graph), favorites)
+            self.assertEqual(
+                list(zip(graph.user_ids, graph.book_ids, graph.created_at)),
+                [
+                    (user_id, book_id, int(created.timestamp()))
+                    for user_id, book_id, created in UserFavoriteBook.objects.order_by('user_id', 'book_id')
+                    .values_list('user_id', 'book_id', 'created_at')
+                ],
+            )
+            self.assertEqual(
+                graph.book_info(),
+                {book.id: (book.title, book.author.name) for book in Book.objects.select_related('author')},
+            )
+        finally:
+            graph.close()
+
+    def test_corrupted_payload_fails_the_checksum(self):
+        dump_favorites_graph(self.path)
+        with open(self.path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xFF]))
+        with self.assertRaisesMessage(GraphFormatError, 'checksum'):
+            load_favorites_graph(self.path)
+
+    def test_other_format_versions_are_rejected(self):
+        dump_favorites_graph(self.path)
+        with open(self.path, 'r+b') as f:
+            magic, version, section_count, crc, payload_length = HEADER.unpack(f.read(HEADER.size))
+            f.seek(0)
+            f.write(HEADER.pack(magic, version + 1, section_count, crc, payload_length))
+        with self.assertRaisesMessage(GraphFormatError, 'format version'):
+            load_favorites_graph(self.path)
@@ -0,0 +1,85 @@
+"""
+Per-request timing by stage (database, Google Books, template rendering, email),
+collected by books.middleware.ServerTimingMiddleware.
+
+Code marks a stage with `with timed_stage('google'):`; outside a request, or with
+the middleware off, that costs one context-variable lookup. Stages may overlap:
+rendering includes the queries that lazy querysets run from the template.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.stages = {}
+        self.queries = []
+
+    def add(self, stage, seconds):
+        total, count = self.stages.get(stage, (0.0, 0))
+        self.stages[stage] = (total + seconds, count + 1)
+
+    def record_query(self, execute, sql, params, many, context):
+        """django.db execute wrapper: times every query run during the request."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries.append((elapsed, sql))
+            self.add('db', elapsed)
+
+    def top_queries(self, limit):
+        return sorted(self.queries, key=lambda query: query[0], reverse=True)[:limit]
+
+
+def current_timings():
+    return _current.get()
+
+
+def start_timings():
+    """Begin collecting for the current request; pass the token to stop_timings."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def stop_timings(token):
+    _current.reset(token)
+
+
+@contextmanager
+def timed_stage(stage):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(stage, time.perf_counter() - started)
+
+
+class _TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed_stage('render'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with each top-level render timed as the 'render' stage."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return _TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -22,7 +22,9 @@ path('terms-of-use/', views.terms_of_use_view, name='terms_of_use'),
 path('privacy-policy/', views.privacy_policy_view, name='privacy_policy'),
 path('api/search/', views.book_autocomplete, name='book_autocomplete'),
 path('api/book-info/', views.book_info_view, name='book_info'),
+path('api/also-loved/<int:book_id>/', views.also_loved_view, name='also_loved'),
 path('feedback/submit/', views.feedback_submit, name='feedback_submit'),
+path('api/csrf-token/', views.csrf_token_view, name='csrf_token'),
     # Password reset URLs
     path('password-reset/', views.password_reset_view, name='password_reset'),
     path('password-reset/done/', auth_views.PasswordResetDoneView.as_view(template_name='registration/password_reset_done.html'), name='password_reset_done'),
@@ -38,4 +40,8 @@ path('unsubscribe/<str:uidb64>/<str:token>/', views.unsubscribe_recommendations_
 path('sitemap.xml', views.sitemap_view, name='sitemap'),
 path('robots.txt', views.robots_txt, name='robots_txt'),
 path('export/top-favorited-books-100-200.csv', views.export_top_favorited_csv_view, name='export_top_favorited_csv'),
+# Any rank range: ?offset=0&limit=1000
+path('export/top-favorited-books.csv', views.export_top_favorited_csv_view, name='export_top_favorited_range_csv'),
+# Prometheus scrape target (staff only)
+path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
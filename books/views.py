@@ -5,7 +5,7 @@ from django.contrib.auth.forms import AuthenticationForm, UserCreationForm, Pass
 from .forms import UserRegistrationForm, FeedbackForm
 from django.contrib.auth import login
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.core.mail import send_mail
 from django.conf import settings
 from django.template.loader import render_to_string
@@ -16,230 +16,30 @@ from django.utils.encoding import force_bytes, force_str
 from django.utils import timezone
 from django.urls import reverse, reverse_lazy
 from django.contrib.auth.forms import SetPasswordForm
-from .models import Book, Author, UserFavoriteBook, Feedback, ToBeReadBook, UserReadBook, UserEmailPreferences
-from django.http import JsonResponse, HttpResponse
-from .utils import get_book_recommendations, smart_title_case, generate_guest_username
+from .models import Book, Author, UserFavoriteBook, Feedback, ToBeReadBook, UserReadBook, UserEmailPreferences, GuestAccount, UserNeighbor
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from .utils import smart_title_case, create_guest_user
+from .recommendations import get_recommendation_groups
+from .recommendation_emails import queue_recommendation_emails, site_base_url
+from .cooccurrence import also_loved
+from .favorites import favorites_added, favorites_removed
+from .stats import get_site_stats
+from .page_cache import cache_public_page
+from .metrics import EMAILS_SENT, collect as collect_metrics, render_prometheus
+from .query_budget import query_budget
+from .query_plans import hot_query
+from .timing import timed_stage
 from .services import search_books, get_book_details
 from datetime import date, timedelta
-from django.views.decorators.http import require_POST
-from django.db.models import Count, Max
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET, require_POST
+from django.middleware.csrf import get_token
 from django.contrib.admin.views.decorators import staff_member_required
 import csv
-import io
 import hashlib
 import logging
 
 
-def _send_new_recommendation_emails(request):
-    """
-    Send email notifications to users when another user (authenticated or guest) 
-    adds favorites that overlap with their favorites and includes new books they don't have.
-    """
-    # Get the user who just added favorites (User B)
-    if request.user.is_authenticated:
-        user_b = request.user
-    else:
-        # Get guest user from session
-        guest_user_id = request.session.get('guest_user_id')
-        if not guest_user_id:
-            return  # No user to check
-        try:
-            user_b = User.objects.get(id=guest_user_id)
-        except User.DoesNotExist:
-            return  # Guest user doesn't exist
-    
-    # Get all of User B's favorite book IDs
-    user_b_favorite_book_ids = set(
-        UserFavoriteBook.objects.filter(user=user_b).values_list("book_id", flat=True)
-    )
-    
-    if not user_b_favorite_book_ids:
-        return  # User B has no favorites
-    
-    # Find all other users (User A) who share at least one favorite with User B
-    # and have an email address (authenticated users only)
-    similar_users = (
-        User.objects.filter(
-            favorite_books__book_id__in=user_b_favorite_book_ids,
-            email__isnull=False,
-            email__gt='',  # Email is not empty
-            is_active=True
-        )
-        .exclude(id=user_b.id)  # Exclude User B
-        .distinct()
-    )
-    
-    # Get site URL for email links
-    site_url = getattr(settings, 'SITE_BASE_URL', '')
-    if not site_url:
-        # Try to build from request, otherwise use default Heroku domain
-        try:
-            site_url = request.build_absolute_uri('/').rstrip('/')
-            # If site_url is malformed (e.g., just '/'), use default
-            if not site_url or site_url.startswith('http:///') or site_url.startswith('https:///'):
-                site_url = 'https://www.greatmindsreadalike.org'
-        except:
-            site_url = 'https://www.greatmindsreadalike.org'
-    
-    # Ensure site_url includes "www." if it's greatmindsreadalike.org
-    if site_url and 'greatmindsreadalike.org' in site_url and 'www.' not in site_url:
-        site_url = site_url.replace('https://greatmindsreadalike.org', 'https://www.greatmindsreadalike.org')
-        site_url = site_url.replace('http://greatmindsreadalike.org', 'https://www.greatmindsreadalike.org')
-    
-    # Ensure site_url doesn't end with a slash (except for root)
-    if site_url and site_url != '/' and site_url.endswith('/'):
-        site_url = site_url.rstrip('/')
-    
-    # For each similar user (User A), check if they should receive a weekly email
-    emails_sent = 0
-    for user_a in similar_users:
-        # Check if user has unsubscribed from recommendation emails
-        email_prefs, _ = UserEmailPreferences.objects.get_or_create(user=user_a)
-        if not email_prefs.receive_recommendation_emails:
-            continue  # Skip this user, they've unsubscribed
-        
-        # Check if it's been at least 7 days since the last recommendation email
-        now = timezone.now()
-        if email_prefs.last_recommendation_email_sent:
-            time_since_last_email = now - email_prefs.last_recommendation_email_sent
-            if time_since_last_email < timedelta(days=7):
-                continue  # Skip this user, it hasn't been a week yet
-        
-        # Get User A's favorite book IDs
-        user_a_favorite_book_ids = set(
-            UserFavoriteBook.objects.filter(user=user_a).values_list("book_id", flat=True)
-        )
-        
-        # Calculate the date 7 days ago
-        seven_days_ago = now - timedelta(days=7)
-        
-        # Find ALL users who share favorites with User A AND added those favorites in the past 7 days
-        # This collects only recent recommendations
-        recent_similar_users = (
-            User.objects.filter(
-                favorite_books__book_id__in=user_a_favorite_book_ids,
-                favorite_books__created_at__gte=seven_days_ago
-            )
-            .exclude(id=user_a.id)
-            .distinct()
-        )
-        
-        # Collect all books from recent similar users that User A doesn't have
-        # Only include books that were added as favorites in the past 7 days
-        all_new_books = set()
-        for similar_user in recent_similar_users:
-            # Get books this user added as favorites in the past 7 days
-            recent_favorites = UserFavoriteBook.objects.filter(
-                user=similar_user,
-                created_at__gte=seven_days_ago
-            ).values_list("book_id", flat=True)
-            
-            similar_user_recent_favorite_book_ids = set(recent_favorites)
-            new_books_from_user = similar_user_recent_favorite_book_ids - user_a_favorite_book_ids
-            all_new_books.update(new_books_from_user)
-        
-        if all_new_books:
-            # Get the Book objects
-            new_books = Book.objects.filter(id__in=all_new_books).select_related('author')
-            
-            # Only send email if there are new books
-            if new_books.exists():
-                # Calculate total recommendations count (similar to recommendation_view logic)
-                # Find all users who share favorites with User A
-                all_similar_users = (
-                    User.objects.filter(
-                        favorite_books__book_id__in=user_a_favorite_book_ids,
-                    )
-                    .exclude(id=user_a.id)
-                    .distinct()
-                )
-                
-                # Count all unique recommended books (not just from past 7 days)
-                all_recommended_book_ids = set()
-                for similar_user in all_similar_users:
-                    their_favorite_book_ids = set(
-                        UserFavoriteBook.objects.filter(user=similar_user).values_list("book_id", flat=True)
-                    )
-                    # Books they love that User A doesn't have
-                    recommended_from_user = their_favorite_book_ids - user_a_favorite_book_ids
-                    all_recommended_book_ids.update(recommended_from_user)
-                
-                total_recommendations_count = len(all_recommended_book_ids)
-                
-                # Limit to 10 books for the email
-                books_for_email = new_books[:10]
-                additional_count = max(0, total_recommendations_count - 10)
-                
-                # New users (authenticated + guest) who joined in the last 7 days with mutual favorites
-                new_similar_users_this_week = (
-                    User.objects.filter(
-                        favorite_books__book_id__in=user_a_favorite_book_ids,
-                        date_joined__gte=seven_days_ago,
-                    )
-                    .exclude(id=user_a.id)
-                    .distinct()
-                    .count()
-                )
-                
-                try:
-                    subject = 'Your Weekly Book Recommendations!'
-                    
-                    # Generate unsubscribe token
-                    token = default_token_generator.make_token(user_a)
-                    uid = urlsafe_base64_encode(force_bytes(user_a.pk))
-                    unsubscribe_path = reverse('unsubscribe_recommendations', kwargs={'uidb64': uid, 'token': token})
-                    # Use site_url if available, otherwise build from request
-                    if site_url:
-                        unsubscribe_url = f"{site_url}{unsubscribe_path}"
-                    else:
-                        unsubscribe_url = request.build_absolute_uri(unsubscribe_path)
-                    
-                    # Create email content
-                    html_message = render_to_string('registration/email_new_recommendations.html', {
-                        'user': user_a,
-                        'new_books': books_for_email,
-                        'total_recommendations_count': total_recommendations_count,
-                        'additional_count': additional_count,
-                        'new_similar_users_this_week': new_similar_users_this_week,
-                        'site_url': site_url,
-                        'site_name': 'Great Minds Read Alike',
-                        'unsubscribe_url': unsubscribe_url,
-                    })
-                    plain_message = f"Hi {user_a.username},\n\n"
-                    plain_message += "Great news! Other readers who share some of your favorite books have added new favorites that you might love, too.\n\n"
-                    if new_similar_users_this_week > 0:
-                        plain_message += f"{new_similar_users_this_week} new reader(s) with similar taste joined this week.\n\n"
-                    plain_message += "Here are the books they added that you haven't listed as favorites yet:\n\n"
-                    for book in books_for_email:
-                        plain_message += f"- {book.title} by {book.author.name}\n"
-                    if additional_count > 0:
-                        plain_message += f"\nThere are {additional_count} more recommendations waiting for you on your recommendations page!\n"
-                    plain_message += f"\nVisit {site_url}{reverse('recommendations')} to see more recommendations!\n\n"
-                    plain_message += f"\nIf you no longer wish to receive these emails, you can unsubscribe here: {unsubscribe_url}\n\n"
-                    plain_message += "Happy reading!\n— Great Minds Read Alike"
-                    
-                    from_email = settings.DEFAULT_FROM_EMAIL
-                    send_mail(
-                        subject,
-                        plain_message,
-                        from_email,
-                        [user_a.email],
-                        html_message=html_message,
-                        fail_silently=True,  # Don't break the flow if email fails
-                    )
-                    
-                    # Update the timestamp for when the email was sent
-                    email_prefs.last_recommendation_email_sent = now
-                    email_prefs.save()
-                    
-                    emails_sent += 1
-                except Exception as e:
-                    # Log error but don't break the flow
-                    logger = logging.getLogger(__name__)
-                    logger.error(f"Error sending recommendation email to {user_a.email}: {str(e)}")
-    
-    return emails_sent
-
 def _merge_guest_favorites(request, user):
     """
     Move favorites from a session-backed guest user into the authenticated user,
@@ -254,16 +54,42 @@ def _merge_guest_favorites(request, user):
     except User.DoesNotExist:
         return
 
-    for fav in UserFavoriteBook.objects.filter(user=guest_user):
-        UserFavoriteBook.objects.get_or_create(
-            user=user,
-            book=fav.book,
-            defaults={'explanation': fav.explanation},
-        )
+    guest_favorites = list(UserFavoriteBook.objects.filter(user=guest_user))
+    already_favorited = set(
+        UserFavoriteBook.objects.filter(user=user, book_id__in=[fav.book_id for fav in guest_favorites])
+        .values_list('book_id', flat=True)
+    )
+    new_favorites = [
+        UserFavoriteBook(user=user, book_id=fav.book_id, explanation=fav.explanation)
+        for fav in guest_favorites if fav.book_id not in already_favorited
+    ]
+    # One INSERT instead of a get_or_create per book
+    try:
+        with transaction.atomic():
+            UserFavoriteBook.objects.bulk_create(new_favorites)
+        added_book_ids = [fav.book_id for fav in new_favorites]
+    except IntegrityError:
+        # A concurrent save added one of these books: insert row by row and only
+        # report the rows created here, so favorite counts aren't incremented twice
+        added_book_ids = []
+        for fav in new_favorites:
+            _, created = UserFavoriteBook.objects.get_or_create(
+                user=user, book_id=fav.book_id, defaults={'explanation': fav.explanation},
+            )
+            if created:
+                added_book_ids.append(fav.book_id)
+    added_pairs = [(user.id, book_id) for book_id in added_book_ids]
 
     UserFavoriteBook.objects.filter(user=guest_user).delete()
     guest_user.delete()
+    favorites_added(added_pairs)
+    favorites_removed((guest_id, fav.book_id) for fav in guest_favorites)
 
+def _site_stats_version(request):
+    return get_site_stats().version
+
+@query_budget(4)
+@cache_public_page(version=_site_stats_version)
 def homepage_view(request):
     """Homepage view - accessible to all users, shows login form if not authenticated"""
     form = AuthenticationForm()
@@ -279,42 +105,30 @@ def homepage_view(request):
             messages.success(request, f"Welcome back, {request.user.username}!")
             return redirect('my_books')
     
-    # Count unique users who have favorite books and total favorites
-    unique_users_count = UserFavoriteBook.objects.values('user').distinct().count()
-    favorites_count = UserFavoriteBook.objects.count()
-
-    # Top 10 most favorited books (title, author, count)
-    top_favorites = (
-        UserFavoriteBook.objects.values('book__title', 'book__author__name')
-        .annotate(count=Count('id'))
-        .order_by('-count', 'book__title')[:10]
-    )
-    
-    # 10 most recently favorited books (unique books, ordered by most recent favorite date)
-    recent_favorites = (
-        UserFavoriteBook.objects.values('book__title', 'book__author__name')
-        .annotate(most_recent=Max('created_at'))
-        .order_by('-most_recent')[:10]
-    )
+    # Unique readers, total favorites, top 10 and 10 most recent come from the precomputed snapshot
+    stats = get_site_stats()
     
     return render(request, 'homepage.html', {
         'form': form,
-        'unique_users_count': unique_users_count,
-        'favorites_count': favorites_count,
-        'top_favorites': top_favorites,
-        'recent_favorites': recent_favorites,
+        'unique_users_count': stats.unique_readers,
+        'favorites_count': stats.total_favorites,
+        'top_favorites': stats.top_favorites,
+        'recent_favorites': stats.recent_favorites,
+        'stats_version': stats.version,
     })
 
 
+@query_budget(4)
+@cache_public_page(version=_site_stats_version)
 def how_it_works_view(request):
     """How It Works page - explains the system to first-time visitors"""
-    # Count unique users who have favorite books and total favorites
-    unique_users_count = UserFavoriteBook.objects.values('user').distinct().count()
-    favorites_count = UserFavoriteBook.objects.count()
+    # Unique readers and total favorites come from the precomputed snapshot
+    stats = get_site_stats()
     
     return render(request, 'how_it_works.html', {
-        'unique_users_count': unique_users_count,
-        'favorites_count': favorites_count,
+        'unique_users_count': stats.unique_readers,
+        'favorites_count': stats.total_favorites,
+        'stats_version': stats.version,
     })
 
 
@@ -361,37 +175,69 @@ def robots_txt(request):
     return HttpResponse("\n".join(lines), content_type="text/plain")
 
 
+class _Echo:
+    """Pseudo-buffer for csv.writer: write() returns the row instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def _query_int(request, name, default, minimum):
+    """Parse a non-negative integer query parameter, or return None if it is invalid."""
+    try:
+        value = int(request.GET.get(name, default))
+    except (TypeError, ValueError):
+        return None
+    return value if value >= minimum else None
+
+
+@query_budget(5)
 @staff_member_required
 def export_top_favorited_csv_view(request):
-    """Download CSV of the 100-200 most favorited books (staff only)."""
-    offset = 99
-    limit = 101
+    """
+    Download CSV of the most favorited books (staff only).
+    ?offset=99&limit=101 (the default) exports ranks 100-200.
+    """
+    offset = _query_int(request, 'offset', 99, 0)
+    limit = _query_int(request, 'limit', 101, 1)
+    if offset is None or limit is None:
+        return HttpResponseBadRequest("offset must be >= 0 and limit must be >= 1")
+
     top_books = (
         Book.objects
-        .annotate(favorite_count=Count('favorited_by'))
         .filter(favorite_count__gt=0)
         .order_by('-favorite_count', 'title')
-        .select_related('author')[offset:offset + limit]
+        .values_list('favorite_count', 'title', 'author__name', 'isbn', 'genre', 'sub_genre')
+        [offset:offset + limit]
+    )
+
+    def rows():
+        # The header goes out before the query runs, so the download starts immediately
+        yield ['rank', 'favorite_count', 'title', 'author', 'isbn', 'genre', 'sub_genre']
+        for i, (favorite_count, title, author, isbn, genre, sub_genre) in enumerate(
+            top_books.iterator(chunk_size=2000), start=offset + 1
+        ):
+            yield [i, favorite_count, title, author, isbn or '', genre or '', sub_genre or '']
+
+    writer = csv.writer(_Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in rows()),
+        content_type='text/csv; charset=utf-8',
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="top_favorited_books_{offset + 1}-{offset + limit}.csv"'
     )
-    books_list = list(top_books)
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerow(['rank', 'favorite_count', 'title', 'author', 'isbn', 'genre', 'sub_genre'])
-    for i, book in enumerate(books_list, start=offset + 1):
-        writer.writerow([
-            i,
-            book.favorite_count,
-            book.title,
-            book.author.name,
-            book.isbn or '',
-            book.genre or '',
-            book.sub_genre or '',
-        ])
-    response = HttpResponse(buffer.getvalue(), content_type='text/csv; charset=utf-8')
-    response['Content-Disposition'] = 'attachment; filename="top_favorited_books_100-200.csv"'
     return response
 
 
+@staff_member_required
+def metrics_view(request):
+    """Metrics of every worker process in Prometheus text format (staff only)."""
+    return HttpResponse(render_prometheus(collect_metrics()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Guest merges cost a few statements per merged favorite; budgeted for a typical guest
+@query_budget(80)
 def register_view(request):
     """Registration view - allows new users to create accounts"""
     if request.user.is_authenticated:
@@ -419,6 +265,7 @@ def add_favorite_view(request):
         
     return render(request, 'add_favorite.html', {'results': results, 'query': query})
 
+@query_budget(4)
 def book_autocomplete(request):
     query = request.GET.get('term', '') # jQuery UI uses 'term' to send what the user types
     
@@ -453,6 +300,11 @@ def book_autocomplete(request):
         logger.error(f"Error in book_autocomplete for query '{query}': {e}", exc_info=True)
         return JsonResponse([], safe=False)
 
+# Each submitted book costs a handful of lookups; budgeted for a few books per save.
+# Favorite upkeep is a fixed number of statements, but SQLite splits bulk writes at 999
+# parameters (one more per ~200 neighbor rows or ~330 co-occurrence pairs touched), so a
+# popular reader's save on the 5,000-reader benchmark dataset runs ~62 queries there
+@query_budget(70)
 def save_favorite_view(request):
     if request.method == "POST":
         # Handle multiple books from add_favorite page
@@ -476,6 +328,7 @@ def save_favorite_view(request):
                 explanations = [explanation] if explanation else ['']
 
         saved_count = 0
+        added_pairs = []
 
         # Ensure explanations list matches the length of other lists
         while len(explanations) < len(titles):
@@ -536,6 +389,7 @@ def save_favorite_view(request):
                     favorite.save()
                 if created:
                     saved_count += 1
+                    added_pairs.append((request.user.id, book.id))
             else:
                 # Non-authenticated users: create or get guest user
                 guest_user_id = request.session.get('guest_user_id')
@@ -548,13 +402,8 @@ def save_favorite_view(request):
                     guest_user = None
                 
                 if not guest_user:
-                    # Create a new guest user with unique username
-                    username = generate_guest_username()
-                    guest_user = User.objects.create_user(
-                        username=username,
-                        password=User.objects.make_random_password(),
-                        is_active=True
-                    )
+                    # Create a new guest user with a username claimed from the pool
+                    guest_user = create_guest_user()
                     request.session['guest_user_id'] = guest_user.id
                 
                 # Save favorite to database using guest user
@@ -569,6 +418,13 @@ def save_favorite_view(request):
                     favorite.save()
                 if created:
                     saved_count += 1
+                    added_pairs.append((guest_user.id, book.id))
+
+        favorites_added(added_pairs)
+
+        if not request.user.is_authenticated and request.session.get('guest_user_id'):
+            # Keep the guest account out of purge_guest_users while it is in use
+            GuestAccount.objects.filter(user_id=request.session['guest_user_id']).update(last_active_at=timezone.now())
 
         if saved_count:
             if saved_count == 1:
@@ -576,8 +432,8 @@ def save_favorite_view(request):
             else:
                 messages.success(request, f"Added {saved_count} book(s) to your favorites!")
             
-            # Send email notifications to users who share favorites
-            _send_new_recommendation_emails(request)
+            # Tell readers who share favorites (queued for send_recommendation_emails)
+            queue_recommendation_emails(added_pairs[0][0], site_base_url(request))
         else:
             messages.warning(request, "No valid books were submitted.")
 
@@ -587,6 +443,7 @@ def save_favorite_view(request):
 
         return redirect('recommendations')
 
+@query_budget(25)
 def remove_favorite_view(request):
     """Remove a book from favorites"""
     if request.method == "POST":
@@ -602,7 +459,9 @@ def remove_favorite_view(request):
                 book = Book.objects.filter(title__iexact=clean_title, author=author).first()
                 if book:
                     if request.user.is_authenticated:
-                        UserFavoriteBook.objects.filter(user=request.user, book=book).delete()
+                        deleted, _ = UserFavoriteBook.objects.filter(user=request.user, book=book).delete()
+                        if deleted:
+                            favorites_removed([(request.user.id, book.id)])
                         messages.success(request, f"Removed {book.title} from your favorites.")
                     else:
                         # Get guest user from session
@@ -610,7 +469,10 @@ def remove_favorite_view(request):
                         if guest_user_id:
                             try:
                                 guest_user = User.objects.get(id=guest_user_id)
-                                UserFavoriteBook.objects.filter(user=guest_user, book=book).delete()
+                                deleted, _ = UserFavoriteBook.objects.filter(user=guest_user, book=book).delete()
+                                if deleted:
+                                    favorites_removed([(guest_user.id, book.id)])
+                                GuestAccount.objects.filter(user=guest_user).update(last_active_at=timezone.now())
                                 messages.success(request, f"Removed {book.title} from your favorites.")
                             except User.DoesNotExist:
                                 messages.warning(request, "Could not find your guest account.")
@@ -620,6 +482,43 @@ def remove_favorite_view(request):
     return redirect('my_books')
 
 
+# Guests with this many favorites or fewer also get item-to-item "also loved" suggestions
+GUEST_ALSO_LOVED_MAX_FAVORITES = 2
+ALSO_LOVED_LIMIT = 10
+ALSO_LOVED_MAX_LIMIT = 50
+
+
+@query_budget(3)
+def also_loved_view(request, book_id):
+    """Books most often favorited by readers who love book_id. ?limit=10 (max 50)."""
+    limit = _query_int(request, 'limit', ALSO_LOVED_LIMIT, 1)
+    if limit is None:
+        return JsonResponse({'error': 'limit must be a positive integer'}, status=400)
+    rows = also_loved(book_id, limit=min(limit, ALSO_LOVED_MAX_LIMIT))
+    return JsonResponse([
+        {
+            'book_id': row.book_b_id,
+            'title': row.book_b.title,
+            'author': row.book_b.author.name,
+            'isbn': row.book_b.isbn or '',
+            'count': row.count,
+        }
+        for row in rows
+    ], safe=False)
+
+
+@hot_query(
+    'recommendations.new_similar_readers',
+    lambda sample: {'user_id': sample.user_id, 'since': sample.since, 'exclude_user_ids': sample.exclude_user_ids},
+)
+def new_similar_readers(user_id, since, exclude_user_ids):
+    """The reader's stored neighbors who joined since `since`."""
+    return (
+        UserNeighbor.objects.filter(user_id=user_id, neighbor__date_joined__gte=since)
+        .exclude(neighbor_id__in=exclude_user_ids)
+    )
+
+
 def _book_matches_sub_genre_filter(book_sub_genre, filter_value):
     """Return True if the book's sub_genre matches the filter. Treats 'Literary Fiction' as 'General Fiction'."""
     if not book_sub_genre:
@@ -630,9 +529,12 @@ def _book_matches_sub_genre_filter(book_sub_genre, filter_value):
     return book_val == filter_value
 
 
+@query_budget(15)
 def recommendation_view(request):
     # Get favorite book IDs (from database or guest user)
+    my_user_id = None
     if request.user.is_authenticated:
+        my_user_id = request.user.id
         my_favorite_book_ids = set(
             UserFavoriteBook.objects.filter(user=request.user).values_list("book_id", flat=True)
         )
@@ -642,6 +544,7 @@ def recommendation_view(request):
         if guest_user_id:
             try:
                 guest_user = User.objects.get(id=guest_user_id)
+                my_user_id = guest_user.id
                 my_favorite_book_ids = set(
                     UserFavoriteBook.objects.filter(user=guest_user).values_list("book_id", flat=True)
                 )
@@ -671,87 +574,28 @@ def recommendation_view(request):
         }
         return render(request, 'recommendations.html', context)
     
-    # Find other users who also love at least one of those same books
-    similar_users = (
-        User.objects.filter(
-            favorite_books__book_id__in=my_favorite_book_ids,
-        )
-    )
+    current_user_ids = set()
     if request.user.is_authenticated:
-        similar_users = similar_users.exclude(id=request.user.id)
-    similar_users = similar_users.distinct()
-    
-    # For each recommended book, track which similar user(s) recommended it
-    # and count the overlap in favorite books
-    book_recommendations = {}  # book_id -> {book, similar_user, overlap_count}
-    
-    for user in similar_users:
-        # Get all books this user loves
-        their_favorite_book_ids = set(
-            UserFavoriteBook.objects.filter(user=user).values_list("book_id", flat=True)
-        )
-        
-        # Find overlapping books: books BOTH users love
-        overlapping_book_ids = my_favorite_book_ids & their_favorite_book_ids
-        overlap_count = len(overlapping_book_ids)
-        
-        # Get the actual Book objects for overlapping favorites
-        overlapping_books = Book.objects.filter(id__in=overlapping_book_ids)
-        overlapping_titles = [book.title for book in overlapping_books]
-        
-        # For each book they love that I haven't favorited, add it as a recommendation
-        for book_id in their_favorite_book_ids:
-            if book_id not in my_favorite_book_ids:
-                # If we haven't seen this book yet, or if this user has more overlap, use this user
-                if book_id not in book_recommendations or overlap_count > book_recommendations[book_id]['overlap_count']:
-                    book_recommendations[book_id] = {
-                        'book_id': book_id,
-                        'similar_user': user,
-                        'overlap_count': overlap_count,
-                        'overlapping_titles': overlapping_titles,
-                    }
-    
-    # Convert to list of dictionaries with book objects
-    recommended_data = []
-    for rec_data in book_recommendations.values():
-        book = Book.objects.get(id=rec_data['book_id'])
-        recommended_data.append({
-            'book': book,
-            'similar_user': rec_data['similar_user'],
-            'overlap_count': rec_data['overlap_count'],
-            'overlapping_titles': rec_data['overlapping_titles'],
-        })
-    
-    # Sort by overlap_count (descending) - users with more overlapping favorites first
-    recommended_data.sort(key=lambda x: x['overlap_count'], reverse=True)
-    
-    # Group recommendations by similar_user
-    grouped_recommendations = {}
-    for rec in recommended_data:
-        user_id = rec['similar_user'].id
-        if user_id not in grouped_recommendations:
-            grouped_recommendations[user_id] = {
-                'similar_user': rec['similar_user'],
-                'overlap_count': rec['overlap_count'],
-                'overlapping_titles': rec['overlapping_titles'],
-                'recommended_books': []
-            }
-        # Get the explanation from the similar user's favorite record
-        favorite = UserFavoriteBook.objects.filter(
-            user=rec['similar_user'],
-            book=rec['book']
-        ).first()
-        explanation = favorite.explanation if favorite else ''
-        
-        grouped_recommendations[user_id]['recommended_books'].append({
-            'book': rec['book'],
-            'explanation': explanation
-        })
-    
-    # Convert to list and sort by overlap_count (descending)
-    grouped_list = list(grouped_recommendations.values())
-    grouped_list.sort(key=lambda x: x['overlap_count'], reverse=True)
+        current_user_ids.add(request.user.id)
+    guest_user_id = request.session.get('guest_user_id')
+    if guest_user_id:
+        current_user_ids.add(int(guest_user_id))
+
+    # The reader's most similar readers (precomputed in UserNeighbor), grouped with the
+    # other books they love (most overlapping favorites first)
+    grouped_list, similar_users_count, recommendations_count = get_recommendation_groups(
+        my_favorite_book_ids, exclude_user_ids=current_user_ids, user_id=my_user_id
+    )
     
+    # Guests who have only just started get "readers who loved X also loved" lists,
+    # answered straight from the co-occurrence index
+    also_loved_lists = []
+    if not request.user.is_authenticated and len(my_favorite_book_ids) <= GUEST_ALSO_LOVED_MAX_FAVORITES:
+        for book in Book.objects.select_related('author').filter(id__in=my_favorite_book_ids).order_by('title'):
+            loved = also_loved(book.id, limit=ALSO_LOVED_LIMIT, exclude_book_ids=my_favorite_book_ids)
+            if loved:
+                also_loved_lists.append({'book': book, 'also_loved': loved})
+
     # New users (authenticated + guest) who joined in the last 7 days and have mutual favorites
     seven_days_ago = timezone.now() - timedelta(days=7)
     
@@ -772,26 +616,14 @@ def recommendation_view(request):
             g for g in grouped_list
             if g['similar_user'].date_joined >= seven_days_ago
         ]
-    current_user_ids = set()
-    if request.user.is_authenticated:
-        current_user_ids.add(request.user.id)
-    guest_user_id = request.session.get('guest_user_id')
-    if guest_user_id:
-        current_user_ids.add(int(guest_user_id))
-    new_similar_users_qs = User.objects.filter(
-        favorite_books__book_id__in=my_favorite_book_ids,
-        date_joined__gte=seven_days_ago,
-    ).distinct()
-    if current_user_ids:
-        new_similar_users_qs = new_similar_users_qs.exclude(id__in=current_user_ids)
-    new_similar_users_this_week = new_similar_users_qs.count()
+    new_similar_users_this_week = new_similar_readers(my_user_id, seven_days_ago, current_user_ids).count()
 
     # Diagnostic info
     total_favorites = len(my_favorite_book_ids)
     diagnostic_info = {
         'total_favorites': total_favorites,
-        'similar_users_count': similar_users.count(),
-        'recommendations_count': len(recommended_data),
+        'similar_users_count': similar_users_count,
+        'recommendations_count': recommendations_count,
         'new_similar_users_this_week': new_similar_users_this_week,
     }
     
@@ -799,7 +631,7 @@ def recommendation_view(request):
     show_account_prompt = not request.user.is_authenticated and total_favorites > 0
     
     # Check if there are similar users but no recommendations
-    show_no_new_books_message = diagnostic_info['similar_users_count'] > 0 and len(recommended_data) == 0
+    show_no_new_books_message = diagnostic_info['similar_users_count'] > 0 and recommendations_count == 0
     
     # Books the current user has marked as read (for strikethrough and "Mark as read" link)
     if request.user.is_authenticated:
@@ -818,6 +650,7 @@ def recommendation_view(request):
         'current_sub_genre': sub_genre_filter,
         'read_book_ids': read_book_ids,
         'viewing_new_this_week': bool(request.GET.get('new_this_week')),
+        'also_loved_lists': also_loved_lists,
     }
     return render(request, 'recommendations.html', context)
 
@@ -842,18 +675,34 @@ def feedback_submit(request):
 
     return JsonResponse({"ok": False, "errors": form.errors}, status=400)
 
+
+@never_cache
+@require_GET
+def csrf_token_view(request):
+    """The visitor's CSRF token, fetched by forms on pages served from the shared page cache."""
+    return JsonResponse({"token": get_token(request)})
+
+@cache_public_page()
 def terms_of_use_view(request):
     """Terms of Use page"""
     return render(request, 'terms_of_use.html')
 
+@cache_public_page()
 def privacy_policy_view(request):
     """Privacy Policy page"""
     return render(request, 'privacy_policy.html')
 
+@hot_query('my_books.favorites', lambda sample: {'user_id': sample.user_id})
+def my_favorites(user_id):
+    """A reader's favorites with their books and authors, newest first."""
+    return UserFavoriteBook.objects.filter(user_id=user_id).select_related('book__author').order_by('-created_at')
+
+
+@query_budget(5)
 def my_books_view(request):
     if request.user.is_authenticated:
         # Fetch user's favorite books ordered by newest first
-        user_favorites = UserFavoriteBook.objects.filter(user=request.user).order_by('-created_at')
+        user_favorites = my_favorites(request.user.id)
         return render(request, 'my_books.html', {'favorites': user_favorites})
     else:
         # For non-authenticated users, get books from guest user
@@ -861,7 +710,7 @@ def my_books_view(request):
         if guest_user_id:
             try:
                 guest_user = User.objects.get(id=guest_user_id)
-                user_favorites = UserFavoriteBook.objects.filter(user=guest_user).order_by('-created_at')
+                user_favorites = my_favorites(guest_user.id)
                 return render(request, 'my_books.html', {'favorites': user_favorites})
             except User.DoesNotExist:
                 # Guest user doesn't exist, return empty list
@@ -871,6 +720,13 @@ def my_books_view(request):
             return render(request, 'my_books.html', {'favorites': []})
 
 
+@hot_query('tbr.items', lambda sample: {'user_id': sample.user_id})
+def tbr_items(user_id):
+    """A reader's To Be Read list with books and authors, newest first."""
+    return ToBeReadBook.objects.filter(user_id=user_id).select_related("book", "book__author").order_by("-created_at")
+
+
+@query_budget(5)
 @login_required
 def tbr_list_view(request):
     """Display and manage the user's To Be Read (TBR) list."""
@@ -914,12 +770,7 @@ def tbr_list_view(request):
 
         return redirect("tbr_list")
 
-    tbr_items = (
-        ToBeReadBook.objects.filter(user=request.user)
-        .select_related("book", "book__author")
-        .order_by("-created_at")
-    )
-    return render(request, "tbr_list.html", {"tbr_items": tbr_items})
+    return render(request, "tbr_list.html", {"tbr_items": tbr_items(request.user.id)})
 
 
 @login_required
@@ -1019,14 +870,16 @@ def forgot_username_view(request):
             
             try:
                 from_email = settings.DEFAULT_FROM_EMAIL
-                send_mail(
-                    subject,
-                    plain_message,
-                    from_email,
-                    [email],
-                    html_message=html_message,
-                    fail_silently=False,
-                )
+                with timed_stage('email'):
+                    send_mail(
+                        subject,
+                        plain_message,
+                        from_email,
+                        [email],
+                        html_message=html_message,
+                        fail_silently=False,
+                    )
+                EMAILS_SENT.inc(kind='forgot_username')
                 messages.success(request, 'An email with your username(s) has been sent to your email address.')
                 return render(request, 'registration/forgot_username_done.html')
             except Exception as e:
@@ -1077,14 +930,16 @@ def password_reset_view(request):
                     
                     try:
                         from_email = settings.DEFAULT_FROM_EMAIL
-                        send_mail(
-                            subject,
-                            plain_message,
-                            from_email,
-                            [email],
-                            html_message=html_message,
-                            fail_silently=False,
-                        )
+                        with timed_stage('email'):
+                            send_mail(
+                                subject,
+                                plain_message,
+                                from_email,
+                                [email],
+                                html_message=html_message,
+                                fail_silently=False,
+                            )
+                        EMAILS_SENT.inc(kind='password_reset')
                     except Exception as e:
                         # Include the from email in error message for debugging
                         messages.error(request, f'Error sending email from {settings.DEFAULT_FROM_EMAIL}: {str(e)}. Please check that this email address is verified in SendGrid.')
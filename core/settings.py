@@ -63,10 +63,13 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # For static files in production
+    'books.middleware.RequestMetricsMiddleware',  # Request latency for /metrics
+    'books.middleware.ServerTimingMiddleware',  # Server-Timing header and slow-request log
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'books.middleware.ProfilingMiddleware',  # Staff-only ?_profile=1, saved as ProfileRun
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,7 +78,8 @@ ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates with rendering timed for the Server-Timing header
+        'BACKEND': 'books.timing.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -84,6 +88,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'books.context_processors.page_cache',
             ],
         },
     },
@@ -215,6 +220,79 @@ else:
 # e.g. SITE_BASE_URL = "https://www.greatmindsreadalike.org"
 SITE_BASE_URL = os.environ.get('SITE_BASE_URL', '')
 
+# Set to True to queue the "new recommendations" emails for send_recommendation_emails
+# instead of sending them while saving favorites. Only do so once something runs that
+# command (a worker service or cron); the default image runs just the web server.
+RECOMMENDATION_EMAILS_DEFERRED = os.environ.get('RECOMMENDATION_EMAILS_DEFERRED', 'False') == 'True'
+
+# Minimum seconds between homepage statistics refreshes triggered by favorite writes
+# (writes inside the window only mark the snapshot stale for refresh_site_stats --if-stale)
+SITE_STATS_DEBOUNCE_SECONDS = int(os.environ.get('SITE_STATS_DEBOUNCE_SECONDS', 60))
+
+# Rendered public pages (homepage, How It Works, terms, privacy) are cached for anonymous
+# visitors for this many seconds, here and (s-maxage) in any CDN or reverse proxy in front;
+# browsers may keep their own copy for the max-age below
+PUBLIC_PAGE_CACHE_TIMEOUT = int(os.environ.get('PUBLIC_PAGE_CACHE_TIMEOUT', 300))
+PUBLIC_PAGE_BROWSER_MAX_AGE = int(os.environ.get('PUBLIC_PAGE_BROWSER_MAX_AGE', 60))
+
+# Directory holding the memory-mapped recommendation graph built by build_recommendation_graph
+# (empty: compute recommendations from the database). Workers check for a new generation
+# at most every RECOMMENDATION_GRAPH_CHECK_SECONDS.
+RECOMMENDATION_GRAPH_DIR = os.environ.get('RECOMMENDATION_GRAPH_DIR', '')
+RECOMMENDATION_GRAPH_CHECK_SECONDS = int(os.environ.get('RECOMMENDATION_GRAPH_CHECK_SECONDS', 30))
+
+# How many most-similar readers to keep per reader in the UserNeighbor table
+# (run rebuild_user_neighbors after changing it)
+USER_NEIGHBORS_K = int(os.environ.get('USER_NEIGHBORS_K', 50))
+
+# How neighbor lists find similar readers: 'exact' compares against every reader sharing a
+# favorite; 'minhash' only re-ranks readers whose MinHash signatures share an LSH band.
+# Run rebuild_minhash_signatures before switching to 'minhash' or changing the sizes below.
+RECOMMENDATION_ENGINE = os.environ.get('RECOMMENDATION_ENGINE', 'exact')
+MINHASH_PERMUTATIONS = int(os.environ.get('MINHASH_PERMUTATIONS', 64))
+MINHASH_BANDS = int(os.environ.get('MINHASH_BANDS', 32))
+
+# How similar readers are ranked: 'overlap', 'jaccard', 'cosine' or 'idf' (see books/scoring.py).
+# The strategy also picks who fills the USER_NEIGHBORS_K slots, so run rebuild_user_neighbors
+# after changing it.
+# Neighbors scoring below the strategy's threshold are ignored; RECOMMENDATION_MIN_SCORE
+# overrides the default threshold of the selected strategy.
+RECOMMENDATION_SCORING = os.environ.get('RECOMMENDATION_SCORING', 'overlap')
+RECOMMENDATION_SCORE_THRESHOLDS = {}
+if os.environ.get('RECOMMENDATION_MIN_SCORE'):
+    RECOMMENDATION_SCORE_THRESHOLDS[RECOMMENDATION_SCORING] = float(os.environ['RECOMMENDATION_MIN_SCORE'])
+
+# Views declare the most queries they may run (books/query_budget.py). When enforced, going
+# over budget raises with the offending SQL; otherwise it is only logged.
+QUERY_BUDGETS_ENFORCED = os.environ.get('QUERY_BUDGETS_ENFORCED', 'False') == 'True'
+
+# Per-request timing by stage (books/middleware.py): a Server-Timing header on responses
+# to staff (to everyone with SERVER_TIMING_PUBLIC), and a JSON record on the
+# books.slow_requests logger for any request slower than SLOW_REQUEST_MS, with the
+# SLOW_REQUEST_TOP_SQL slowest statements
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'True') == 'True'
+SERVER_TIMING_PUBLIC = os.environ.get('SERVER_TIMING_PUBLIC', 'False') == 'True'
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 1000))
+SLOW_REQUEST_TOP_SQL = int(os.environ.get('SLOW_REQUEST_TOP_SQL', 5))
+
+# Metrics (books/metrics.py) are written by each process to METRICS_DIR at most every
+# METRICS_FLUSH_SECONDS and merged by the staff-only /metrics endpoint. Every worker
+# must see the same directory (default: books-metrics under the system temp dir).
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = int(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+
+# On-demand profiling (books.profiling): staff add ?_profile=1 to a URL and the
+# request is saved as a ProfileRun, downloadable from the admin.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'True') == 'True'
+PROFILE_RATE_LIMIT_PER_HOUR = int(os.environ.get('PROFILE_RATE_LIMIT_PER_HOUR', 10))
+# Profiles larger than this keep only their text summary
+PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES', 5 * 1024 * 1024))
+PROFILE_MAX_QUERIES = int(os.environ.get('PROFILE_MAX_QUERIES', 1000))
+PROFILE_RUNS_KEEP = int(os.environ.get('PROFILE_RUNS_KEEP', 100))
+
+# Google Books volumes endpoint; the loadtest command points this at its local stand-in
+GOOGLE_BOOKS_API_URL = os.environ.get('GOOGLE_BOOKS_API_URL', 'https://www.googleapis.com/books/v1/volumes')
+
 # Cache configuration for Google Books API responses
 # Using local memory cache (fast, but not shared across processes)
 # For production, consider Redis: pip install django-redis
@@ -0,0 +1,150 @@
+"""
+Gunicorn configuration, driven by environment variables.
+
+    gunicorn core.wsgi:application -c gunicorn.conf.py
+
+GUNICORN_WORKER_CLASS   gthread (default), sync, gevent or eventlet. Async classes
+                        need their package installed; without it gthread is used.
+GUNICORN_WORKERS        Worker processes (also WEB_CONCURRENCY). Default: 2 * CPUs + 1,
+                        capped by what fits in memory (see below).
+GUNICORN_THREADS        Threads per gthread worker (default: 4), so a slow Google
+                        Books call or email send doesn't hold a whole worker.
+GUNICORN_WORKER_MEMORY_MB    Expected memory per worker (default: 120; measured
+                        with `manage.py loadtest --server-pid`, see RAILWAY_DEPLOYMENT.md)
+GUNICORN_MEMORY_RESERVE_MB   Memory kept free for the master and the OS (default: 128)
+GUNICORN_PRELOAD        Load the app once in the master (default: True)
+GUNICORN_MAX_REQUESTS   Recycle a worker after this many requests (default: 1000),
+                        plus up to GUNICORN_MAX_REQUESTS_JITTER (default: 100)
+GUNICORN_TIMEOUT        Seconds before a silent worker is restarted (default: 30)
+GUNICORN_KEEPALIVE      Seconds to keep idle client connections open (default: 5)
+GUNICORN_LOG_LEVEL      Default: info
+
+With preload the app and its imports live in the master, and workers share those
+pages copy-on-write. gc.freeze() before forking moves the preloaded objects out of
+the collector's reach, so collections in the workers don't write to (and so copy)
+the shared pages.
+"""
+import gc
+import importlib.util
+import json
+import os
+
+from gunicorn import glogging
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _cpu_count():
+    # A container's CPU quota (cgroup v2), else the CPUs this process may run on
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _memory_mb():
+    # A container's memory limit (cgroup v2, then v1), else physical memory
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 2 ** 60:
+            return int(value) // (1024 * 1024)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _workers():
+    configured = _env_int('GUNICORN_WORKERS', _env_int('WEB_CONCURRENCY', 0))
+    if configured:
+        return configured
+    by_cpu = 2 * _cpu_count() + 1
+    memory = _memory_mb()
+    if memory is None:
+        return by_cpu
+    per_worker = _env_int('GUNICORN_WORKER_MEMORY_MB', 120)
+    by_memory = (memory - _env_int('GUNICORN_MEMORY_RESERVE_MB', 128)) // per_worker
+    return max(1, min(by_cpu, by_memory))
+
+
+def _worker_class():
+    name = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+    if name in ('gevent', 'eventlet') and importlib.util.find_spec(name) is None:
+        print(f"GUNICORN_WORKER_CLASS={name} but {name} is not installed; using gthread")
+        return 'gthread'
+    return name
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = _worker_class()
+workers = _workers()
+threads = _env_int('GUNICORN_THREADS', 4) if worker_class == 'gthread' else 1
+if worker_class in ('gevent', 'eventlet'):
+    worker_connections = _env_int('GUNICORN_WORKER_CONNECTIONS', 100)
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True') == 'True'
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+capture_output = True
+
+
+class JsonAccessLogger(glogging.Logger):
+    """Writes each access log line as one JSON object."""
+
+    def access(self, resp, req, environ, request_time):
+        if not self.cfg.accesslog:
+            return
+        atoms = self.atoms(resp, req, environ, request_time)
+        record = {
+            'remote_addr': atoms['h'],
+            'forwarded_for': environ.get('HTTP_X_FORWARDED_FOR', ''),
+            'method': atoms['m'],
+            'path': atoms['U'],
+            'query': atoms['q'],
+            'status': int(atoms['s']) if str(atoms['s']).isdigit() else atoms['s'],
+            'bytes': atoms['B'],
+            'duration_ms': round(request_time.total_seconds() * 1000, 1),
+            'referer': atoms['f'],
+            'user_agent': atoms['a'],
+            'pid': os.getpid(),
+        }
+        self.access_log.info(json.dumps(record))
+
+
+logger_class = JsonAccessLogger
+
+
+def when_ready(server):
+    # The app is loaded (preload) and workers are about to fork: drop connections
+    # opened while loading, then freeze what's been allocated so far
+    if preload_app:
+        from django.db import connections
+
+        connections.close_all()
+        gc.collect()
+        gc.freeze()
+    server.log.info(
+        f"{workers} {worker_class} workers x {threads} threads, preload={preload_app}, "
+        f"max_requests={max_requests}+{max_requests_jitter}"
+    )
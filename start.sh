@@ -9,34 +9,18 @@ echo "PORT variable: ${PORT}"
 echo "Working directory: $(pwd)"
 echo "Python path: $(which python)"
 
-# Check if migrations are needed (Railway might run them separately)
-echo "=== Checking database connection ==="
-python manage.py check --database default || echo "Database check failed, continuing..."
-
-# Run migrations (idempotent, safe to run multiple times)
-echo "=== Running migrations ==="
-python manage.py migrate --noinput || {
-    echo "=== Migration failed, but continuing ==="
+# Migrate and collect static files only if something changed since the last
+# boot; replicas take turns on migrations (see books/management/commands/boot.py)
+echo "=== Boot: migrations and static files ==="
+python manage.py boot || {
+    echo "=== Boot failed, but continuing ==="
 }
 
-echo "=== Migrations step complete ==="
-
-# Collect static files
-echo "=== Collecting static files ==="
-python manage.py collectstatic --noinput || {
-    echo "=== Static files collection failed, continuing ==="
-}
+echo "=== Boot step complete ==="
 
 echo "=== Starting Gunicorn ==="
-echo "Command: gunicorn core.wsgi:application --bind 0.0.0.0:${PORT:-8000}"
-
-# Start Gunicorn - use exec to replace shell process
-exec gunicorn core.wsgi:application \
-    --bind 0.0.0.0:${PORT:-8000} \
-    --workers 2 \
-    --timeout 120 \
-    --access-logfile - \
-    --error-logfile - \
-    --log-level debug \
-    --capture-output
+echo "Command: gunicorn core.wsgi:application -c gunicorn.conf.py (bind 0.0.0.0:${PORT:-8000})"
 
+# Start Gunicorn - use exec to replace shell process. Workers, threads, preload,
+# timeouts and logging come from gunicorn.conf.py (GUNICORN_* environment variables)
+exec gunicorn core.wsgi:application -c gunicorn.conf.py